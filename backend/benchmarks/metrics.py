@@ -0,0 +1,62 @@
+"""
+Per-request cost of the metrics middleware (users/metrics.py): the
+``begin``/``end`` pair around a request, with a resolved route and a
+non-streaming response, and the per-query wrapper.
+
+    python benchmarks/metrics.py --iterations 200000
+
+Timed with ``time.process_time``; no database or HTTP involved.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from wsgi_vs_asgi import setup_django
+
+
+def per_call(fn, iterations):
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, "bench.sqlite3"), users=1)
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from django.urls import resolve
+
+        from users import metrics
+
+        request = RequestFactory().get("/api/users/1/")
+        request.resolver_match = resolve("/api/users/1/")
+        response = HttpResponse(b"{}" * 100, content_type="application/json")
+
+        def request_cycle():
+            metrics.end(metrics.begin(), request, response)
+
+        def query():
+            return None
+
+        def wrapped_query():
+            metrics._count_queries(lambda *a: None, "SELECT 1", (), False, {})
+
+        state = metrics.begin()
+        baseline = per_call(query, args.iterations)
+        wrapped = per_call(wrapped_query, args.iterations)
+        metrics.end(state, request, response)
+        cycle = per_call(request_cycle, args.iterations)
+
+    print(f"begin/end per request: {cycle:.2f} us")
+    print(f"query wrapper overhead: {wrapped - baseline:.2f} us per query")
+
+
+if __name__ == "__main__":
+    main()
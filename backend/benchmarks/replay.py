@@ -0,0 +1,359 @@
+"""
+Replay captured traffic (TRAFFIC_CAPTURE_PATH, see users/capture.py) against
+the application and report throughput, latency percentiles and errors per
+route.
+
+    python benchmarks/replay.py captures/traffic.jsonl --target wsgi --concurrency 16
+    python benchmarks/replay.py captures/traffic.jsonl --target asgi --speed 1
+    python benchmarks/replay.py captures/traffic.jsonl --target http://staging:8000 --rate 200
+
+--target wsgi / asgi load config.wsgi / config.asgi in this process, with
+the settings (and database) DJANGO_SETTINGS_MODULE points at; a URL sends
+the requests over HTTP instead, one keep-alive connection per worker.
+
+Requests are issued by --concurrency workers (threads; asyncio tasks for
+asgi) in capture order. By default each worker sends its next request as
+soon as the previous one is answered. --rate paces the starts at N requests
+per second overall; --speed keeps the captured gaps between requests,
+divided by the factor (2 = twice as fast). A request that cannot start on
+time because every worker is busy starts late, and its wait is not part of
+its latency; "late" counts them.
+
+Errors are 5xx responses and failed requests; 4xx are reported apart, as
+are responses whose status differs from the captured one (expected when
+the data replayed against differs). Redacted values are sent as captured:
+for instance password updates come back 400 after checking the password.
+Pass the real credential for redacted Authorization headers with
+--authorization.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+REDACTED = "[redacted]"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+BOUNDARY = "replay-boundary"
+
+
+def load(path, limit=0):
+    records = []
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                records.append(json.loads(line))
+                if limit and len(records) == limit:
+                    break
+    return records
+
+
+def build_request(record, authorization=""):
+    """``(method, path_with_query, headers, body)`` reproducing a capture record."""
+    headers = {}
+    for name, value in record["headers"].items():
+        if value == REDACTED:
+            if name == "authorization" and authorization:
+                headers[name] = authorization
+            continue
+        headers[name] = value
+
+    body = b""
+    if record.get("files"):
+        # Uploads are replayed as PNG-signed files of the captured size
+        parts = []
+        for field, size in record["files"].items():
+            content = PNG_SIGNATURE + bytes(max(size - len(PNG_SIGNATURE), 0))
+            parts.append(
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; '
+                f'filename="{field}.png"\r\nContent-Type: image/png\r\n\r\n'.encode()
+                + content
+                + b"\r\n"
+            )
+        body = b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+        headers["content-type"] = f"multipart/form-data; boundary={BOUNDARY}"
+    elif record.get("body") is not None:
+        body = json.dumps(record["body"]).encode()
+    elif record.get("request_bytes") and record["method"] not in ("GET", "HEAD"):
+        # Body not captured (too large or not JSON): send as many bytes
+        body = bytes(record["request_bytes"])
+
+    path = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    return record["method"], path, headers, body
+
+
+def schedule(records, rate=0.0, speed=0.0):
+    """Start offsets (seconds from the start of the run), or None to not pace."""
+    if rate:
+        return [index / rate for index in range(len(records))]
+    if speed:
+        first = records[0]["ts"] if records else 0
+        return [(record["ts"] - first) / speed for record in records]
+    return None
+
+
+class WSGITransport:
+    def __init__(self):
+        from config.wsgi import application
+
+        self.app = application
+
+    def __call__(self, method, path, headers, body):
+        path_info, _, query = path.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path_info,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": BytesIO(body),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace("-", "_")
+            if key != "CONTENT_TYPE":
+                key = f"HTTP_{key}"
+            environ[key] = value
+        status = []
+        result = self.app(environ, lambda s, response_headers, exc_info=None: status.append(s))
+        try:
+            for _ in result:
+                pass
+        finally:
+            getattr(result, "close", lambda: None)()
+        return int(status[0].split()[0])
+
+
+class HTTPTransport:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.local = threading.local()
+
+    def __call__(self, method, path, headers, body):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.netloc, timeout=30)
+        try:
+            connection.request(method, self.prefix + path, body=body or None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+
+
+def run_threads(transport, requests, offsets, concurrency):
+    """
+    Run with a thread pool. Returns ``([(index, status, seconds, late)], elapsed)``;
+    ``status`` is None for a failed request.
+    """
+    started = time.perf_counter()
+
+    def call(index):
+        method, path, headers, body = requests[index]
+        late = False
+        if offsets is not None:
+            delay = started + offsets[index] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late = delay < -0.001
+        begin = time.perf_counter()
+        try:
+            status = transport(method, path, headers, body)
+        except Exception:
+            status = None
+        return index, status, time.perf_counter() - begin, late
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, range(len(requests))))
+    return results, time.perf_counter() - started
+
+
+def run_asgi(requests, offsets, concurrency):
+    from config.asgi import application
+
+    async def call(method, path, headers, body):
+        path_info, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path_info,
+            "raw_path": path_info.encode(),
+            "query_string": query.encode(),
+            "headers": [(b"host", b"localhost"), (b"content-length", str(len(body)).encode())]
+            + [(name.encode(), value.encode()) for name, value in headers.items()],
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client stays connected; Django cancels this once it responds
+            await asyncio.Future()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await application(scope, receive, send)
+        return status[0]
+
+    async def main():
+        loop_started = time.perf_counter()
+        pending = list(range(len(requests) - 1, -1, -1))
+        results = []
+
+        async def worker():
+            while pending:
+                index = pending.pop()
+                late = False
+                if offsets is not None:
+                    delay = loop_started + offsets[index] - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        late = delay < -0.001
+                begin = time.perf_counter()
+                try:
+                    status = await call(*requests[index])
+                except Exception:
+                    status = None
+                results.append((index, status, time.perf_counter() - begin, late))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results, time.perf_counter() - loop_started
+
+    return asyncio.run(main())
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(records, results, elapsed):
+    """Per-route rows (plus a "TOTAL" row) of the report."""
+    by_route = defaultdict(list)
+    for index, status, seconds, late in results:
+        record = records[index]
+        route = record.get("route") or record["path"]
+        by_route[route].append((status, seconds, late, record.get("status")))
+    by_route["TOTAL"] = [item for items in list(by_route.values()) for item in items]
+
+    rows = []
+    for route, items in by_route.items():
+        latencies = sorted(seconds for _, seconds, _, _ in items)
+        errors = sum(1 for status, *_ in items if status is None or status >= 500)
+        rows.append(
+            {
+                "route": route,
+                "requests": len(items),
+                "rps": len(items) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "error_rate": errors / len(items),
+                "client_errors": sum(1 for status, *_ in items if status and 400 <= status < 500),
+                "status_changed": sum(
+                    1 for status, _, _, captured in items if captured and status != captured
+                ),
+                "late": sum(1 for _, _, late, _ in items if late),
+            }
+        )
+    rows.sort(key=lambda row: (row["route"] == "TOTAL", -row["requests"], row["route"]))
+    return rows
+
+
+def print_table(rows):
+    width = max(len("route"), *(len(row["route"]) for row in rows))
+    print(
+        f"{'route':<{width}} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7} {'4xx':>5} {'changed':>7} {'late':>5}"
+    )
+    for row in rows:
+        print(
+            f"{row['route']:<{width}} {row['requests']:>8} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+            f"{row['error_rate']:>7.1%} {row['client_errors']:>5} "
+            f"{row['status_changed']:>7} {row['late']:>5}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("capture", help="JSON lines written by TrafficCaptureMiddleware")
+    parser.add_argument(
+        "--target", default="wsgi", help="wsgi, asgi or a base URL (http://host:port)"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument("--rate", type=float, default=0.0, help="Requests per second overall.")
+    pacing.add_argument("--speed", type=float, default=0.0, help="Replay captured gaps, sped up.")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N records.")
+    parser.add_argument("--authorization", default="", help="Value for redacted Authorization.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON lines.")
+    args = parser.parse_args()
+
+    records = load(args.capture, args.limit)
+    if not records:
+        parser.error(f"No records in {args.capture}")
+    requests = [build_request(record, args.authorization) for record in records]
+    offsets = schedule(records, args.rate, args.speed)
+
+    if args.target in ("wsgi", "asgi"):
+        sys.path.insert(0, str(BACKEND_DIR))
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+        if args.target == "asgi":
+            # As config.asgi does; set before the settings are loaded below
+            os.environ.setdefault("USERS_ASYNC_VIEWS", "1")
+        from django.conf import settings
+
+        # Replayed requests are not captured again
+        settings.TRAFFIC_CAPTURE_PATH = ""
+    if args.target == "asgi":
+        results, elapsed = run_asgi(requests, offsets, args.concurrency)
+    else:
+        transport = WSGITransport() if args.target == "wsgi" else HTTPTransport(args.target)
+        results, elapsed = run_threads(transport, requests, offsets, args.concurrency)
+
+    rows = summarize(records, results, elapsed)
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
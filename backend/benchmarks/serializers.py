@@ -0,0 +1,141 @@
+"""
+Per-response CPU of payload serialization: the hand-built dicts and
+``django.http.JsonResponse`` the views used before, against the compiled
+serializers (users/serializers.py) and users/renderers.py.
+
+    python benchmarks/serializers.py --iterations 2000 --bulk-users 500
+
+The single-user case times serialization and encoding of instances loaded
+once. The bulk case includes the (in-process SQLite) query, since building
+instances is the cost ``.values()`` avoids. Timed with ``time.process_time``.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from wsgi_vs_asgi import setup_django
+
+
+def legacy_user(user):
+    return {
+        "id": user.id,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "profile_picture": user.profile_picture.url if user.profile_picture else None,
+    }
+
+
+def legacy_notifications(settings):
+    return {
+        "user_id": settings.user_id,
+        "push_messages": settings.push_messages,
+        "push_comments": settings.push_comments,
+        "push_reminders": settings.push_reminders,
+        "email_news": settings.email_news,
+        "email_messages": settings.email_messages,
+        "email_reminders": settings.email_reminders,
+    }
+
+
+def legacy_theme(settings):
+    return {
+        "user_id": settings.user_id,
+        "skin": settings.skin,
+        "primary_color": settings.primary_color,
+        "font_family": settings.font_family,
+    }
+
+
+def legacy_privacy(settings):
+    return {
+        "user_id": settings.user_id,
+        "profile_visibility": settings.profile_visibility,
+        "show_email": settings.show_email,
+        "data_sharing": settings.data_sharing,
+    }
+
+
+def per_call_us(fn, iterations):
+    fn()  # warm-up (compiles row serializers)
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--bulk-users", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        user_ids = setup_django(os.path.join(tmp, "bench.sqlite3"), args.bulk_users)
+
+        from django.http import JsonResponse as DjangoJsonResponse
+        from users import renderers
+        from users.models import User, UserNotificationSettings, UserPrivacySettings, UserThemeSettings
+        from users.serializers import (
+            serialize_notification_settings,
+            serialize_privacy_settings,
+            serialize_theme_settings,
+            serialize_user,
+        )
+        from users.services import SETTINGS_RELATIONS, iter_bulk_preferences, settings_or_defaults
+
+        for model in (UserNotificationSettings, UserThemeSettings, UserPrivacySettings):
+            model.objects.bulk_create(model(user_id=pk) for pk in user_ids)
+        related = [related_name for related_name, _ in SETTINGS_RELATIONS]
+        user = User.objects.select_related(*related).get(pk=user_ids[0])
+        notifications, theme, privacy = settings_or_defaults(user)
+
+        def legacy_preferences():
+            return DjangoJsonResponse({
+                "user": legacy_user(user),
+                "notifications": legacy_notifications(notifications),
+                "theme": legacy_theme(theme),
+                "privacy": legacy_privacy(privacy),
+            })
+
+        def compiled_preferences():
+            return renderers.JsonResponse({
+                "user": serialize_user(user),
+                "notifications": serialize_notification_settings(notifications),
+                "theme": serialize_theme_settings(theme),
+                "privacy": serialize_privacy_settings(privacy),
+            })
+
+        # Both bulk cases include their query: instances vs .values() rows
+        def legacy_bulk():
+            results = {}
+            for item in User.objects.select_related(*related).filter(pk__in=user_ids):
+                groups = settings_or_defaults(item)
+                results[str(item.pk)] = {
+                    "notifications": legacy_notifications(groups[0]),
+                    "theme": legacy_theme(groups[1]),
+                    "privacy": legacy_privacy(groups[2]),
+                }
+            return DjangoJsonResponse({"results": results, "missing": []})
+
+        def compiled_bulk():
+            results = {str(pk): prefs for pk, prefs in iter_bulk_preferences(user_ids)}
+            return renderers.JsonResponse({"results": results, "missing": []})
+
+        bulk_iterations = max(args.iterations // 100, 5)
+        rows = [
+            ("preferences", per_call_us(legacy_preferences, args.iterations),
+             per_call_us(compiled_preferences, args.iterations)),
+            (f"bulk x{args.bulk_users}", per_call_us(legacy_bulk, bulk_iterations),
+             per_call_us(compiled_bulk, bulk_iterations)),
+        ]
+
+    print(f"JSON backend: {renderers.backend()}")
+    print(f"{'response':<14} {'before us':>11} {'after us':>11} {'speedup':>8}")
+    for name, before, after in rows:
+        print(f"{name:<14} {before:>11.1f} {after:>11.1f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Compare WSGI (sync views) and ASGI (users.async_views) throughput and tail
+latency under concurrent load, in-process and without a network in between.
+
+    python benchmarks/wsgi_vs_asgi.py --requests 5000 --concurrency 32 --users 1000
+
+Each mode runs in its own subprocess against a fresh temporary SQLite
+database, so both see identical data. WSGI requests are issued from a thread
+pool of --concurrency workers; ASGI requests from --concurrency asyncio tasks
+on one event loop. --writes is the fraction of requests that are settings
+updates instead of reads.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+READ_PATHS = [
+    "/api/users/{pk}/",
+    "/api/users/{pk}/notifications/",
+    "/api/users/{pk}/theme/",
+    "/api/users/{pk}/privacy/",
+    "/api/users/{pk}/preferences/",
+]
+WRITE_PATH = "/api/users/{pk}/notifications/update/"
+
+
+def setup_django(db_path, users):
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["*"]
+    django.setup()
+
+    from django.core.management import call_command
+    from users.models import User
+
+    call_command("migrate", verbosity=0)
+    User.objects.bulk_create(
+        User(email=f"bench{i}@example.com", first_name="Bench", last_name=str(i))
+        for i in range(users)
+    )
+    return list(User.objects.values_list("pk", flat=True))
+
+
+def make_plan(user_ids, count, writes, seed):
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(count):
+        pk = rng.choice(user_ids)
+        if rng.random() < writes:
+            body = json.dumps({"email_news": rng.random() < 0.5}).encode()
+            plan.append(("PUT", WRITE_PATH.format(pk=pk), body))
+        else:
+            plan.append(("GET", rng.choice(READ_PATHS).format(pk=pk), b""))
+    return plan
+
+
+def run_wsgi(plan, concurrency):
+    from io import BytesIO
+    from django.core.wsgi import get_wsgi_application
+
+    app = get_wsgi_application()
+
+    def call(item):
+        method, path, body = item
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": BytesIO(body),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+        }
+        status = []
+        started = time.perf_counter()
+        result = app(environ, lambda s, headers, exc_info=None: status.append(s))
+        b"".join(result)
+        getattr(result, "close", lambda: None)()
+        return time.perf_counter() - started, int(status[0].split()[0])
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(call, plan))
+
+
+def run_asgi(plan, concurrency):
+    from django.core.asgi import get_asgi_application
+
+    app = get_asgi_application()
+
+    async def call(item):
+        method, path, body = item
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client stays connected; Django cancels this once it responds
+            await asyncio.Future()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        return time.perf_counter() - started, status[0]
+
+    async def main():
+        queue = list(reversed(plan))
+        results = []
+
+        async def worker():
+            while queue:
+                results.append(await call(queue.pop()))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results
+
+    return asyncio.run(main())
+
+
+def summarize(mode, results, elapsed):
+    latencies = sorted(latency for latency, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100)
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        "mode": mode,
+        "requests": len(results),
+        "rps": len(results) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "errors": errors,
+    }
+
+
+def run_mode(args):
+    if args.mode == "asgi":
+        os.environ["USERS_ASYNC_VIEWS"] = "1"
+    with tempfile.TemporaryDirectory() as tmp:
+        user_ids = setup_django(os.path.join(tmp, "bench.sqlite3"), args.users)
+        plan = make_plan(user_ids, args.requests, args.writes, args.seed)
+        runner = run_asgi if args.mode == "asgi" else run_wsgi
+        runner(plan[: min(len(plan), 200)], args.concurrency)  # warm-up
+        started = time.perf_counter()
+        results = runner(plan, args.concurrency)
+        print(json.dumps(summarize(args.mode, results, time.perf_counter() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mode", choices=["wsgi", "asgi", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--writes", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode != "both":
+        run_mode(args)
+        return
+
+    print(f"{'mode':<6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in ("wsgi", "asgi"):
+        argv = [sys.executable, __file__, "--mode", mode] + [
+            f"--{name}={getattr(args, name)}"
+            for name in ("requests", "concurrency", "users", "writes", "seed")
+        ]
+        output = subprocess.run(argv, check=True, capture_output=True, text=True).stdout
+        row = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{row['mode']:<6} {row['rps']:>9.0f} {row['p50_ms']:>8.2f} "
+            f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
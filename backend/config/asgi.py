@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Serve the native async views (users.async_views) under ASGI
+os.environ.setdefault('USERS_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,14 +36,34 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
+    # First: preflights are answered before anything else runs
     'users.middleware.SimpleCORSMiddleware',
+    'users.middleware.MetricsMiddleware',
+    'users.middleware.TrafficCaptureMiddleware',
+    'users.middleware.CompressionMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'users.middleware.ThrottleMiddleware',
+    'users.middleware.ReplicaRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
 
+# CORS (users/middleware.py). Empty CORS_ALLOWED_ORIGINS allows any origin
+# (development); in production list the frontend origins, e.g.
+# CORS_ALLOWED_ORIGINS="https://app.example.com,https://*.example.com".
+# Browsers reuse a preflight for CORS_PREFLIGHT_MAX_AGE seconds (Chromium
+# caps this at 7200).
+CORS_ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get('CORS_ALLOWED_ORIGINS', '').split(',')
+    if origin.strip()
+]
+CORS_PREFLIGHT_MAX_AGE = 7200
+CORS_ALLOW_HEADERS = ('Content-Type', 'Authorization', 'If-Match', 'If-None-Match')
+CORS_EXPOSE_HEADERS = ('ETag', 'Retry-After', 'X-Export-Cursor')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -58,6 +79,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Route /api/users/ to users.async_views instead of users.views.
+# config/asgi.py turns this on; under WSGI the sync views are used.
+USERS_ASYNC_VIEWS = os.environ.get('USERS_ASYNC_VIEWS', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -69,6 +94,86 @@ DATABASES = {
     }
 }
 
+# Read replicas (users/routers.py): reads go to the DATABASE_REPLICAS aliases,
+# writes to 'default'. After a write, reads of that user stay on 'default' for
+# REPLICA_PIN_SECONDS; pins are kept in REPLICA_PIN_CACHE, which must be
+# shared between worker processes in production.
+# DATABASE_REPLICA_PATHS adds comma-separated SQLite files (e.g. copied
+# snapshots) as replicas.
+for index, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_PATHS', '').split(','))):
+    DATABASES[f'replica{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['users.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_CACHE = 'default'
+
+
+# Caches
+# The "preferences" cache fronts User and the settings models (see users/cache.py).
+# Swap its BACKEND for FileBasedCache/Redis to share it between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'preferences': {
+        'BACKEND': 'users.cache.LRUCache',
+        'LOCATION': 'preferences',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+PREFERENCES_CACHE = 'preferences'
+
+
+# JSON encoder for API responses (users/renderers.py): 'auto' uses orjson
+# when installed and falls back to the standard library; 'orjson' or 'json'
+# force one.
+JSON_ENCODER = 'auto'
+
+
+# Store boolean preferences as bits of User.preference_flags instead of in
+# the settings tables (users/flags.py). Pack existing users with
+# `manage.py pack_preference_flags`; run it with --unpack before turning
+# this off again.
+COMPACT_PREFERENCE_FLAGS = False
+
+
+# Bearer token required by the admin-only /api/users/export/ endpoint.
+# The endpoint is disabled while this is empty.
+EXPORT_API_TOKEN = ''
+
+
+# Password hashing runs in a process pool (users/hashing.py). Requests are
+# answered with 429 while MAX_PENDING jobs are in flight, or when a job takes
+# longer than TIMEOUT seconds. 0 workers = inline.
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_MAX_PENDING = 8
+PASSWORD_HASHING_TIMEOUT = 30
+
+
+# Token-bucket throttling (users/throttle.py). A request to a route in
+# THROTTLE_COSTS takes that many tokens from the bucket of the user in the URL
+# and from the bucket of the client address; buckets are (capacity, tokens
+# refilled per second). Refused requests get 429 with Retry-After. Buckets
+# are per process unless THROTTLE_CACHE names a cache shared by the workers.
+THROTTLE_COSTS = {
+    'update_password': 10,
+    'update_profile_picture': 5,
+}
+THROTTLE_USER_BUCKET = (30, 0.5)
+THROTTLE_IP_BUCKET = (120, 2.0)
+THROTTLE_CACHE = ''
+THROTTLE_SHARDS = 64
+THROTTLE_MAX_KEYS = 100000
+
 
 # Password validation (not used)
 AUTH_PASSWORD_VALIDATORS = []
@@ -89,3 +194,61 @@ USE_TZ = True
 # Media files (User uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Media is served by users.media.serve. Content-addressed names are cached as
+# immutable; other files for MEDIA_MAX_AGE seconds. MEDIA_ACCEL hands the
+# transfer to a front proxy: 'x-accel-redirect' (nginx, internal location at
+# MEDIA_ACCEL_PREFIX) or 'x-sendfile'.
+MEDIA_MAX_AGE = 3600
+MEDIA_ACCEL = ''
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Profile picture variants (users/thumbnails.py): square edge sizes in px,
+# output format and background worker threads (0 = generate inline).
+THUMBNAIL_SIZES = (40, 80, 160, 320)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_WORKERS = 2
+
+# Write-behind for settings updates (users/writebehind.py): changes are
+# buffered per process and written together WRITE_BEHIND_WINDOW seconds after
+# the first one (0 = write in the request). A buffer holding
+# WRITE_BEHIND_MAX_USERS users is flushed immediately.
+WRITE_BEHIND_WINDOW = 0
+WRITE_BEHIND_MAX_USERS = 1000
+
+# Response compression (users/compression.py, CompressionMiddleware). Codecs
+# in order of preference; 'zstd' and 'br' need the zstandard / brotli
+# packages and are skipped without them. COMPRESSION_LEVEL applies to gzip,
+# deflate and zstd. Compressed GET bodies are cached per ETag, up to
+# COMPRESSION_CACHE_SIZE entries per process (0 = no cache).
+COMPRESSION_CODECS = ('zstd', 'br', 'gzip', 'deflate')
+COMPRESSION_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_CACHE_SIZE = 256
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/plain',
+    'text/html',
+    'image/svg+xml',
+)
+
+# Per-route metrics served at /metrics (users/metrics.py). With METRICS_DIR
+# set, worker processes share their totals through snapshot files written
+# there at most every METRICS_FLUSH_SECONDS; use one directory per host and
+# clear it on deploy. A non-empty METRICS_API_TOKEN is required as a Bearer
+# token to read /metrics.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = 10
+METRICS_API_TOKEN = os.environ.get('METRICS_API_TOKEN', '')
+
+# Traffic capture for load replay (users/capture.py, benchmarks/replay.py).
+# Off while TRAFFIC_CAPTURE_PATH is empty; e.g. captures/traffic.jsonl. A
+# SAMPLE_RATE fraction of requests is appended there, JSON bodies up to
+# MAX_BODY bytes with the values of keys containing a REDACT word replaced.
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH', '')
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', '1'))
+TRAFFIC_CAPTURE_MAX_BODY = 16384
+TRAFFIC_CAPTURE_REDACT = ('password', 'token', 'secret', 'email', 'name')
@@ -1,12 +1,22 @@
 """URL configuration for config project."""
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from users import media, metrics
+
+# Native async views when served over ASGI (see config/asgi.py)
+users_urls = "users.async_urls" if settings.USERS_ASYNC_VIEWS else "users.urls"
 
 urlpatterns = [
-    path("api/users/", include("users.urls")),
+    path("api/users/", include(users_urls)),
+    # Prometheus scrape target (users/metrics.py)
+    path("metrics", metrics.metrics_view, name="metrics"),
+    # Uploaded media, with range and conditional request support (users/media.py)
+    re_path(
+        r"^%s(?P<path>.+)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        media.serve,
+        name="media",
+    ),
 ]
-
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,11 +1,156 @@
+"""
+Seed the database.
+
+    python seed_user.py                         # the demo user only
+    python seed_user.py --users 1000000 --workers 4
+    python seed_user.py --import users.ndjson   # load an export_users dump
+
+Synthetic users get realistic distributions of notification, theme and
+privacy settings (including users who never saved some settings group).
+Rows are written with bulk_create in chunked transactions; generation can be
+spread over worker processes. Throughput is reported in rows/sec.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
 import os
+import random
+import time
 import django
 
+FIRST_NAMES = ["Ava", "Ben", "Chloe", "Dev", "Elena", "Farah", "Gus", "Hana", "Ivan", "Jun"]
+LAST_NAMES = ["Silva", "Perera", "Smith", "Khan", "Garcia", "Nguyen", "Müller", "Rossi"]
 
-def main():
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
-    django.setup()
+# (value, weight) pairs
+SKINS = [("material", 55), ("willow", 15), ("flat", 10), ("compact", 8), ("mini", 7), ("contrast", 5)]
+FONTS = [("system", 70), ("sans", 15), ("serif", 8), ("mono", 7)]
+COLORS = [("#4b7bec", 60), ("#20bf6b", 10), ("#eb3b5a", 10), ("#fa8231", 8), ("#8854d0", 7), ("#2d3436", 5)]
+VISIBILITY = [("public", 55), ("friends", 30), ("private", 15)]
+
+# Probability that a flag is on, and that a user ever saved each settings group
+NOTIFICATION_ON = {
+    "push_messages": 0.85,
+    "push_comments": 0.7,
+    "push_reminders": 0.6,
+    "email_news": 0.35,
+    "email_messages": 0.75,
+    "email_reminders": 0.5,
+}
+HAS_SETTINGS = {"notifications": 0.6, "theme": 0.4, "privacy": 0.3}
+
+
+def _pick(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def generate_chunk(spec):
+    """Generate ``count`` user records starting at ``start_id`` (runs in workers)."""
+    start_id, count, seed = spec
+    rng = random.Random(seed)
+    records = []
+    for user_id in range(start_id, start_id + count):
+        record = {
+            "id": user_id,
+            "email": f"user{user_id}@example.com",
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+        }
+        if rng.random() < HAS_SETTINGS["notifications"]:
+            record["notifications"] = {
+                field: rng.random() < p for field, p in NOTIFICATION_ON.items()
+            }
+        if rng.random() < HAS_SETTINGS["theme"]:
+            record["theme"] = {
+                "skin": _pick(rng, SKINS),
+                "primary_color": _pick(rng, COLORS),
+                "font_family": _pick(rng, FONTS),
+            }
+        if rng.random() < HAS_SETTINGS["privacy"]:
+            record["privacy"] = {
+                "profile_visibility": _pick(rng, VISIBILITY),
+                "show_email": rng.random() < 0.1,
+                "data_sharing": rng.random() < 0.2,
+            }
+        records.append(record)
+    return records
+
+
+def write_chunk(records, password_hash):
+    """Insert one chunk of records in a single transaction; return rows written."""
+    from django.db import transaction
+    from users.models import User, UserNotificationSettings, UserPrivacySettings, UserThemeSettings
+
+    users = [
+        User(
+            id=r["id"],
+            email=r["email"],
+            first_name=r["first_name"],
+            last_name=r["last_name"],
+            password=password_hash,
+        )
+        for r in records
+    ]
+    groups = []
+    for key, model in (
+        ("notifications", UserNotificationSettings),
+        ("theme", UserThemeSettings),
+        ("privacy", UserPrivacySettings),
+    ):
+        groups.append((model, [
+            model(user_id=r["id"], **{k: v for k, v in r[key].items() if k != "user_id"})
+            for r in records
+            if r.get(key)
+        ]))
+
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        for model, rows in groups:
+            model.objects.bulk_create(rows)
+    return len(users) + sum(len(rows) for _, rows in groups)
+
+
+def load(chunks, password_hash):
+    started = time.perf_counter()
+    users = rows = 0
+    for records in chunks:
+        rows += write_chunk(records, password_hash)
+        users += len(records)
+        elapsed = time.perf_counter() - started
+        print(f"{users} users, {rows} rows, {rows / elapsed:.0f} rows/s", flush=True)
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {users} users ({rows} rows) in {elapsed:.1f}s: {rows / max(elapsed, 1e-9):.0f} rows/s")
 
+
+def seed_synthetic(count, batch_size, workers, seed):
+    from django.contrib.auth.hashers import make_password
+    from django.db.models import Max
+    from users.models import User
+
+    # PBKDF2 is far too slow to run per synthetic user; they all share one hash
+    password_hash = make_password("password")
+    start_id = (User.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+    specs = [
+        (start_id + offset, min(batch_size, count - offset), seed + offset)
+        for offset in range(0, count, batch_size)
+    ]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            load(pool.imap(generate_chunk, specs), password_hash)
+    else:
+        load(map(generate_chunk, specs), password_hash)
+
+
+def seed_import(path, batch_size):
+    # Exports carry no password hashes; imported users start without one
+    with open(path, encoding="utf-8") as fh:
+        records = (json.loads(line) for line in fh if line.strip())
+        chunks = iter(lambda: list(itertools.islice(records, batch_size)), [])
+        load(chunks, "")
+
+
+def seed_demo_user():
     from users.models import User, UserNotificationSettings, UserThemeSettings
 
     obj, created = User.objects.get_or_create(
@@ -52,6 +197,25 @@ def main():
         print("Theme settings already exist for user:", obj.email)
 
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--users", type=int, default=0, help="Number of synthetic users to generate.")
+    parser.add_argument("--import", dest="import_path", help="NDJSON file produced by export_users.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Users per transaction.")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used for generation.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for reproducible data.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    django.setup()
+
+    if args.import_path:
+        seed_import(args.import_path, args.batch_size)
+    elif args.users:
+        seed_synthetic(args.users, args.batch_size, args.workers, args.seed)
+    else:
+        seed_demo_user()
+
+
 if __name__ == "__main__":
     main()
-
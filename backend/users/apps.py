@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        import atexit
+
+        from . import metrics, writebehind
+        from .cache import connect_signals
+
+        connect_signals()
+        metrics.install()
+        atexit.register(metrics.shutdown)
+        # Buffered settings changes must not be lost on a clean exit
+        atexit.register(writebehind.shutdown)
@@ -0,0 +1,280 @@
+"""
+Async counterparts of the user/settings views, served when running under
+ASGI (see ``USERS_ASYNC_VIEWS`` in settings and ``config/asgi.py``).
+
+They share parsing, validation and serialization with ``views`` and only
+replace the database access with the async ORM. Endpoints without an async
+version here (bulk reads/writes) are re-exported unchanged and run through
+Django's sync adapter. The export streams from an async generator: ASGI
+would read a sync iterator in full before sending any of it.
+"""
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.http import Http404, HttpResponseBadRequest
+from django.utils import timezone
+
+from . import flags, hashing, thumbnails, writebehind
+from .cache import aread_through
+from .export import aiter_export
+from .models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+    VersionConflict,
+)
+from .renderers import JsonResponse
+from .serializers import (
+    serialize_notification_settings,
+    serialize_privacy_settings,
+    serialize_theme_settings,
+    serialize_user,
+)
+from .services import (
+    SETTINGS_RELATIONS,
+    asettings_or_default,
+    settings_or_defaults,
+)
+from .views import (
+    apply_notification_changes,
+    apply_privacy_changes,
+    apply_theme_changes,
+    apply_user_changes,
+    bad_request,
+    conditional_json_response,
+    etag_for,
+    export_response,
+    if_match_passes,
+    parse_export_request,
+    parse_json_body,
+    parse_password_payload,
+    precondition_failed,
+    too_many_requests,
+    updated_response,
+    uploaded_profile_picture,
+    write_settings,
+)
+# Sync-only endpoints, re-exported so the async URLconf has every view
+from .views import bulk_preferences, bulk_update_preferences  # noqa: F401
+
+
+async def _get_user_or_404(pk):
+    try:
+        return await User.objects.aget(pk=pk)
+    except User.DoesNotExist:
+        raise Http404("User not found")
+
+
+async def _cached_user_or_404(pk):
+    try:
+        return await aread_through(User, pk, lambda: User.objects.aget(pk=pk))
+    except User.DoesNotExist:
+        raise Http404("User not found")
+
+
+async def get_user(request, pk: int):
+    user = await _cached_user_or_404(pk)
+    return conditional_json_response(request, [user], lambda: serialize_user(user))
+
+
+async def update_user(request, pk: int):
+    """Async ``views.update_user``."""
+    if request.method not in ("PUT", "PATCH", "POST"):
+        return bad_request("Unsupported method", code="unsupported_method")
+
+    payload, error = parse_json_body(request)
+    if error:
+        return error
+
+    user = await _get_user_or_404(pk)
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
+    error = apply_user_changes(user, payload)
+    if error:
+        return error
+
+    try:
+        changed = await user.asave_changes()
+    except IntegrityError:
+        return bad_request("Email already in use", code="duplicate_email")
+    except VersionConflict:
+        return precondition_failed()
+
+    return updated_response(serialize_user(user), changed, [user])
+
+
+async def update_profile_picture(request, pk: int):
+    """Async ``views.update_profile_picture``."""
+    if request.method not in ("POST", "PUT", "PATCH"):
+        return bad_request("Unsupported method", code="unsupported_method")
+
+    user = await _get_user_or_404(pk)
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
+    upload = uploaded_profile_picture(request)
+    if upload is None:
+        return bad_request("No file uploaded", code="missing_file")
+    user.profile_picture = upload
+    # The previous picture's variants no longer apply
+    user.profile_picture_variants = {}
+    try:
+        await user.asave_changes()
+    except VersionConflict:
+        return precondition_failed()
+    await sync_to_async(thumbnails.schedule)(user)
+
+    response = JsonResponse(serialize_user(user))
+    response["ETag"] = etag_for([user])
+    return response
+
+
+async def _get_settings(request, pk, model, serialize):
+    user = await _cached_user_or_404(pk)
+    # Defaults without writing a row; the row is created by the first update
+    settings = await aread_through(
+        model, user.pk, lambda: asettings_or_default(model, user), field="user_id"
+    )
+    settings = writebehind.overlay(settings)
+    return conditional_json_response(request, [settings], lambda: serialize(settings))
+
+
+async def _update_settings(request, pk, model, apply_changes, serialize):
+    if request.method not in ("PUT", "PATCH", "POST"):
+        return bad_request("Unsupported method", code="unsupported_method")
+
+    payload, error = parse_json_body(request)
+    if error:
+        return error
+
+    user = await _get_user_or_404(pk)
+    if writebehind.enabled() or flags.enabled():
+        # Buffered and packed writes are made by the sync service layer
+        settings, changed, error = await sync_to_async(write_settings)(
+            request, model, user, apply_changes, payload
+        )
+        if error:
+            return error
+        return updated_response(serialize(settings), changed, [settings])
+
+    # Rows are created by the first update that changes something
+    settings = await asettings_or_default(model, user)
+    if not if_match_passes(request, [settings]):
+        return precondition_failed()
+    apply_changes(settings, payload)
+    if not settings.changed_fields():
+        return updated_response(serialize(settings), [], [settings])
+    try:
+        changed = await settings.asave_changes()
+    except (VersionConflict, IntegrityError):
+        # Row updated, or created, by a concurrent request
+        return precondition_failed()
+
+    return updated_response(serialize(settings), changed, [settings])
+
+
+async def get_notification_settings(request, pk: int):
+    return await _get_settings(
+        request, pk, UserNotificationSettings, serialize_notification_settings
+    )
+
+
+async def update_notification_settings(request, pk: int):
+    return await _update_settings(
+        request,
+        pk,
+        UserNotificationSettings,
+        apply_notification_changes,
+        serialize_notification_settings,
+    )
+
+
+async def get_theme_settings(request, pk: int):
+    return await _get_settings(request, pk, UserThemeSettings, serialize_theme_settings)
+
+
+async def update_theme_settings(request, pk: int):
+    return await _update_settings(
+        request, pk, UserThemeSettings, apply_theme_changes, serialize_theme_settings
+    )
+
+
+async def get_privacy_settings(request, pk: int):
+    return await _get_settings(
+        request, pk, UserPrivacySettings, serialize_privacy_settings
+    )
+
+
+async def update_privacy_settings(request, pk: int):
+    return await _update_settings(
+        request,
+        pk,
+        UserPrivacySettings,
+        apply_privacy_changes,
+        serialize_privacy_settings,
+    )
+
+
+async def update_password(request, pk: int):
+    """Async ``views.update_password``; hashing runs in the worker pool."""
+    if request.method not in ("PUT", "PATCH", "POST"):
+        return HttpResponseBadRequest("Unsupported method")
+
+    current_password, new_password, error = parse_password_payload(request)
+    if error:
+        return error
+
+    user = await _get_user_or_404(pk)
+    if not user.password:
+        return bad_request("No existing password set", code="no_password")
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
+
+    try:
+        job = hashing.change_password(current_password, user.password, new_password)
+        matches, new_encoded = await hashing.aresult(job)
+    except hashing.HashingBusy:
+        return too_many_requests("Password service busy, retry shortly", code="hashing_busy")
+    if not matches:
+        return bad_request("Current password is incorrect", code="incorrect_current_password")
+
+    user.password = new_encoded
+    try:
+        await user.asave_changes()
+    except VersionConflict:
+        return precondition_failed()
+
+    response = JsonResponse({"id": user.id, "message": "Password updated"})
+    response["ETag"] = etag_for([user])
+    return response
+
+
+async def get_preferences(request, pk: int):
+    """Async ``views.get_preferences``."""
+    try:
+        user = await User.objects.select_related(
+            *(related_name for related_name, _ in SETTINGS_RELATIONS)
+        ).aget(pk=pk)
+    except User.DoesNotExist:
+        raise Http404("User not found")
+
+    notifications, theme, privacy = map(writebehind.overlay, settings_or_defaults(user))
+
+    return conditional_json_response(
+        request,
+        [user, notifications, theme, privacy],
+        lambda: {
+            "user": serialize_user(user),
+            "notifications": serialize_notification_settings(notifications),
+            "theme": serialize_theme_settings(theme),
+            "privacy": serialize_privacy_settings(privacy),
+        },
+    )
+
+
+async def export_users(request):
+    """Async ``views.export_users``; pages are fetched as the body is sent."""
+    export_format, since, error = parse_export_request(request)
+    if error:
+        return error
+    cursor = timezone.now()
+    return export_response(aiter_export(export_format, since=since), export_format, cursor)
@@ -0,0 +1,181 @@
+"""
+Read-through cache for users and their preference rows.
+
+Reads go through ``read_through`` which consults the cache configured under
+``settings.PREFERENCES_CACHE`` (an alias in ``settings.CACHES``) before
+hitting the database. Entries are invalidated from ``post_save`` /
+``post_delete`` signals, so every ``save()``/``delete()`` - including the
+ones done by the ``update_*`` views - drops the stale copy. The entry is
+dropped once the transaction commits: dropped earlier, a concurrent read
+could cache the old committed row again for the whole ``TIMEOUT``.
+
+Any Django cache backend can be plugged in: ``LRUCache`` below for a bounded
+in-process cache, or e.g. ``FileBasedCache`` / Redis for a cache shared
+between worker processes. Queryset ``update()`` and ``bulk_update()`` do not
+send signals; callers using them must call ``invalidate`` themselves.
+"""
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+
+class CacheStats:
+    """Per-process hit/miss/eviction counters."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def incr(self, name, delta=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+stats = CacheStats()
+
+
+class LRUCache(LocMemCache):
+    """
+    Bounded in-process LRU cache.
+
+    ``LocMemCache`` already keeps entries in recency order but culls a third
+    of them at once when full; this evicts only the least recently used
+    entry and counts it.
+    """
+
+    def _cull(self):
+        key, _ = self._cache.popitem()
+        del self._expire_info[key]
+        stats.incr("evictions")
+
+    # Pure in-memory operations: no need for BaseCache's thread hand-off
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set(key, value, timeout, version)
+
+
+def get_cache():
+    """Return the configured preference cache, or None when caching is off."""
+    alias = getattr(settings, "PREFERENCES_CACHE", None)
+    if not alias or alias not in settings.CACHES:
+        return None
+    return caches[alias]
+
+
+def cache_key(model, value, field="pk"):
+    return f"{model._meta.label_lower}:{field}:{value}"
+
+
+def read_through(model, value, loader, field="pk"):
+    """
+    Return the cached object for ``model``/``field``/``value``, calling
+    ``loader()`` and caching its result on a miss. Exceptions raised by the
+    loader (e.g. ``DoesNotExist``) propagate and nothing is cached.
+    """
+    cache = get_cache()
+    if cache is None:
+        return loader()
+
+    key = cache_key(model, value, field)
+    obj = cache.get(key)
+    if obj is not None:
+        stats.incr("hits")
+        return obj
+
+    stats.incr("misses")
+    obj = loader()
+    cache.set(key, obj)
+    return obj
+
+
+async def aread_through(model, value, loader, field="pk"):
+    """Async ``read_through``; ``loader()`` must return an awaitable."""
+    cache = get_cache()
+    if cache is None:
+        return await loader()
+
+    key = cache_key(model, value, field)
+    obj = await cache.aget(key)
+    if obj is not None:
+        stats.incr("hits")
+        return obj
+
+    stats.incr("misses")
+    obj = await loader()
+    await cache.aset(key, obj)
+    return obj
+
+
+def invalidate(model, value, field="pk"):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete(cache_key(model, value, field))
+
+
+def invalidate_many(model, values, field="pk"):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_many([cache_key(model, value, field) for value in values])
+
+
+def clear():
+    cache = get_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def _invalidate_user(sender, instance, using=None, **kwargs):
+    pk = instance.pk
+    if instance.preference_flags is None:
+        transaction.on_commit(lambda: invalidate(sender, pk), using=using)
+        return
+    from .services import invalidate_flags
+
+    # Packed settings take their values and updated_at from the user row
+    transaction.on_commit(lambda: invalidate_flags([pk]), using=using)
+
+
+def _invalidate_settings(sender, instance, using=None, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(
+        lambda: invalidate(sender, user_id, field="user_id"), using=using
+    )
+
+
+def connect_signals():
+    from .models import (
+        User,
+        UserNotificationSettings,
+        UserPrivacySettings,
+        UserThemeSettings,
+    )
+
+    for name, signal in (("save", post_save), ("delete", post_delete)):
+        signal.connect(_invalidate_user, sender=User, dispatch_uid=f"cache-{name}-user")
+        for model in (UserNotificationSettings, UserThemeSettings, UserPrivacySettings):
+            signal.connect(
+                _invalidate_settings,
+                sender=model,
+                dispatch_uid=f"cache-{name}-{model._meta.model_name}",
+            )
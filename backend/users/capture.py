@@ -0,0 +1,211 @@
+"""
+Traffic capture for load replay (``middleware.TrafficCaptureMiddleware``,
+replayed by ``benchmarks/replay.py``).
+
+With ``TRAFFIC_CAPTURE_PATH`` set, a sample (``TRAFFIC_CAPTURE_SAMPLE_RATE``)
+of requests is appended to that file as JSON lines::
+
+    {"ts": 1760781014.12, "method": "PUT", "path": "/api/users/7/theme/update/",
+     "query": "", "route": "update_theme_settings",
+     "headers": {"content-type": "application/json"}, "body": {"skin": "flat"},
+     "files": null, "request_bytes": 16, "status": 200, "duration_ms": 3.1,
+     "response_bytes": 151}
+
+Only what is needed to reproduce the request is kept, sanitized:
+
+* headers from ``CAPTURE_HEADERS``; credentials (``Authorization``) are
+  recorded as ``[redacted]``;
+* JSON bodies up to ``TRAFFIC_CAPTURE_MAX_BODY`` bytes, with the values of
+  keys matching ``TRAFFIC_CAPTURE_REDACT`` replaced (e-mail addresses by a
+  stable pseudonym at ``example.invalid``, so they stay valid and distinct);
+  larger or non-JSON bodies only by size;
+* uploads as ``{field: size}``;
+* query parameters with the same key rules. Client addresses and cookies
+  are never recorded.
+
+Each record is written with a single ``write`` to a file opened with
+``O_APPEND``, so the worker processes of a host can share one file.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.http.request import RawPostDataException
+
+REDACTED = "[redacted]"
+
+# Request headers that change what the API does; everything else is dropped
+CAPTURE_HEADERS = (
+    "Accept",
+    "Accept-Encoding",
+    "Content-Type",
+    "If-Match",
+    "If-Modified-Since",
+    "If-None-Match",
+)
+CREDENTIAL_HEADERS = ("Authorization",)
+
+_lock = threading.Lock()
+# path -> file descriptor opened for appending
+_files = {}
+
+
+def enabled():
+    return bool(settings.TRAFFIC_CAPTURE_PATH)
+
+
+def sampled():
+    rate = settings.TRAFFIC_CAPTURE_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
+
+
+def _redacts(key):
+    key = key.lower()
+    return any(word in key for word in settings.TRAFFIC_CAPTURE_REDACT)
+
+
+def pseudonym(email):
+    digest = hashlib.sha256(email.lower().encode()).hexdigest()[:12]
+    return f"u-{digest}@example.invalid"
+
+
+def redact_value(value):
+    if isinstance(value, str):
+        return pseudonym(value) if "@" in value else REDACTED
+    if isinstance(value, (list, tuple)):
+        return [redact_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact_value(item) for key, item in value.items()}
+    return value  # booleans and numbers say nothing about the user
+
+
+def sanitize(data):
+    """``data`` with the values under sensitive keys redacted, recursively."""
+    if isinstance(data, dict):
+        return {
+            key: redact_value(value) if _redacts(str(key)) else sanitize(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [sanitize(item) for item in data]
+    return data
+
+
+def sanitize_query(query_string):
+    pairs = parse_qsl(query_string, keep_blank_values=True)
+    return urlencode([(key, REDACTED if _redacts(key) else value) for key, value in pairs])
+
+
+def request_headers(request):
+    headers = {}
+    for name in CAPTURE_HEADERS:
+        value = request.headers.get(name)
+        if value is not None:
+            headers[name.lower()] = value
+    for name in CREDENTIAL_HEADERS:
+        if name in request.headers:
+            headers[name.lower()] = REDACTED
+    return headers
+
+
+def request_body(request):
+    """``(body, files)`` as recorded: sanitized JSON or None, upload sizes or None."""
+    content_type = request.content_type
+    if content_type == "multipart/form-data":
+        return None, {name: upload.size for name, upload in request.FILES.items()} or None
+    if content_type != "application/json":
+        return None, None
+    if int(request.META.get("CONTENT_LENGTH") or 0) > settings.TRAFFIC_CAPTURE_MAX_BODY:
+        return None, None
+    try:
+        return sanitize(json.loads(request.body)), None
+    except (RawPostDataException, ValueError):
+        return None, None
+
+
+def start():
+    return time.time(), time.perf_counter()
+
+
+def record(state, request, response, response_bytes):
+    """The capture record of a finished request (see the module docstring)."""
+    ts, started = state
+    body, files = request_body(request)
+    match = request.resolver_match
+    return {
+        "ts": round(ts, 6),
+        "method": request.method,
+        "path": request.path,
+        "query": sanitize_query(request.META.get("QUERY_STRING", "")),
+        "route": (match.url_name or match.view_name) if match else None,
+        "headers": request_headers(request),
+        "body": body,
+        "files": files,
+        "request_bytes": int(request.META.get("CONTENT_LENGTH") or 0),
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "response_bytes": response_bytes,
+    }
+
+
+def _fd(path):
+    with _lock:
+        fd = _files.get(path)
+        if fd is None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = _files[path] = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        return fd
+
+
+def write(data):
+    line = json.dumps(data, separators=(",", ":"), default=str) + "\n"
+    os.write(_fd(settings.TRAFFIC_CAPTURE_PATH), line.encode())
+
+
+def capture(state, request, response):
+    """
+    Record ``response`` to ``request``; returns the response. Streamed
+    bodies are recorded once they have been sent, with their size.
+    """
+    if not response.streaming:
+        write(record(state, request, response, len(response.content)))
+        return response
+    # Read the body now: the request may be gone when the stream ends
+    data = record(state, request, response, None)
+    if response.is_async:
+        response.streaming_content = _acount_bytes(response.streaming_content, data)
+    else:
+        response.streaming_content = _count_bytes(response.streaming_content, data)
+    return response
+
+
+def _count_bytes(chunks, data):
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    data["response_bytes"] = size
+    write(data)
+
+
+async def _acount_bytes(chunks, data):
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    data["response_bytes"] = size
+    write(data)
+
+
+def close():
+    with _lock:
+        for fd in _files.values():
+            os.close(fd)
+        _files.clear()
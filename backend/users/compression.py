@@ -0,0 +1,201 @@
+"""
+Response compression codecs, ``Accept-Encoding`` negotiation and a cache of
+compressed bodies (used by ``middleware.CompressionMiddleware``).
+
+gzip and deflate are always available; zstd and brotli are offered when the
+``zstandard`` / ``brotli`` packages are installed. ``COMPRESSION_CODECS``
+lists the codecs the server may use, in order of preference; the first one
+the client accepts (q > 0) wins.
+
+Bodies of ``GET`` responses with an ``ETag`` are kept compressed in a small
+per-process LRU keyed by ETag and codec (``COMPRESSION_CACHE_SIZE``
+entries), so a hot representation is compressed once rather than on every
+request. Entries also record the length and CRC-32 of the uncompressed body
+and are only reused for an identical body.
+"""
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+class ZlibCodec:
+    """gzip (``wbits=31``) or zlib-wrapped deflate (``wbits=15``)."""
+
+    def __init__(self, wbits):
+        self.wbits = wbits
+
+    def compressobj(self):
+        return zlib.compressobj(settings.COMPRESSION_LEVEL, zlib.DEFLATED, self.wbits)
+
+    def compress(self, data):
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+
+class BrotliCodec:
+    def compressobj(self):
+        return _BrotliStream(brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY))
+
+    def compress(self, data):
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+
+class _BrotliStream:
+    # brotli.Compressor spells compress/flush as process/finish
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+class ZstdCodec:
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=settings.COMPRESSION_LEVEL).compressobj()
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=settings.COMPRESSION_LEVEL).compress(data)
+
+
+CODECS = {"gzip": ZlibCodec(31), "deflate": ZlibCodec(15)}
+if brotli is not None:
+    CODECS["br"] = BrotliCodec()
+if zstandard is not None:
+    CODECS["zstd"] = ZstdCodec()
+
+
+def parse_accept_encoding(header):
+    """``{coding: q}`` for an ``Accept-Encoding`` header."""
+    accepted = {}
+    for part in header.lower().split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate(header):
+    """Name of the preferred available codec the client accepts, or None."""
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    for name in settings.COMPRESSION_CODECS:
+        if name in CODECS and accepted.get(name, wildcard) > 0:
+            return name
+    return None
+
+
+class CompressionStats:
+    """Per-process counters: bodies compressed, cache hits, bytes in and out."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.compressed = 0
+            self.cache_hits = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def incr(self, name, delta=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "compressed": self.compressed,
+                "cache_hits": self.cache_hits,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+
+
+stats = CompressionStats()
+
+_cache_lock = Lock()
+# (etag, codec) -> (len(body), crc32(body), compressed body)
+_cache = OrderedDict()
+
+
+def compress(body, codec, etag=None):
+    """
+    Compress ``body`` with the named codec. With an ``etag``, the result is
+    cached and reused while the same representation keeps being served.
+    """
+    key = None
+    if etag and settings.COMPRESSION_CACHE_SIZE:
+        key = (etag, codec)
+        signature = (len(body), zlib.crc32(body))
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[:2] == signature:
+                _cache.move_to_end(key)
+                stats.incr("cache_hits")
+                return entry[2]
+
+    compressed = CODECS[codec].compress(body)
+    stats.incr("compressed")
+    stats.incr("bytes_in", len(body))
+    stats.incr("bytes_out", len(compressed))
+
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = (*signature, compressed)
+            _cache.move_to_end(key)
+            while len(_cache) > settings.COMPRESSION_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return compressed
+
+
+def compress_stream(chunks, codec):
+    """Compress an iterable of byte chunks, yielding only non-empty output."""
+    compressor = CODECS[codec].compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def acompress_stream(chunks, codec):
+    """Async ``compress_stream`` for async iterators."""
+    compressor = CODECS[codec].compressobj()
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
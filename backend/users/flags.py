@@ -0,0 +1,104 @@
+"""
+Packed storage for boolean preferences.
+
+With ``COMPACT_PREFERENCE_FLAGS`` enabled, every boolean settings field is
+kept as one bit of ``User.preference_flags`` instead of in the settings
+tables: notification settings need no row at all, and privacy rows only
+hold ``profile_visibility``. API payloads are unchanged; users/services.py
+maps bits back onto settings instances.
+
+``preference_flags`` is NULL for users that have not been packed yet; their
+booleans are still read from the rows. They are packed by their first
+settings update, or in bulk by ``manage.py pack_preference_flags``.
+
+Bits can be filtered on in queries::
+
+    User.objects.filter(preference_flags__has_all=mask("notifications.email_news"))
+    User.objects.filter(preference_flags__has_any=mask("privacy.show_email", "privacy.data_sharing"))
+
+Only packed users match.
+"""
+from django.conf import settings
+from django.db import models
+from django.db.models import Lookup
+
+# Bit i stores FLAGS[i]. This is the storage format: append, never reorder.
+FLAGS = (
+    "notifications.push_messages",
+    "notifications.push_comments",
+    "notifications.push_reminders",
+    "notifications.email_news",
+    "notifications.email_messages",
+    "notifications.email_reminders",
+    "privacy.show_email",
+    "privacy.data_sharing",
+)
+
+BITS = {flag: 1 << index for index, flag in enumerate(FLAGS)}
+# Largest value of the (signed 64-bit) column
+MAX_VALUE = (1 << 63) - 1
+
+
+def enabled():
+    return settings.COMPACT_PREFERENCE_FLAGS
+
+
+def group_fields(group):
+    """Names of the fields of ``group`` ("notifications") stored as bits."""
+    prefix = f"{group}."
+    return [flag[len(prefix):] for flag in FLAGS if flag.startswith(prefix)]
+
+
+def mask(*flags):
+    """Bitmask of dotted flag names, e.g. ``mask("notifications.email_news")``."""
+    value = 0
+    for flag in flags:
+        value |= BITS[flag]
+    return value
+
+
+def pack(values, base=0):
+    """Return ``base`` with the bits of ``{dotted_name: bool}`` set or cleared."""
+    set_bits, clear_bits = masks(values)
+    return (base & ~clear_bits) | set_bits
+
+
+def masks(values):
+    """``(set_bits, clear_bits)`` for ``{dotted_name: bool}``."""
+    set_bits = mask(*(flag for flag, value in values.items() if value))
+    clear_bits = mask(*(flag for flag, value in values.items() if not value))
+    return set_bits, clear_bits
+
+
+def keep_mask(clear_bits):
+    """AND-mask that clears ``clear_bits`` and keeps every other bit."""
+    return MAX_VALUE & ~clear_bits
+
+
+def unpack(value, group):
+    """``{field: bool}`` for the fields of ``group`` stored in ``value``."""
+    return {name: bool(value & BITS[f"{group}.{name}"]) for name in group_fields(group)}
+
+
+class PreferenceFlagsField(models.PositiveBigIntegerField):
+    """Integer bitmask laid out by ``FLAGS``; supports has_all/has_any lookups."""
+
+
+@PreferenceFlagsField.register_lookup
+class HasAllFlags(Lookup):
+    lookup_name = "has_all"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"({lhs} & {rhs}) = {rhs}", [*lhs_params, *rhs_params, *rhs_params]
+
+
+@PreferenceFlagsField.register_lookup
+class HasAnyFlags(Lookup):
+    lookup_name = "has_any"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"({lhs} & {rhs}) != 0", [*lhs_params, *rhs_params]
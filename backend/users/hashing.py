@@ -0,0 +1,183 @@
+"""
+Password hashing off the request thread.
+
+``check_password``/``make_password`` (PBKDF2) cost hundreds of milliseconds
+of CPU. They run in a bounded process pool of ``PASSWORD_HASHING_WORKERS``
+processes so a burst of password changes cannot stall other requests served
+by the same worker. At most ``PASSWORD_HASHING_MAX_PENDING`` jobs may be in
+flight; beyond that ``HashingBusy`` is raised and views answer 429.
+``PASSWORD_HASHING_WORKERS = 0`` hashes inline in the calling thread.
+
+Jobs return concurrent futures; wait for them with ``result`` / ``aresult``,
+which give up after ``PASSWORD_HASHING_TIMEOUT`` seconds. A pool whose
+worker died is replaced by a new one on the next job. Jobs that time out or
+were lost with the pool raise ``HashingBusy`` too, so callers can retry.
+"""
+import asyncio
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class HashingBusy(Exception):
+    """Raised when too many hashing jobs are already pending."""
+
+
+class HashingStats:
+    """Per-process counters and latency totals for hashing jobs."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.completed = 0
+            self.rejected = 0
+            self.hash_seconds = 0.0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+
+    def record(self, hash_seconds, total_seconds):
+        with self._lock:
+            self.completed += 1
+            self.hash_seconds += hash_seconds
+            self.total_seconds += total_seconds
+            self.max_seconds = max(self.max_seconds, total_seconds)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "hash_seconds": self.hash_seconds,
+                "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+            }
+
+
+stats = HashingStats()
+
+_lock = Lock()
+_executor = None
+_slots = None
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+def _change_password(current_password, encoded, new_password):
+    started = time.perf_counter()
+    matches = check_password(current_password, encoded)
+    new_encoded = make_password(new_password) if matches else None
+    return (matches, new_encoded), time.perf_counter() - started
+
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = settings.PASSWORD_HASHING_WORKERS
+            _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+            _slots = BoundedSemaphore(settings.PASSWORD_HASHING_MAX_PENDING)
+        return _executor, _slots
+
+
+def _discard(executor):
+    """Forget a broken pool so the next job starts a new one."""
+    global _executor, _slots
+    with _lock:
+        if _executor is executor:
+            _executor = None
+            _slots = None
+    executor.shutdown(wait=False)
+
+
+def _submit(fn, *args):
+    submitted = time.perf_counter()
+    result = Future()
+
+    def finish(job):
+        try:
+            value, hash_seconds = job.result()
+        except BrokenProcessPool as exc:
+            _discard(executor)
+            result.set_exception(exc)
+            return
+        except Exception as exc:
+            result.set_exception(exc)
+            return
+        stats.record(hash_seconds, time.perf_counter() - submitted)
+        result.set_result(value)
+
+    if not settings.PASSWORD_HASHING_WORKERS:
+        job = Future()
+        try:
+            job.set_result(fn(*args))
+        except Exception as exc:
+            job.set_exception(exc)
+        finish(job)
+        return result
+
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        stats.reject()
+        raise HashingBusy()
+    try:
+        job = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker died; the pool refuses every job from now on
+        slots.release()
+        _discard(executor)
+        raise HashingBusy()
+    job.add_done_callback(lambda job: slots.release())
+    job.add_done_callback(finish)
+    return result
+
+
+def change_password(current_password, encoded, new_password):
+    """
+    Verify ``current_password`` against ``encoded`` and, if it matches, hash
+    ``new_password``. Future result: ``(matches, new_encoded_or_None)``.
+    """
+    return _submit(_change_password, current_password, encoded, new_password)
+
+
+def result(job):
+    """Wait for ``job``; raises ``HashingBusy`` if it times out or its pool broke."""
+    try:
+        return job.result(timeout=settings.PASSWORD_HASHING_TIMEOUT)
+    except (TimeoutError, BrokenProcessPool) as exc:
+        raise HashingBusy() from exc
+
+
+async def aresult(job):
+    """Async ``result``."""
+    try:
+        # Shielded: a timeout must not cancel the future the pool completes
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(job)), settings.PASSWORD_HASHING_TIMEOUT
+        )
+    except (TimeoutError, BrokenProcessPool) as exc:
+        raise HashingBusy() from exc
+
+
+def shutdown(wait=True):
+    """Stop the worker pool; the next job starts a new one from current settings."""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+        _executor = None
+        _slots = None
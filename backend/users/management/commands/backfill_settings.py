@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.cache import invalidate_many
+from users.models import User
+from users.routers import use_primary
+from users.services import SETTINGS_RELATIONS
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the missing notification/theme/privacy settings rows (with "
+        "their defaults) for existing users, in batches ordered by user id. "
+        "Safe to re-run; pass --start-after with the last reported id to resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            default=0,
+            help="Only process users with an id greater than this one.",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches to leave room for live writes.",
+        )
+
+    def handle(self, *args, **options):
+        # A lagging replica could miss rows created by live updates
+        with use_primary():
+            self.run(**options)
+
+    def run(self, **options):
+        batch_size = options["batch_size"]
+        last_id = options["start_after"]
+        created = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+
+            with transaction.atomic():
+                for _, model in SETTINGS_RELATIONS:
+                    existing = set(
+                        model.objects.filter(user_id__in=user_ids).values_list(
+                            "user_id", flat=True
+                        )
+                    )
+                    rows = [
+                        model(user_id=user_id)
+                        for user_id in user_ids
+                        if user_id not in existing
+                    ]
+                    # ignore_conflicts: a concurrent update may create the row first
+                    model.objects.bulk_create(rows, ignore_conflicts=True)
+                    created += len(rows)
+                    # Cached virtual defaults are replaced by the real rows
+                    transaction.on_commit(
+                        lambda model=model, rows=rows: invalidate_many(
+                            model, [row.user_id for row in rows], field="user_id"
+                        )
+                    )
+
+            last_id = user_ids[-1]
+            self.stdout.write(f"Processed users up to id {last_id} ({created} rows created)")
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill complete: {created} rows created"))
@@ -0,0 +1,121 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import User
+from users.routers import use_primary
+from users.thumbnails import variant_owner
+
+
+def path_key(name):
+    # Compare by path components so the order matches the directory walk
+    return name.split("/")
+
+
+def iter_files(storage, directory):
+    """Yield file names under ``directory`` in sorted, resumable order."""
+    dirs, files = storage.listdir(directory)
+    entries = [(name, True) for name in dirs] + [(name, False) for name in files]
+    for name, is_dir in sorted(entries):
+        path = f"{directory}/{name}"
+        if is_dir:
+            yield from iter_files(storage, path)
+        else:
+            yield path
+
+
+def referenced_names(names):
+    """The subset of ``names`` that are, or are variants of, a current profile picture."""
+    candidates = set(names)
+    candidates.update(owner for owner in map(variant_owner, names) if owner)
+    pictures = set(
+        User.objects.filter(profile_picture__in=candidates).values_list(
+            "profile_picture", flat=True
+        )
+    )
+    return {name for name in names if name in pictures or variant_owner(name) in pictures}
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete profile pictures and variants no user references any more. "
+        "Scans the storage in batches, in name order; pass --start-after with "
+        "the last reported name to resume, and --limit to bound a single run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", default="profile_pictures")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=0,
+            help="Stop after scanning this many files (0 scans everything).",
+        )
+        parser.add_argument(
+            "--start-after",
+            default="",
+            help="Only scan files after this name.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=float,
+            default=3600,
+            help=(
+                "Seconds since a file was written before it may be deleted, so "
+                "uploads whose user row is not saved yet are kept."
+            ),
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        # A lagging replica could miss a new reference to a file
+        with use_primary():
+            self.run(**options)
+
+    def run(self, **options):
+        storage = User._meta.get_field("profile_picture").storage
+        if not storage.exists(options["directory"]):
+            self.stdout.write("Nothing to collect")
+            return
+
+        batch_size = options["batch_size"]
+        start_after = path_key(options["start_after"]) if options["start_after"] else None
+        cutoff = time.time() - options["min_age"]
+        scanned = deleted = 0
+        batch = []
+
+        def collect(batch):
+            nonlocal deleted
+            queried = time.time()
+            keep = referenced_names(batch)
+            for name in batch:
+                if name in keep:
+                    continue
+                # Read after the query: a file uploaded again since then has a
+                # reference the query could not see
+                modified = storage.get_modified_time(name).timestamp()
+                if modified > cutoff or modified >= queried:
+                    continue
+                if not options["dry_run"]:
+                    storage.delete(name)
+                deleted += 1
+            self.stdout.write(f"Scanned up to {batch[-1]} ({deleted} files deleted)")
+
+        for name in iter_files(storage, options["directory"]):
+            if start_after and path_key(name) <= start_after:
+                continue
+            batch.append(name)
+            scanned += 1
+            if len(batch) == batch_size:
+                collect(batch)
+                batch = []
+            if options["limit"] and scanned >= options["limit"]:
+                break
+        if batch:
+            collect(batch)
+
+        verb = "would be deleted" if options["dry_run"] else "deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"Garbage collection complete: {scanned} scanned, {deleted} {verb}")
+        )
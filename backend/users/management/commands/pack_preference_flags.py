@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from users import flags
+from users.models import User
+from users.routers import use_primary
+from users.services import (
+    FLAG_RELATIONS,
+    GROUP_NAMES,
+    SETTINGS_RELATIONS,
+    apply_settings_changes,
+    flag_backed,
+    invalidate_flags,
+    row_flags,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy boolean preferences from the settings rows into "
+        "User.preference_flags (see COMPACT_PREFERENCE_FLAGS), in batches "
+        "ordered by user id. --unpack copies them back into the rows and "
+        "clears the flags. Runs only while COMPACT_PREFERENCE_FLAGS is on. "
+        "Safe to re-run; resume with --start-after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            default=0,
+            help="Only process users with an id greater than this one.",
+        )
+        parser.add_argument(
+            "--unpack",
+            action="store_true",
+            help="Write packed flags back to the settings rows.",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help=(
+                "After packing, delete settings rows that only hold flags "
+                "(notification settings); --unpack recreates them."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        # Without compact mode, updates go to the rows only: flags packed now
+        # would go stale and undo those updates once the mode is turned on
+        if not flags.enabled():
+            raise CommandError(
+                "pack_preference_flags requires COMPACT_PREFERENCE_FLAGS; turn it on "
+                "first, and turn it off only after --unpack"
+            )
+        # A lagging replica could return rows older than the live data
+        with use_primary():
+            self.run(**options)
+
+    def run(self, **options):
+        batch_size = options["batch_size"]
+        last_id = options["start_after"]
+        processed = 0
+        step = self.unpack_batch if options["unpack"] else self.pack_batch
+
+        while True:
+            users = list(
+                User.objects.filter(pk__gt=last_id, preference_flags__isnull=not options["unpack"])
+                .select_related(*FLAG_RELATIONS)
+                .order_by("pk")[:batch_size]
+            )
+            if not users:
+                break
+            with transaction.atomic():
+                processed += step(users, options)
+                user_ids = [user.pk for user in users]
+                transaction.on_commit(lambda user_ids=user_ids: invalidate_flags(user_ids))
+            last_id = users[-1].pk
+            self.stdout.write(f"Processed users up to id {last_id} ({processed} users)")
+
+        verb = "unpacked" if options["unpack"] else "packed"
+        self.stdout.write(self.style.SUCCESS(f"Done: {processed} users {verb}"))
+
+    def pack_batch(self, users, options):
+        by_value = defaultdict(list)
+        for user in users:
+            by_value[row_flags(user)].append(user.pk)
+        packed = 0
+        for value, user_ids in by_value.items():
+            # Users packed by a live update meanwhile already hold newer values
+            packed += User.objects.filter(pk__in=user_ids, preference_flags__isnull=True).update(
+                preference_flags=value
+            )
+        if options["prune"]:
+            user_ids = [user.pk for user in users]
+            for _, model in SETTINGS_RELATIONS:
+                if flag_backed(model):
+                    model.objects.filter(
+                        user_id__in=user_ids, user__preference_flags__isnull=False
+                    ).delete()
+        return packed
+
+    def unpack_batch(self, users, options):
+        now = timezone.now()
+        for _, model in SETTINGS_RELATIONS:
+            group = GROUP_NAMES[model]
+            if not flags.group_fields(group):
+                continue
+            apply_settings_changes(
+                model,
+                {user.pk: flags.unpack(user.preference_flags, group) for user in users},
+                now,
+            )
+        return User.objects.filter(pk__in=[user.pk for user in users]).update(
+            preference_flags=None
+        )
@@ -0,0 +1,172 @@
+"""
+Serving of uploaded media, in development and production alike.
+
+``serve`` answers ``GET``/``HEAD`` for files under ``MEDIA_ROOT`` with
+``ETag``/``Last-Modified`` validators, conditional requests and single byte
+ranges. Whole files go through ``FileResponse`` so WSGI servers that provide
+``wsgi.file_wrapper`` can use ``sendfile``. Under ASGI (``USERS_ASYNC_VIEWS``)
+bodies are read block by block by an async iterator instead, since Django
+reads a sync iterator in full before sending it to an ASGI server.
+Content-addressed names (see users/storage.py) never change content and are
+cached as ``immutable``.
+
+With ``MEDIA_ACCEL`` set to ``"x-accel-redirect"`` (nginx) or
+``"x-sendfile"`` (Apache, lighttpd) the view only checks the request and the
+front proxy sends the bytes, ranges included.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# A SHA-256 stem, optionally followed by extensions (variants add ``.40.webp``)
+CONTENT_ADDRESSED_NAME = re.compile(r"(?:^|/)[0-9a-f]{64}(?:\.[^/]*)?$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def cache_control(path):
+    if CONTENT_ADDRESSED_NAME.search(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={settings.MEDIA_MAX_AGE}"
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single satisfiable byte range,
+    None to serve the whole file, or ``False`` if the range is unsatisfiable.
+    """
+    match = BYTE_RANGE.match(header.replace(" ", ""))
+    if not match:
+        # Multiple or malformed ranges: the full representation is a valid answer
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def iter_range(path, start, length):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(STREAM_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def aiter_range(path, start, length):
+    """Async ``iter_range``; reads run in worker threads."""
+    fh = await sync_to_async(open, thread_sensitive=False)(path, "rb")
+    try:
+        await sync_to_async(fh.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await sync_to_async(fh.read, thread_sensitive=False)(
+                min(STREAM_BLOCK_SIZE, length)
+            )
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def accel_response(path, full_path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_ACCEL == "x-accel-redirect":
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    else:
+        response["X-Sendfile"] = full_path
+    return response
+
+
+def serve(request, path):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Media file not found")
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("Media file not found")
+    if not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is None:
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if settings.MEDIA_ACCEL:
+            response = accel_response(path, full_path, content_type)
+        else:
+            response = file_response(request, full_path, stat, etag, content_type)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = cache_control(path)
+    return response
+
+
+def file_response(request, full_path, stat, etag, content_type):
+    size = stat.st_size
+    byte_range = None
+    if "HTTP_RANGE" in request.META and if_range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.META["HTTP_RANGE"], size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    elif byte_range:
+        start, end = byte_range
+        chunks = aiter_range if settings.USERS_ASYNC_VIEWS else iter_range
+        response = StreamingHttpResponse(
+            chunks(full_path, start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    elif settings.USERS_ASYNC_VIEWS:
+        response = StreamingHttpResponse(aiter_range(full_path, 0, size), content_type=content_type)
+        response["Content-Length"] = str(size)
+    else:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    response["Accept-Ranges"] = "bytes"
+    return response
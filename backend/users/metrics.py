@@ -0,0 +1,359 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` times every request and, per named URL pattern
+(``get_user``, ``bulk_preferences``, ...), records:
+
+* requests by route, method and status;
+* a latency histogram (seconds, measured around the rest of the chain);
+* a histogram of DB queries per request and the total time spent in them,
+  counted by a wrapper installed on every connection;
+* a response size histogram (bytes as sent, i.e. after compression;
+  streamed bodies are counted as they are consumed).
+
+Aggregates are kept in per-thread shards, so recording takes no lock; a
+scrape sums the shards. When a thread exits, its shard is merged into one
+shard of retired counts, so thread-per-connection servers do not grow the
+list without bound. ``GET /metrics`` serves them together with the
+counters of the cache, hashing, compression and write-behind components.
+
+Multi-process servers: set ``METRICS_DIR`` to a directory shared by the
+workers of one host. Each process writes a snapshot of its totals there
+(``<pid>.json``) at most every ``METRICS_FLUSH_SECONDS`` after a request and
+at exit; ``/metrics`` merges every snapshot, so any worker can answer the
+scrape. Snapshots of exited workers keep their counts until the directory is
+cleared, normally on deploy, so counters never go backwards.
+"""
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+from . import cache, compression, hashing, writebehind
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    "users_http_request_duration_seconds": ("Request latency.", LATENCY_BUCKETS),
+    "users_db_queries_per_request": ("Database queries per request.", QUERY_BUCKETS),
+    "users_http_response_size_bytes": ("Response body size.", SIZE_BUCKETS),
+}
+LATENCY, QUERIES, SIZE = HISTOGRAMS
+
+# Components whose ``stats.as_dict()`` counters are exported as
+# ``users_<component>_<counter>``
+COMPONENTS = {
+    "cache": cache.stats,
+    "hashing": hashing.stats,
+    "compression": compression.stats,
+    "writebehind": writebehind.stats,
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# [queries, seconds] of the current request, updated by the query wrapper
+_current = ContextVar("users_metrics_request", default=None)
+
+
+class Shard:
+    """The aggregates of one thread."""
+
+    def __init__(self):
+        # (route, method, status) -> count
+        self.requests = {}
+        # metric -> route -> [bucket counts..., +Inf count, sum]
+        self.histograms = {name: {} for name in HISTOGRAMS}
+        # route -> seconds spent in queries
+        self.query_seconds = {}
+
+    def observe(self, metric, route, value):
+        bounds = HISTOGRAMS[metric][1]
+        counts = self.histograms[metric].get(route)
+        if counts is None:
+            counts = self.histograms[metric][route] = [0] * (len(bounds) + 2)
+        counts[bisect_left(bounds, value)] += 1
+        counts[-1] += value
+
+    def absorb(self, other):
+        for key, count in other.requests.items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        for name, routes in other.histograms.items():
+            for route, counts in routes.items():
+                _add(self.histograms[name], route, list(counts))
+        for route, seconds in other.query_seconds.items():
+            self.query_seconds[route] = self.query_seconds.get(route, 0.0) + seconds
+
+
+class _ThreadToken:
+    """Lives in a thread's locals only, so it is collected when the thread exits."""
+
+
+_lock = threading.Lock()
+_local = threading.local()
+# Counts of exited threads
+_retired = Shard()
+# The retired shard and the shards of live threads
+_shards = [_retired]
+_last_flush = 0.0
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = Shard()
+        _local.token = _ThreadToken()
+        weakref.finalize(_local.token, _retire, shard)
+        with _lock:
+            _shards.append(shard)
+        return shard
+
+
+def _retire(shard):
+    with _lock:
+        _retired.absorb(shard)
+        _shards.remove(shard)
+
+
+def reset():
+    """Zero the aggregates of this process."""
+    with _lock:
+        for shard in _shards:
+            shard.__init__()
+
+
+def _count_queries(execute, sql, params, many, context):
+    counter = _current.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter[0] += 1
+        counter[1] += time.perf_counter() - started
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+def install():
+    """Count queries on every database connection opened from now on."""
+    connection_created.connect(_install_query_counter, dispatch_uid="users.metrics")
+
+
+def begin():
+    """Start measuring a request; pass the result to ``end``."""
+    counter = [0, 0.0]
+    return _current.set(counter), counter, time.perf_counter()
+
+
+def end(state, request, response):
+    """Record the request started by ``begin``; returns ``response``."""
+    token, counter, started = state
+    elapsed = time.perf_counter() - started
+    _current.reset(token)
+
+    match = request.resolver_match
+    route = (match.url_name or match.view_name) if match else "unmatched"
+    shard = _shard()
+    key = (route, request.method, response.status_code)
+    shard.requests[key] = shard.requests.get(key, 0) + 1
+    shard.observe(LATENCY, route, elapsed)
+    shard.observe(QUERIES, route, counter[0])
+    shard.query_seconds[route] = shard.query_seconds.get(route, 0.0) + counter[1]
+
+    length = response.get("Content-Length")
+    if length is not None:
+        shard.observe(SIZE, route, int(length))
+    elif not response.streaming:
+        shard.observe(SIZE, route, len(response.content))
+    elif response.is_async:
+        response.streaming_content = _acount_bytes(response.streaming_content, route)
+    else:
+        response.streaming_content = _count_bytes(response.streaming_content, route)
+
+    if settings.METRICS_DIR and time.monotonic() - _last_flush > settings.METRICS_FLUSH_SECONDS:
+        write_snapshot()
+    return response
+
+
+def _count_bytes(chunks, route):
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    _shard().observe(SIZE, route, size)
+
+
+async def _acount_bytes(chunks, route):
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    _shard().observe(SIZE, route, size)
+
+
+def snapshot():
+    """This process's totals, as a JSON-serializable dict."""
+    requests = {}
+    histograms = {name: {} for name in HISTOGRAMS}
+    query_seconds = {}
+    # Held throughout, so a shard retired meanwhile is not counted twice
+    with _lock:
+        for shard in _shards:
+            # Copies: the owning threads keep writing while we read
+            for key, count in list(shard.requests.items()):
+                requests[key] = requests.get(key, 0) + count
+            for name, routes in shard.histograms.items():
+                for route, counts in list(routes.items()):
+                    _add(histograms[name], route, list(counts))
+            for route, seconds in list(shard.query_seconds.items()):
+                query_seconds[route] = query_seconds.get(route, 0.0) + seconds
+    return {
+        "requests": [[*key, count] for key, count in requests.items()],
+        "histograms": histograms,
+        "query_seconds": query_seconds,
+        "components": {name: stats.as_dict() for name, stats in COMPONENTS.items()},
+    }
+
+
+def _add(routes, route, counts):
+    total = routes.get(route)
+    if total is None:
+        routes[route] = counts
+    else:
+        for index, value in enumerate(counts):
+            total[index] += value
+
+
+def merge(snapshots):
+    """Sum snapshots of several processes (maxima are combined with max)."""
+    requests = {}
+    histograms = {name: {} for name in HISTOGRAMS}
+    query_seconds = {}
+    components = {}
+    for data in snapshots:
+        for *key, count in data["requests"]:
+            key = tuple(key)
+            requests[key] = requests.get(key, 0) + count
+        for name, routes in data["histograms"].items():
+            for route, counts in routes.items():
+                _add(histograms.setdefault(name, {}), route, list(counts))
+        for route, seconds in data["query_seconds"].items():
+            query_seconds[route] = query_seconds.get(route, 0.0) + seconds
+        for component, counters in data["components"].items():
+            merged = components.setdefault(component, {})
+            for name, value in counters.items():
+                if name.startswith("max_"):
+                    merged[name] = max(merged.get(name, value), value)
+                else:
+                    merged[name] = merged.get(name, 0) + value
+    return {
+        "requests": [[*key, count] for key, count in requests.items()],
+        "histograms": histograms,
+        "query_seconds": query_seconds,
+        "components": components,
+    }
+
+
+def write_snapshot():
+    """Write this process's snapshot to ``METRICS_DIR``."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(snapshot(), fh)
+    os.replace(tmp, path)
+
+
+def read_snapshots():
+    """This process's snapshot merged with every other one in ``METRICS_DIR``."""
+    write_snapshot()
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+        try:
+            with open(path) as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue  # replaced or removed while we listed the directory
+    return merge(snapshots)
+
+
+def shutdown():
+    if settings.METRICS_DIR:
+        write_snapshot()
+
+
+def _labels(**labels):
+    return ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(data):
+    """Prometheus text exposition of a (merged) snapshot."""
+    lines = [
+        "# HELP users_http_requests_total Requests by route, method and status.",
+        "# TYPE users_http_requests_total counter",
+    ]
+    for route, method, status, count in sorted(data["requests"]):
+        lines.append(
+            f"users_http_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}"
+        )
+
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for route, counts in sorted(data["histograms"].get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip((*bounds, "+Inf"), counts):
+                cumulative += count
+                labels = _labels(route=route, le=bound)
+                lines.append(f"{name}_bucket{{{labels}}} {cumulative}")
+            labels = _labels(route=route)
+            lines.append(f"{name}_sum{{{labels}}} {_number(counts[-1])}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+    lines += [
+        "# HELP users_db_query_duration_seconds_total Time spent in database queries.",
+        "# TYPE users_db_query_duration_seconds_total counter",
+    ]
+    for route, seconds in sorted(data["query_seconds"].items()):
+        lines.append(
+            f"users_db_query_duration_seconds_total{{{_labels(route=route)}}} {_number(seconds)}"
+        )
+
+    for component, counters in sorted(data["components"].items()):
+        for counter, value in counters.items():
+            name = f"users_{component}_{counter}"
+            lines += [f"# TYPE {name} untyped", f"{name} {_number(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """``GET /metrics``; requires ``Authorization: Bearer <METRICS_API_TOKEN>`` when set."""
+    token = settings.METRICS_API_TOKEN
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if token and not hmac.compare_digest(supplied.encode(), token.encode()):
+        return HttpResponse("Forbidden\n", status=403, content_type=CONTENT_TYPE)
+    data = read_snapshots() if settings.METRICS_DIR else snapshot()
+    return HttpResponse(render(data), content_type=CONTENT_TYPE)
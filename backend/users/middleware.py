@@ -1,25 +1,322 @@
-from django.http import HttpResponse
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import capture, compression, metrics, routers, throttle
+from .views import too_many_requests
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+CORS_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
 
 
 class SimpleCORSMiddleware:
     """
-    Very simple CORS middleware for development.
-    Allows requests from any origin and handles OPTIONS preflight.
+    CORS for the API. Works in both sync (WSGI) and async (ASGI) middleware
+    chains.
+
+    With ``CORS_ALLOWED_ORIGINS`` empty (development) any origin is allowed
+    with ``*``. Otherwise only the listed origins are; entries may use one
+    ``*`` wildcard (``https://*.example.com``) and are compiled once, when
+    the middleware is created. Responses then carry ``Vary: Origin`` so
+    shared caches keep one copy per origin.
+
+    ``OPTIONS`` is answered here, before the rest of the chain runs, and
+    preflights are cacheable by browsers for ``CORS_PREFLIGHT_MAX_AGE``
+    seconds. Keep this middleware first in ``MIDDLEWARE``.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        self.allow_any = not settings.CORS_ALLOWED_ORIGINS
+        self.exact_origins = frozenset(
+            origin for origin in settings.CORS_ALLOWED_ORIGINS if "*" not in origin
+        )
+        patterns = [
+            re.escape(origin).replace(r"\*", r"[A-Za-z0-9.-]+")
+            for origin in settings.CORS_ALLOWED_ORIGINS
+            if "*" in origin
+        ]
+        self.origin_pattern = re.compile("|".join(patterns)) if patterns else None
+
+        # Built once; copied onto responses as they are
+        self.headers = {
+            "Access-Control-Allow-Methods": ", ".join(CORS_METHODS),
+            "Access-Control-Allow-Headers": ", ".join(settings.CORS_ALLOW_HEADERS),
+            "Access-Control-Expose-Headers": ", ".join(settings.CORS_EXPOSE_HEADERS),
+        }
+        if self.allow_any:
+            self.headers["Access-Control-Allow-Origin"] = "*"
+        self.preflight_headers = dict(self.headers)
+        if settings.CORS_PREFLIGHT_MAX_AGE:
+            self.preflight_headers["Access-Control-Max-Age"] = str(settings.CORS_PREFLIGHT_MAX_AGE)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
         # Handle preflight
         if request.method == "OPTIONS":
-            response = HttpResponse()
+            return self.preflight(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        if request.method == "OPTIONS":
+            return self.preflight(request)
+        return self.add_headers(request, await self.get_response(request))
+
+    def origin_allowed(self, origin):
+        return origin in self.exact_origins or bool(
+            self.origin_pattern and self.origin_pattern.fullmatch(origin)
+        )
+
+    def preflight(self, request):
+        return self.apply(request, HttpResponse(), self.preflight_headers)
+
+    def add_headers(self, request, response):
+        return self.apply(request, response, self.headers)
+
+    def apply(self, request, response, headers):
+        if self.allow_any:
+            for name, value in headers.items():
+                response[name] = value
+            return response
+        # The answer depends on Origin, even when it is missing or refused
+        patch_vary_headers(response, ("Origin",))
+        origin = request.headers.get("Origin")
+        if origin and self.origin_allowed(origin):
+            for name, value in headers.items():
+                response[name] = value
+            response["Access-Control-Allow-Origin"] = origin
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records per-route latency, query counts and response sizes (see
+    users/metrics.py). Placed right after the CORS middleware, so it times
+    everything else and sees bodies as they are sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        state = metrics.begin()
+        return metrics.end(state, request, self.get_response(request))
+
+    async def __acall__(self, request):
+        state = metrics.begin()
+        return metrics.end(state, request, await self.get_response(request))
+
+
+class TrafficCaptureMiddleware:
+    """
+    Appends sanitized records of sampled requests to ``TRAFFIC_CAPTURE_PATH``
+    for ``benchmarks/replay.py`` (see users/capture.py). Unused while the
+    setting is empty. Placed before the compression middleware, so response
+    sizes are those sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not capture.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not capture.sampled():
+            return self.get_response(request)
+        state = capture.start()
+        return capture.capture(state, request, self.get_response(request))
+
+    async def __acall__(self, request):
+        if not capture.sampled():
+            return await self.get_response(request)
+        state = capture.start()
+        return capture.capture(state, request, await self.get_response(request))
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best codec the client accepts (see
+    users/compression.py). Only ``200`` responses of ``COMPRESSIBLE_TYPES``
+    are touched: images and other media are already compressed, and
+    ``FileResponse`` bodies are left to ``sendfile``. Bodies smaller than
+    ``COMPRESSION_MIN_SIZE`` bytes are sent as they are.
+
+    The ``ETag`` of a compressed response is made weak, like Django's
+    ``GZipMiddleware`` does: conditional GETs still match it, and
+    ``If-Match`` compares weak tags by value (see ``views.if_match_passes``).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.compressible_types = frozenset(settings.COMPRESSIBLE_TYPES)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (
+            response.status_code != 200
+            or isinstance(response, FileResponse)
+            or response.has_header("Content-Encoding")
+            or response.get("Content-Type", "").split(";")[0].strip() not in self.compressible_types
+        ):
+            return response
+        # Whether compressed or not, the body depends on Accept-Encoding
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        codec = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+        if codec is None:
+            return response
+
+        etag = response.get("ETag")
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compression.acompress_stream(
+                    response.streaming_content, codec
+                )
+            else:
+                response.streaming_content = compression.compress_stream(
+                    response.streaming_content, codec
+                )
+            del response["Content-Length"]
         else:
-            response = self.get_response(request)
+            cache_etag = etag if request.method in ("GET", "HEAD") else None
+            response.content = compression.compress(response.content, codec, cache_etag)
+            response["Content-Length"] = str(len(response.content))
 
-        response["Access-Control-Allow-Origin"] = "*"
-        response["Access-Control-Allow-Methods"] = "GET, POST, PUT, PATCH, DELETE, OPTIONS"
-        response["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = codec
         return response
 
 
+class ThrottleMiddleware:
+    """
+    Token-bucket throttling of the routes in ``THROTTLE_COSTS`` per target
+    user and client address (see users/throttle.py). Runs in
+    ``process_view``, once the route is known, and before the replica
+    routing middleware: a refused request pins nothing. Unused while
+    ``THROTTLE_COSTS`` is empty.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.THROTTLE_COSTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.url_name
+        if not throttle.cost_of(route):
+            return None
+        wait = throttle.take(route, view_kwargs.get("pk"), request.META.get("REMOTE_ADDR"))
+        if not wait:
+            return None
+        return too_many_requests(
+            "Too many requests, retry later",
+            code="throttled",
+            retry_after=throttle.retry_after(wait),
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Chooses between the primary and the read replicas for the request's
+    reads (see users/routers.py) and, after a successful write for a user,
+    pins that user's reads to the primary for a while.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        with routers.routing_state():
+            response = self.get_response(request)
+        return self.pin_written_user(request, response)
+
+    async def __acall__(self, request):
+        with routers.routing_state():
+            response = await self.get_response(request)
+        return self.pin_written_user(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        pk = view_kwargs.get("pk")
+        if request.method not in SAFE_METHODS and not getattr(view_func, "replica_reads", False):
+            routers.use_primary_for_request()
+            request.written_user_id = pk
+        elif pk is not None and routers.is_pinned(pk):
+            routers.use_primary_for_request()
+        return None
+
+    def pin_written_user(self, request, response):
+        user_id = getattr(request, "written_user_id", None)
+        if user_id is not None and response.status_code < 400:
+            routers.pin([user_id])
+        return response
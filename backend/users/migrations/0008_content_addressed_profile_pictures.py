@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+import users.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_user_profile_picture_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="profile_picture",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=users.storage.get_picture_storage,
+                upload_to=users.storage.profile_picture_upload_to,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+import users.flags
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0008_content_addressed_profile_pictures"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="preference_flags",
+            field=users.flags.PreferenceFlagsField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -1,7 +1,185 @@
-from django.db import models
+import copy
 
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, models, router
+from django.db.models import F
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_save, pre_save
 
-class User(models.Model):
+from .flags import PreferenceFlagsField
+from .storage import get_picture_storage, profile_picture_upload_to
+
+
+def _comparable(value):
+    if isinstance(value, FieldFile):
+        return value.name
+    if isinstance(value, (dict, list)):
+        # JSON values are mutable; keep our own copy
+        return copy.deepcopy(value)
+    return value
+
+
+class ChangeTrackingMixin:
+    """
+    Remembers field values as loaded or last saved, so updates can write only
+    the fields that changed (``save_changes``) and skip no-op writes.
+    """
+
+    def _tracked_fields(self):
+        deferred = self.get_deferred_fields()
+        return [
+            field
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and not getattr(field, "auto_now", False)
+            and not getattr(field, "auto_now_add", False)
+            and field.attname not in deferred
+        ]
+
+    def _timestamp_fields(self):
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if getattr(field, "auto_now", False)
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.track_changes()
+        return instance
+
+    def track_changes(self, fields=None):
+        """Treat the current values of ``fields`` (default: all) as saved."""
+        if not hasattr(self, "_saved_values"):
+            self._saved_values = {}
+        for field in self._tracked_fields():
+            if fields is None or field.name in fields or field.attname in fields:
+                self._saved_values[field.attname] = _comparable(getattr(self, field.attname))
+
+    def changed_fields(self):
+        """Names of the fields whose value differs from the saved one."""
+        saved = getattr(self, "_saved_values", {})
+        return [
+            field.name
+            for field in self._tracked_fields()
+            if field.attname not in saved
+            or saved[field.attname] != _comparable(getattr(self, field.attname))
+        ]
+
+    def _changes_to_save(self):
+        if self._state.adding:
+            return self.changed_fields(), None
+        changed = self.changed_fields()
+        return changed, [*changed, *self._timestamp_fields()]
+
+    def save_changes(self, **kwargs):
+        """
+        Save only the changed fields (and ``updated_at``); write nothing if no
+        field changed. New instances are saved in full. Returns the names of
+        the changed fields.
+        """
+        changed, update_fields = self._changes_to_save()
+        if update_fields is None:
+            self.save(**kwargs)
+        elif changed:
+            self._save_fields(update_fields, **kwargs)
+        return changed
+
+    async def asave_changes(self, **kwargs):
+        """Async ``save_changes``."""
+        changed, update_fields = self._changes_to_save()
+        if update_fields is None:
+            await self.asave(**kwargs)
+        elif changed:
+            await self._asave_fields(update_fields, **kwargs)
+        return changed
+
+    def _save_fields(self, update_fields, **kwargs):
+        self.save(update_fields=update_fields, **kwargs)
+
+    async def _asave_fields(self, update_fields, **kwargs):
+        await self.asave(update_fields=update_fields, **kwargs)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.track_changes(kwargs.get("update_fields"))
+
+
+class VersionConflict(Exception):
+    """The row was written by someone else since the instance was loaded."""
+
+
+class VersionedModel(ChangeTrackingMixin, models.Model):
+    """
+    Rows carry a ``version`` that every write increments. ``save_changes`` on
+    a loaded instance is a compare-and-swap (``UPDATE ... WHERE version =
+    <loaded>``) and raises ``VersionConflict`` if the row moved on in the
+    meantime, so concurrent read-modify-write cycles cannot overwrite each
+    other. A plain ``save()`` overwrites the row and bumps ``version``.
+    Queryset updates must bump ``version`` themselves.
+    """
+
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def _tracked_fields(self):
+        return [field for field in super()._tracked_fields() if field.name != "version"]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if self._state.adding or (update_fields is not None and not update_fields):
+            return super().save(*args, update_fields=update_fields, **kwargs)
+        if update_fields is not None:
+            update_fields = [*update_fields, "version"]
+        loaded = self.version
+        # Bumped in SQL: this instance's version may already be stale
+        self.version = F("version") + 1
+        try:
+            super().save(*args, update_fields=update_fields, **kwargs)
+        except BaseException:
+            self.version = loaded
+            raise
+        self.refresh_from_db(using=kwargs.get("using"), fields=["version"])
+
+    def _save_fields(self, update_fields, using=None):
+        """Write ``update_fields`` only if the row is still at the loaded version."""
+        model = type(self)
+        using = using or router.db_for_write(model, instance=self)
+        expected = self.version
+        update_fields = frozenset(update_fields)
+        pre_save.send(
+            sender=model, instance=self, raw=False, using=using, update_fields=update_fields
+        )
+        # pre_save() stamps auto_now fields and commits pending file uploads
+        values = {
+            field.attname: field.pre_save(self, False)
+            for field in self._meta.concrete_fields
+            if field.name in update_fields
+        }
+        rows = model._base_manager.using(using)
+        if not rows.filter(pk=self.pk, version=expected).update(**values, version=expected + 1):
+            if rows.filter(pk=self.pk).exists():
+                raise VersionConflict(f"{self._meta.label} {self.pk} is no longer at version {expected}")
+            raise DatabaseError("Save with update_fields did not affect any rows.")
+        self.version = expected + 1
+        self._state.db = using
+        post_save.send(
+            sender=model,
+            instance=self,
+            created=False,
+            update_fields=update_fields,
+            raw=False,
+            using=using,
+        )
+        self.track_changes(update_fields)
+
+    async def _asave_fields(self, update_fields, using=None):
+        await sync_to_async(self._save_fields)(update_fields, using=using)
+
+
+class User(VersionedModel):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
 
@@ -13,11 +191,19 @@ class User(models.Model):
         help_text="Hashed password or placeholder; store securely."
     )
 
+    # Stored once per distinct content; see users/storage.py
     profile_picture = models.ImageField(
-        upload_to='profile_pictures/',
+        upload_to=profile_picture_upload_to,
+        storage=get_picture_storage,
         null=True,
         blank=True
     )
+    # Resized copies of profile_picture keyed by edge size in px ("40": name),
+    # filled in by the background thumbnail workers (users/thumbnails.py)
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
+    # Boolean preferences packed as bits when COMPACT_PREFERENCE_FLAGS is on
+    # (users/flags.py); NULL until the user is packed
+    preference_flags = PreferenceFlagsField(null=True, blank=True, default=None)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -26,7 +212,7 @@ class User(models.Model):
         return self.email
 
 
-class UserNotificationSettings(models.Model):
+class UserNotificationSettings(VersionedModel):
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -50,7 +236,7 @@ class UserNotificationSettings(models.Model):
         return f"Notification settings for {self.user.email}"
 
 
-class UserThemeSettings(models.Model):
+class UserThemeSettings(VersionedModel):
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -93,7 +279,7 @@ class UserThemeSettings(models.Model):
         return f"Theme settings for {self.user.email}"
 
 
-class UserPrivacySettings(models.Model):
+class UserPrivacySettings(VersionedModel):
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
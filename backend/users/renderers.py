@@ -0,0 +1,53 @@
+"""
+JSON encoding for API responses.
+
+``JSON_ENCODER`` selects the backend: ``"orjson"`` when that package is
+installed (several times faster than the standard library, and it returns
+bytes directly), ``"json"`` for the standard library, or ``"auto"`` (the
+default) for orjson with a fallback to ``json``. Both backends accept the
+same payloads and format datetimes and decimals identically.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+# Decimals, lazy strings and (passed through) datetimes are formatted exactly
+# as DjangoJSONEncoder formats them
+_django_encoder = DjangoJSONEncoder()
+
+
+def backend():
+    choice = settings.JSON_ENCODER
+    if choice == "orjson" and orjson is None:
+        raise RuntimeError("JSON_ENCODER = 'orjson' but orjson is not installed")
+    if choice in ("orjson", "auto") and orjson is not None:
+        return "orjson"
+    return "json"
+
+
+def dumps(data):
+    """Encode ``data`` to JSON bytes with the configured backend."""
+    if backend() == "orjson":
+        return orjson.dumps(data, default=_django_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class JsonResponse(HttpResponse):
+    """Drop-in for ``django.http.JsonResponse`` encoding with ``dumps``."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
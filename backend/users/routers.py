@@ -0,0 +1,101 @@
+"""
+Primary/replica database routing.
+
+Writes always go to ``default``. Reads go to a random alias from
+``DATABASE_REPLICAS`` unless the current request is pinned to the primary:
+
+* requests with a non-safe method (other than views marked
+  ``replica_reads``) read from the primary, so they see their own writes;
+* after a successful write for a user, reads of that user (the ``pk`` URL
+  argument) stay on the primary for ``REPLICA_PIN_SECONDS``, covering
+  replication lag. Pins live in the ``REPLICA_PIN_CACHE`` cache so every
+  worker process sees them when that cache is shared.
+
+Code outside a request (management commands, scripts) reads from replicas
+unless it runs inside ``use_primary()``.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+
+class RoutingState:
+    """Per-request routing decision, shared with threads running the request."""
+
+    def __init__(self, primary=False):
+        self.primary = primary
+
+
+_state = ContextVar("users_routing_state", default=None)
+
+
+def pin_key(user_id):
+    return f"replica-pin:user:{user_id}"
+
+
+def pin(user_ids):
+    """Keep reads of ``user_ids`` on the primary for ``REPLICA_PIN_SECONDS``."""
+    if settings.DATABASE_REPLICAS and settings.REPLICA_PIN_SECONDS:
+        caches[settings.REPLICA_PIN_CACHE].set_many(
+            {pin_key(user_id): True for user_id in user_ids},
+            timeout=settings.REPLICA_PIN_SECONDS,
+        )
+
+
+def is_pinned(user_id):
+    return bool(caches[settings.REPLICA_PIN_CACHE].get(pin_key(user_id)))
+
+
+def use_primary_for_request():
+    state = _state.get()
+    if state is not None:
+        state.primary = True
+
+
+@contextmanager
+def use_primary():
+    """Route every read in the block to the primary."""
+    token = _state.set(RoutingState(primary=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def routing_state():
+    token = _state.set(RoutingState())
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+def replica_reads(view):
+    """Mark a view that only reads, whatever its HTTP method."""
+    view.replica_reads = True
+    return view
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        state = _state.get()
+        if not replicas or (state is not None and state.primary):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Related objects come from wherever their instance was loaded
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
@@ -0,0 +1,106 @@
+"""
+JSON representations of users and their settings, shared by views and services.
+
+Each resource declares its fields once in a ``Serializer``. The serializer
+compiles two extraction functions from that list: one reading model
+instances and one reading ``.values()`` rows (optionally with a column
+prefix such as ``"theme_settings__"``), so bulk paths can skip model
+instantiation. Both produce the same dict.
+"""
+from .storage import picture_storage
+
+
+def picture_url(value):
+    # FieldFile on instances, the stored name in .values() rows
+    name = getattr(value, "name", value)
+    return picture_storage.url(name) if name else None
+
+
+def variant_urls(variants):
+    # {"40": url, "80": url, ...}; empty until the thumbnail job has run
+    return {size: picture_storage.url(name) for size, name in (variants or {}).items()}
+
+
+class Serializer:
+    """
+    ``fields`` lists output keys, or ``(key, source)`` pairs when the
+    attribute/column differs from the key. ``converters`` maps keys to
+    functions applied to the source value.
+    """
+
+    def __init__(self, fields, converters=None):
+        self.fields = tuple(
+            (field, field) if isinstance(field, str) else tuple(field) for field in fields
+        )
+        self.converters = dict(converters or {})
+        self.serialize = self._compile(lambda source: f"obj.{source}")
+        self._row_extractors = {}
+
+    @property
+    def sources(self):
+        return [source for _, source in self.fields]
+
+    def row_serializer(self, prefix=""):
+        """
+        Return a function serializing ``.values()`` rows whose columns are the
+        field sources with ``prefix`` prepended. Compiled once per prefix.
+        """
+        extract = self._row_extractors.get(prefix)
+        if extract is None:
+            extract = self._row_extractors[prefix] = self._compile(
+                lambda source: f"obj[{prefix + source!r}]"
+            )
+        return extract
+
+    def from_row(self, row, prefix=""):
+        return self.row_serializer(prefix)(row)
+
+    def _compile(self, access):
+        namespace = {}
+        items = []
+        for index, (key, source) in enumerate(self.fields):
+            expression = access(source)
+            if key in self.converters:
+                namespace[f"_convert{index}"] = self.converters[key]
+                expression = f"_convert{index}({expression})"
+            items.append(f"{key!r}: {expression}")
+        # A single dict display is the cheapest way to build the payload
+        source = "def extract(obj):\n    return {" + ", ".join(items) + "}\n"
+        exec(compile(source, f"<serializer {', '.join(self.sources)}>", "exec"), namespace)
+        return namespace["extract"]
+
+
+SERIALIZERS = {
+    "user": Serializer(
+        (
+            "id",
+            "email",
+            "first_name",
+            "last_name",
+            "profile_picture",
+            "profile_picture_variants",
+        ),
+        converters={
+            "profile_picture": picture_url,
+            "profile_picture_variants": variant_urls,
+        },
+    ),
+    "notifications": Serializer(
+        (
+            "user_id",
+            "push_messages",
+            "push_comments",
+            "push_reminders",
+            "email_news",
+            "email_messages",
+            "email_reminders",
+        )
+    ),
+    "theme": Serializer(("user_id", "skin", "primary_color", "font_family")),
+    "privacy": Serializer(("user_id", "profile_visibility", "show_email", "data_sharing")),
+}
+
+serialize_user = SERIALIZERS["user"].serialize
+serialize_notification_settings = SERIALIZERS["notifications"].serialize
+serialize_theme_settings = SERIALIZERS["theme"].serialize
+serialize_privacy_settings = SERIALIZERS["privacy"].serialize
@@ -0,0 +1,479 @@
+"""
+Python-level preference services used by views and background workers.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import flags
+from .cache import invalidate_many
+from .routers import pin, use_primary
+from .models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+    VersionConflict,
+)
+from .serializers import SERIALIZERS
+
+# (related_name on User, settings model) for each preference group
+SETTINGS_RELATIONS = (
+    ("notification_settings", UserNotificationSettings),
+    ("theme_settings", UserThemeSettings),
+    ("privacy_settings", UserPrivacySettings),
+)
+
+# Request/response key for each settings model in bulk payloads
+SETTINGS_GROUPS = {
+    "notifications": UserNotificationSettings,
+    "theme": UserThemeSettings,
+    "privacy": UserPrivacySettings,
+}
+
+GROUP_NAMES = {model: group for group, model in SETTINGS_GROUPS.items()}
+
+# Settings relations holding at least one boolean that flags.FLAGS packs
+FLAG_RELATIONS = tuple(
+    related_name
+    for related_name, model in SETTINGS_RELATIONS
+    if flags.group_fields(GROUP_NAMES[model])
+)
+
+# Keeps the number of bound parameters per query well below SQLite's limit
+BULK_CHUNK_SIZE = 500
+
+
+def flag_backed(model):
+    """True if every writable field of ``model`` is stored as a flag."""
+    return set(writable_fields(model)) <= set(flags.group_fields(GROUP_NAMES[model]))
+
+
+def with_flags(settings, user):
+    """
+    In compact mode, overlay the booleans packed in ``user.preference_flags``
+    onto ``settings``. Users that are not packed yet keep their row values.
+    """
+    group = GROUP_NAMES[type(settings)]
+    if not flags.enabled() or user.preference_flags is None or not flags.group_fields(group):
+        return settings
+    values = flags.unpack(user.preference_flags, group)
+    for name, value in values.items():
+        setattr(settings, name, value)
+    # The packed values are the stored ones, not changes
+    settings.track_changes(list(values))
+    # Flag writes bump the user's updated_at; ETag/Last-Modified follow it
+    if settings.updated_at is None or settings.updated_at < user.updated_at:
+        settings.updated_at = user.updated_at
+    # Flag writes are compare-and-swap on the user's version (see save_settings)
+    settings._flags_version = user.version
+    return settings
+
+
+def _unsaved_default(model, user):
+    settings = model(user=user)
+    # Updates compare against the defaults the user is served
+    settings.track_changes()
+    return settings
+
+
+def settings_or_default(model, user):
+    """
+    Return the saved ``model`` settings row for ``user``, or an unsaved
+    instance carrying the model defaults. Never writes.
+    """
+    if flags.enabled() and user.preference_flags is not None and flag_backed(model):
+        return with_flags(_unsaved_default(model, user), user)
+    try:
+        settings = model.objects.get(user_id=user.pk)
+    except model.DoesNotExist:
+        settings = _unsaved_default(model, user)
+    return with_flags(settings, user)
+
+
+async def asettings_or_default(model, user):
+    """Async ``settings_or_default``."""
+    if flags.enabled() and user.preference_flags is not None and flag_backed(model):
+        return with_flags(_unsaved_default(model, user), user)
+    try:
+        settings = await model.objects.aget(user_id=user.pk)
+    except model.DoesNotExist:
+        settings = _unsaved_default(model, user)
+    return with_flags(settings, user)
+
+
+def save_settings(settings):
+    """
+    Save settings from ``settings_or_default``, writing only the fields that
+    changed (booleans are packed in compact mode); a missing row is created
+    unless every changed field is a flag. Nothing is written when nothing
+    changed. Writes are compare-and-swap on the loaded versions and raise
+    ``VersionConflict`` if the row or the user's flags moved on.
+    Returns the names of the changed fields.
+    """
+    if not flags.enabled():
+        return settings.save_changes()
+
+    changed = settings.changed_fields()
+    if not changed:
+        return changed
+    model = type(settings)
+    group = GROUP_NAMES[model]
+    flag_names = set(flags.group_fields(group))
+    with transaction.atomic():
+        if not flag_backed(model) and any(name not in flag_names for name in changed):
+            settings.save_changes()
+        values = {f"{group}.{name}": getattr(settings, name) for name in changed if name in flag_names}
+        if values:
+            now = timezone.now()
+            versions = {}
+            if hasattr(settings, "_flags_version"):
+                versions[settings.user_id] = settings._flags_version
+            write_flags({settings.user_id: values}, now=now, versions=versions)
+            # As with_flags will report it once reloaded
+            settings.updated_at = now
+            if versions:
+                settings._flags_version += 1
+    settings.track_changes()
+    return changed
+
+
+def row_flags(user):
+    """
+    Pack ``user``'s booleans as stored in the settings rows (defaults for
+    missing rows). ``user`` should be loaded with ``FLAG_RELATIONS``.
+    """
+    values = {}
+    for related_name, model in SETTINGS_RELATIONS:
+        group = GROUP_NAMES[model]
+        try:
+            settings = getattr(user, related_name)
+        except model.DoesNotExist:
+            settings = model(user=user)
+        values.update(
+            (f"{group}.{name}", getattr(settings, name)) for name in flags.group_fields(group)
+        )
+    return flags.pack(values)
+
+
+def invalidate_flags(user_ids):
+    invalidate_many(User, user_ids)
+    for related_name, model in SETTINGS_RELATIONS:
+        if related_name in FLAG_RELATIONS:
+            invalidate_many(model, user_ids, field="user_id")
+
+
+def write_flags(values_by_user, now=None, versions=None, stamps=None):
+    """
+    Write ``{user_id: {"notifications.email_news": False, ...}}`` to
+    ``User.preference_flags``. Packed users are updated with bitwise
+    expressions, one UPDATE per distinct change set, so concurrent writes to
+    other bits are not lost. Unpacked users are packed from their rows first.
+
+    Users in ``versions`` (``{user_id: version}``) are written only if their
+    row is still at that version, else ``VersionConflict`` is raised.
+    Users in ``stamps`` get ``stamps[user_id]`` rather than ``now`` as
+    ``updated_at``. Returns the number of users written.
+    """
+    now = now or timezone.now()
+    versions = versions or {}
+    stamps = stamps or {}
+    written = set()
+    unpacked = User.objects.filter(
+        pk__in=list(values_by_user), preference_flags__isnull=True
+    ).select_related(*FLAG_RELATIONS)
+    for user in unpacked:
+        value = flags.pack(values_by_user[user.pk], base=row_flags(user))
+        # A concurrent writer may have packed the user in the meantime
+        if User.objects.filter(pk=user.pk, preference_flags__isnull=True).update(
+            preference_flags=value, updated_at=stamps.get(user.pk, now), version=F("version") + 1
+        ):
+            written.add(user.pk)
+
+    by_masks = defaultdict(list)
+    for user_id, values in values_by_user.items():
+        if user_id not in written:
+            by_masks[flags.masks(values), versions.get(user_id), stamps.get(user_id, now)].append(
+                user_id
+            )
+    for ((set_bits, clear_bits), version, stamp), user_ids in by_masks.items():
+        queryset = User.objects.filter(pk__in=user_ids, preference_flags__isnull=False)
+        if version is not None:
+            queryset = queryset.filter(version=version)
+        updated = queryset.update(
+            preference_flags=F("preference_flags").bitand(flags.keep_mask(clear_bits)).bitor(set_bits),
+            updated_at=stamp,
+            version=F("version") + 1,
+        )
+        if version is not None and not updated:
+            raise VersionConflict(f"User {user_ids[0]} is no longer at version {version}")
+        written.update(user_ids)
+
+    transaction.on_commit(lambda user_ids=list(values_by_user): invalidate_flags(user_ids))
+    return len(written)
+
+
+def settings_or_defaults(user):
+    """
+    Return ``(notifications, theme, privacy)`` for a user loaded with
+    ``select_related`` over the settings relations. Groups without a row are
+    returned as unsaved instances carrying the model defaults.
+    """
+    groups = []
+    for related_name, model in SETTINGS_RELATIONS:
+        try:
+            settings = getattr(user, related_name)
+        except model.DoesNotExist:
+            settings = model(user=user)
+        groups.append(with_flags(settings, user))
+    return tuple(groups)
+
+
+def iter_bulk_preferences(user_ids, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Yield ``(user_id, preferences)`` for every existing user in ``user_ids``.
+
+    Ids are de-duplicated and processed ``chunk_size`` at a time, one joined
+    ``IN`` query per chunk. Rows are read with ``.values()`` and serialized
+    straight from them, without building model instances. Unknown ids are
+    skipped.
+    """
+    groups = []
+    columns = ["pk", "preference_flags"]
+    for related_name, model in SETTINGS_RELATIONS:
+        group = GROUP_NAMES[model]
+        serializer = SERIALIZERS[group]
+        prefix = f"{related_name}__"
+        # Users without a row get the serialized model defaults
+        defaults = serializer.serialize(model())
+        packed = flags.enabled() and bool(flags.group_fields(group))
+        groups.append((group, prefix, serializer.row_serializer(prefix), defaults, packed))
+        columns.append(f"{prefix}id")
+        columns.extend(prefix + source for source in serializer.sources)
+
+    ids = list(dict.fromkeys(int(pk) for pk in user_ids))
+    for start in range(0, len(ids), chunk_size):
+        rows = User.objects.filter(pk__in=ids[start:start + chunk_size]).values(*columns)
+        for row in rows:
+            preferences = {}
+            for group, prefix, serialize, defaults, packed in groups:
+                if row[f"{prefix}id"] is None:
+                    payload = {**defaults, "user_id": row["pk"]}
+                else:
+                    payload = serialize(row)
+                if packed and row["preference_flags"] is not None:
+                    payload.update(flags.unpack(row["preference_flags"], group))
+                preferences[group] = payload
+            yield row["pk"], preferences
+
+
+def get_bulk_preferences(user_ids, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Return ``{user_id: preferences}`` for all existing users in ``user_ids``.
+    See ``iter_bulk_preferences``; use that directly for very large id lists
+    to avoid holding every result in memory.
+    """
+    return dict(iter_bulk_preferences(user_ids, chunk_size=chunk_size))
+
+
+def writable_fields(model):
+    """Return ``{name: field}`` for the user-editable fields of a settings model."""
+    return {
+        field.name: field
+        for field in model._meta.concrete_fields
+        if field.name not in ("id", "user", "version", "created_at", "updated_at")
+    }
+
+
+def validate_settings_changes(item):
+    """
+    Validate one bulk write item of the form
+    ``{"user_id": 1, "notifications": {...}, "theme": {...}, "privacy": {...}}``.
+
+    Returns ``(user_id, changes, errors)`` where ``changes`` maps group names
+    to cleaned ``{field: value}`` dicts and ``errors`` maps offending keys
+    (``"theme.skin"``) to messages.
+    """
+    if not isinstance(item, dict):
+        return None, {}, {"item": "Expected an object"}
+
+    user_id = item.get("user_id")
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        return None, {}, {"user_id": "Expected an integer"}
+
+    changes = {}
+    errors = {}
+    for group, model in SETTINGS_GROUPS.items():
+        values = item.get(group)
+        if values is None:
+            continue
+        if not isinstance(values, dict):
+            errors[group] = "Expected an object"
+            continue
+        fields = writable_fields(model)
+        for name, value in values.items():
+            key = f"{group}.{name}"
+            if name not in fields:
+                errors[key] = "Unknown field"
+                continue
+            try:
+                changes.setdefault(group, {})[name] = fields[name].clean(value, None)
+            except ValidationError as exc:
+                errors[key] = " ".join(exc.messages)
+    return user_id, changes, errors
+
+
+def apply_settings_changes(model, changes_by_user, now, stamps=None):
+    """
+    Write ``{user_id: {field: value}}`` for one settings model. Missing rows
+    are bulk-created; users sharing an identical change set are updated with
+    a single ``UPDATE ... WHERE user_id IN (...)``, the rest via
+    ``bulk_update`` grouped by the set of changed fields. Rows get
+    ``updated_at = now``, or ``stamps[user_id]`` for users in ``stamps``.
+    Returns ``(created, updated)``.
+    """
+    stamps = stamps or {}
+    row_ids = dict(
+        model.objects.filter(user_id__in=list(changes_by_user)).values_list("user_id", "pk")
+    )
+    new_rows = [
+        model(user_id=user_id, **changes)
+        for user_id, changes in changes_by_user.items()
+        if user_id not in row_ids
+    ]
+    model.objects.bulk_create(new_rows)
+    _restamp_created(model, [row for row in new_rows if row.user_id in stamps], stamps)
+
+    by_changes = defaultdict(list)
+    for user_id, changes in changes_by_user.items():
+        if user_id in row_ids:
+            by_changes[tuple(sorted(changes.items())), stamps.get(user_id, now)].append(user_id)
+
+    singles = defaultdict(list)
+    for (key, stamp), user_ids in by_changes.items():
+        changes = dict(key)
+        if len(user_ids) > 1:
+            model.objects.filter(user_id__in=user_ids).update(
+                updated_at=stamp, version=F("version") + 1, **changes
+            )
+        else:
+            obj = model(
+                pk=row_ids[user_ids[0]], updated_at=stamp, version=F("version") + 1, **changes
+            )
+            singles[tuple(sorted(changes))].append(obj)
+    for fields, objs in singles.items():
+        model.objects.bulk_update(objs, [*fields, "updated_at", "version"])
+
+    return len(new_rows), len(changes_by_user) - len(new_rows)
+
+
+def _restamp_created(model, rows, stamps):
+    # bulk_create() stamps auto_now fields with the current time
+    if not rows:
+        return
+    if any(row.pk is None for row in rows):
+        # Backends that cannot return ids from a bulk insert
+        row_ids = dict(
+            model.objects.filter(user_id__in=[row.user_id for row in rows]).values_list(
+                "user_id", "pk"
+            )
+        )
+        for row in rows:
+            row.pk = row_ids[row.user_id]
+    for row in rows:
+        row.updated_at = stamps[row.user_id]
+    model.objects.bulk_update(rows, ["updated_at"])
+
+
+def _split_flag_changes(group, changes_by_user, flag_values):
+    """
+    Move the changes to flag fields of ``group`` into ``flag_values``
+    (``{user_id: {dotted_name: bool}}``); return the remaining row changes.
+    """
+    names = set(flags.group_fields(group))
+    row_changes = {}
+    for user_id, changes in changes_by_user.items():
+        for name, value in changes.items():
+            if name in names:
+                flag_values[user_id][f"{group}.{name}"] = value
+            else:
+                row_changes.setdefault(user_id, {})[name] = value
+    return row_changes
+
+
+def bulk_update_settings(items, chunk_size=BULK_CHUNK_SIZE, stamps=None):
+    """
+    Apply many settings changes at once.
+
+    ``items`` is an iterable of dicts as accepted by
+    ``validate_settings_changes``. Invalid items and items for unknown users
+    are skipped and reported; later items for the same user override earlier
+    ones. Valid changes are written ``chunk_size`` users at a time, each chunk
+    in its own transaction, and affected cache entries are invalidated once
+    the chunk commits. Written rows get the current time as ``updated_at``,
+    or ``stamps[user_id]`` (a datetime) for users in ``stamps``.
+
+    Returns ``{"created": n, "updated": n, "errors": [...]}`` where ``created``
+    and ``updated`` count settings rows (plus, in compact mode, users whose
+    flags were written, as ``updated``) and each error is
+    ``{"index": i, "user_id": id, "errors": {...}}``.
+    """
+    errors = []
+    pending = {}
+    indexes = defaultdict(list)
+    for index, item in enumerate(items):
+        user_id, changes, item_errors = validate_settings_changes(item)
+        if item_errors:
+            errors.append({"index": index, "user_id": user_id, "errors": item_errors})
+            continue
+        indexes[user_id].append(index)
+        merged = pending.setdefault(user_id, {})
+        for group, values in changes.items():
+            merged.setdefault(group, {}).update(values)
+
+    created = updated = 0
+    user_ids = list(pending)
+    # Existing rows must be read where they are written
+    with use_primary():
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            existing = set(User.objects.filter(pk__in=chunk).values_list("pk", flat=True))
+            for user_id in chunk:
+                if user_id not in existing:
+                    errors.extend(
+                        {"index": index, "user_id": user_id, "errors": {"user_id": "User not found"}}
+                        for index in indexes[user_id]
+                    )
+
+            now = timezone.now()
+            with transaction.atomic():
+                flag_values = defaultdict(dict)
+                for group, model in SETTINGS_GROUPS.items():
+                    changes_by_user = {
+                        user_id: pending[user_id][group]
+                        for user_id in chunk
+                        if user_id in existing and group in pending[user_id]
+                    }
+                    if flags.enabled():
+                        changes_by_user = _split_flag_changes(group, changes_by_user, flag_values)
+                    if not changes_by_user:
+                        continue
+                    group_created, group_updated = apply_settings_changes(
+                        model, changes_by_user, now, stamps
+                    )
+                    created += group_created
+                    updated += group_updated
+                    transaction.on_commit(
+                        lambda model=model, keys=list(changes_by_user): invalidate_many(
+                            model, keys, field="user_id"
+                        )
+                    )
+                if flag_values:
+                    updated += write_flags(flag_values, now, stamps=stamps)
+                transaction.on_commit(lambda chunk=chunk: pin(chunk))
+
+    errors.sort(key=lambda error: error["index"])
+    return {"created": created, "updated": updated, "errors": errors}
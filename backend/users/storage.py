@@ -0,0 +1,63 @@
+"""
+Content-addressed storage for profile pictures.
+
+Uploads are named after the SHA-256 of their bytes
+(``profile_pictures/3f/3fa9...c1.png``), so identical images uploaded by many
+users are stored once, and a name that already exists is never rewritten.
+Variants (users/thumbnails.py) are named after their original and are
+therefore content-derived too. Files are shared, so nothing deletes them on
+replacement; ``manage.py gc_media`` reclaims files no user references.
+Saving a name that exists refreshes its modification time, which is the age
+``gc_media --min-age`` checks before deleting.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage for content-derived names: an existing name already
+    holds the same bytes, so saving it again is a no-op.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            try:
+                # A new reference: restart the age gc_media waits for
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Collected in the meantime; write it again
+                pass
+        # Write under a unique temporary name and move it into place, so a
+        # concurrent upload of the same content cannot leave a partial file.
+        temporary = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+picture_storage = ContentAddressedStorage()
+
+
+def get_picture_storage():
+    return picture_storage
+
+
+def content_addressed_name(directory, content, filename):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    checksum = digest.hexdigest()
+    extension = os.path.splitext(filename)[1].lower()
+    return f"{directory}/{checksum[:2]}/{checksum}{extension}"
+
+
+def profile_picture_upload_to(instance, filename):
+    return content_addressed_name("profile_pictures", instance.profile_picture, filename)
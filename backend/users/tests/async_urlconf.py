@@ -0,0 +1,6 @@
+"""Root URLconf serving users.async_urls, as config/urls.py does under ASGI."""
+from django.urls import include, path
+
+urlpatterns = [
+    path("api/users/", include("users.async_urls")),
+]
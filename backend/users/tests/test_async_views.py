@@ -0,0 +1,125 @@
+import json
+from django.contrib.auth.hashers import check_password, make_password
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+
+from users import async_views, cache, export, throttle
+from users.models import User, UserNotificationSettings, UserPrivacySettings
+
+
+@override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.reset()
+        self.user = User.objects.create(
+            email="async@example.com",
+            first_name="Async",
+            last_name="User",
+            password=make_password("oldpass123"),
+        )
+
+    def test_routes_resolve_to_async_views(self):
+        match = resolve(reverse("get_notification_settings", args=[self.user.id]))
+        self.assertIs(match.func, async_views.get_notification_settings)
+
+    async def test_get_user(self):
+        resp = await self.async_client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["email"], "async@example.com")
+        missing = await self.async_client.get(reverse("get_user", args=[999]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_settings_defaults_then_update(self):
+        url = reverse("get_notification_settings", args=[self.user.id])
+        resp = await self.async_client.get(url)
+        self.assertTrue(resp.json()["email_news"])
+        self.assertFalse(
+            await UserNotificationSettings.objects.filter(user=self.user).aexists()
+        )
+
+        resp = await self.async_client.put(
+            reverse("update_notification_settings", args=[self.user.id]),
+            data=json.dumps({"email_news": False}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        # Invalidation runs on commit, which the test transaction never reaches
+        cache.clear()
+        resp = await self.async_client.get(url)
+        self.assertFalse(resp.json()["email_news"])
+
+    async def test_updates_report_changed_fields(self):
+        url = reverse("update_privacy_settings", args=[self.user.id])
+        payload = json.dumps({"show_email": True, "data_sharing": False})
+        resp = await self.async_client.put(url, data=payload, content_type="application/json")
+        self.assertEqual(resp.json()["changed_fields"], ["show_email"])
+        resp = await self.async_client.put(url, data=payload, content_type="application/json")
+        self.assertEqual(resp.json()["changed_fields"], [])
+
+        resp = await self.async_client.put(
+            reverse("update_user", args=[self.user.id]),
+            data=json.dumps({"first_name": "Async"}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["changed_fields"], [])
+
+    async def test_conditional_get(self):
+        url = reverse("get_theme_settings", args=[self.user.id])
+        etag = (await self.async_client.get(url))["ETag"]
+        resp = await self.async_client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+    async def test_update_user_duplicate_email(self):
+        await User.objects.acreate(email="taken@example.com")
+        resp = await self.async_client.put(
+            reverse("update_user", args=[self.user.id]),
+            data=json.dumps({"email": "taken@example.com"}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["error"]["code"], "duplicate_email")
+
+    async def test_update_password(self):
+        resp = await self.async_client.put(
+            reverse("update_password", args=[self.user.id]),
+            data=json.dumps(
+                {
+                    "current_password": "oldpass123",
+                    "new_password": "newpass123",
+                    "confirm_password": "newpass123",
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        await self.user.arefresh_from_db()
+        self.assertTrue(check_password("newpass123", self.user.password))
+
+    @override_settings(EXPORT_API_TOKEN="export-secret")
+    async def test_export_is_streamed_asynchronously(self):
+        for i in range(4):
+            await User.objects.acreate(email=f"aexport{i}@example.com")
+        auth = {"authorization": "Bearer export-secret"}
+        resp = await self.async_client.get(reverse("export_users"), headers=auth)
+        self.assertTrue(resp.is_async)
+        self.assertIn("X-Export-Cursor", resp)
+        body = b"".join([chunk async for chunk in resp.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 5)
+
+        resp = await self.async_client.get(reverse("export_users"), {"format": "csv"}, headers=auth)
+        rows = b"".join([chunk async for chunk in resp.streaming_content]).decode().splitlines()
+        self.assertEqual(rows[0], ",".join(export.CSV_HEADER))
+        self.assertEqual(len(rows), 6)
+
+        resp = await self.async_client.get(reverse("export_users"), {"format": "xml"}, headers=auth)
+        self.assertEqual(resp.json()["error"]["code"], "invalid_format")
+
+    async def test_preferences(self):
+        await UserPrivacySettings.objects.acreate(user=self.user, show_email=True)
+        resp = await self.async_client.get(reverse("get_preferences", args=[self.user.id]))
+        self.assertTrue(resp.json()["privacy"]["show_email"])
+
+    async def test_cors_preflight(self):
+        resp = await self.async_client.options(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Access-Control-Allow-Origin"], "*")
@@ -0,0 +1,95 @@
+import json
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache
+from users.models import User, UserNotificationSettings, UserThemeSettings
+
+
+class PreferenceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.stats.reset()
+        self.user = User.objects.create(
+            email="cache@example.com", first_name="Cache", last_name="User"
+        )
+
+    def test_second_read_is_served_from_cache(self):
+        url = reverse("get_notification_settings", args=[self.user.id])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()["email_news"])
+        self.assertEqual(cache.stats.hits, 2)
+
+    def test_update_view_invalidates(self):
+        get_url = reverse("get_theme_settings", args=[self.user.id])
+        self.client.get(get_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                reverse("update_theme_settings", args=[self.user.id]),
+                data=json.dumps({"skin": "flat"}),
+                content_type="application/json",
+            )
+        self.assertEqual(self.client.get(get_url).json()["skin"], "flat")
+
+    def test_model_save_and_delete_invalidate(self):
+        url = reverse("get_user", args=[self.user.id])
+        self.client.get(url)
+        self.user.first_name = "Changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(url).json()["first_name"], "Changed")
+
+        self.client.get(reverse("get_notification_settings", args=[self.user.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserNotificationSettings.objects.filter(user=self.user).delete()
+            self.user.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalidation_waits_for_commit(self):
+        settings = UserThemeSettings.objects.create(user=self.user)
+        self.client.get(reverse("get_theme_settings", args=[self.user.id]))
+        key = cache.cache_key(UserThemeSettings, self.user.id, field="user_id")
+        with self.captureOnCommitCallbacks() as callbacks:
+            settings.skin = "flat"
+            settings.save()
+        # Reads before the commit may still be served the committed row
+        self.assertIsNotNone(cache.get_cache().get(key))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get_cache().get(key))
+
+    def test_missing_user_is_not_cached(self):
+        url = reverse("get_user", args=[self.user.id + 1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(cache.stats.misses, 2)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "preferences": {
+                "BACKEND": "users.cache.LRUCache",
+                "LOCATION": "preferences-small",
+                "OPTIONS": {"MAX_ENTRIES": 2},
+            },
+        }
+    )
+    def test_lru_evicts_least_recently_used(self):
+        for model, pk in ((User, 1), (User, 2)):
+            cache.read_through(model, pk, lambda: object)
+        cache.read_through(User, 1, lambda: object)
+        cache.read_through(UserThemeSettings, 1, lambda: object, field="user_id")
+        self.assertEqual(cache.stats.evictions, 1)
+        backend = cache.get_cache()
+        self.assertTrue(backend.has_key(cache.cache_key(User, 1)))
+        self.assertFalse(backend.has_key(cache.cache_key(User, 2)))
+
+    @override_settings(PREFERENCES_CACHE=None)
+    def test_disabled_cache_reads_database(self):
+        url = reverse("get_user", args=[self.user.id])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            self.client.get(url)
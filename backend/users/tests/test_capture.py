@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, capture, throttle
+from users.models import User
+
+
+@override_settings(EXPORT_API_TOKEN="export-secret", THUMBNAIL_WORKERS=0)
+class TrafficCaptureTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.reset()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "captures", "traffic.jsonl")
+        override = override_settings(TRAFFIC_CAPTURE_PATH=self.path, MEDIA_ROOT=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(capture.close)
+        self.user = User.objects.create(email="capture@example.com", first_name="Cap")
+
+    def records(self):
+        with open(self.path) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_middleware_is_unused_without_a_path(self):
+        self.assertIn("users.middleware.TrafficCaptureMiddleware", settings.MIDDLEWARE)
+        with self.settings(TRAFFIC_CAPTURE_PATH=""):
+            self.client_class().get(reverse("get_user", args=[self.user.id]))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_requests_are_recorded_sanitized(self):
+        resp = self.client.get(
+            reverse("get_user", args=[self.user.id]),
+            headers={"accept-encoding": "gzip", "cookie": "sessionid=abc"},
+        )
+        self.client.put(
+            reverse("update_user", args=[self.user.id]),
+            data=json.dumps({"email": "Renamed@Example.com", "first_name": "Re", "age": 3}),
+            content_type="application/json",
+        )
+        self.client.put(
+            reverse("update_password", args=[self.user.id]),
+            data=json.dumps({"current_password": "a", "new_password": "b"}),
+            content_type="application/json",
+        )
+
+        read, update, password = self.records()
+        self.assertEqual(read["method"], "GET")
+        self.assertEqual(read["path"], f"/api/users/{self.user.id}/")
+        self.assertEqual(read["route"], "get_user")
+        self.assertEqual(read["status"], 200)
+        self.assertEqual(read["response_bytes"], len(resp.content))
+        self.assertEqual(read["headers"], {"accept-encoding": "gzip"})
+        self.assertGreater(read["duration_ms"], 0)
+
+        self.assertEqual(update["route"], "update_user")
+        self.assertEqual(
+            update["body"],
+            {"email": capture.pseudonym("renamed@example.com"), "first_name": "[redacted]", "age": 3},
+        )
+        self.assertTrue(update["body"]["email"].endswith("@example.invalid"))
+        self.assertEqual(
+            password["body"], {"current_password": "[redacted]", "new_password": "[redacted]"}
+        )
+        with open(self.path) as fh:
+            self.assertNotIn("capture@example.com", fh.read())
+
+    def test_credentials_and_streamed_sizes(self):
+        resp = self.client.get(
+            reverse("export_users") + "?format=csv&token=abc",
+            headers={"authorization": "Bearer export-secret"},
+        )
+        # Written once the stream has been sent
+        self.assertFalse(os.path.exists(self.path))
+        body = b"".join(resp.streaming_content)
+
+        (record,) = self.records()
+        self.assertEqual(record["headers"], {"authorization": "[redacted]"})
+        self.assertEqual(record["query"], "format=csv&token=%5Bredacted%5D")
+        self.assertEqual(record["response_bytes"], len(body))
+
+    def test_uploads_are_recorded_by_size(self):
+        upload = SimpleUploadedFile("a.png", b"\x89PNG\r\n\x1a\n" + bytes(92), content_type="image/png")
+        self.client.post(reverse("update_profile_picture", args=[self.user.id]), {"upload": upload})
+        (record,) = self.records()
+        self.assertEqual(record["files"], {"upload": 100})
+        self.assertIsNone(record["body"])
+        self.assertGreater(record["request_bytes"], 100)
+
+    @override_settings(TRAFFIC_CAPTURE_SAMPLE_RATE=0.0)
+    def test_sampling(self):
+        self.client.get(reverse("get_user", args=[self.user.id]))
+        self.assertFalse(os.path.exists(self.path))
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_chain(self):
+        await self.async_client.get(reverse("get_user", args=[self.user.id]))
+        (record,) = self.records()
+        self.assertEqual(record["route"], "get_user")
+        self.assertEqual(record["status"], 200)
@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from users import thumbnails
+from users.management.commands.gc_media import path_key, referenced_names
+from users.models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+)
+
+
+class BackfillSettingsCommandTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(
+                email=f"backfill{i}@example.com", first_name="Back", last_name=str(i)
+            )
+            for i in range(5)
+        ]
+        UserThemeSettings.objects.create(user=self.users[0], skin="flat")
+
+    def test_backfill_creates_missing_rows_only(self):
+        out = StringIO()
+        call_command("backfill_settings", batch_size=2, stdout=out)
+        self.assertEqual(UserNotificationSettings.objects.count(), 5)
+        self.assertEqual(UserThemeSettings.objects.count(), 5)
+        self.assertEqual(UserPrivacySettings.objects.count(), 5)
+        self.assertEqual(UserThemeSettings.objects.get(user=self.users[0]).skin, "flat")
+        self.assertIn("14 rows created", out.getvalue())
+
+        call_command("backfill_settings", stdout=out)
+        self.assertIn("Backfill complete: 0 rows created", out.getvalue())
+
+    def test_backfill_resumes_after_id(self):
+        call_command(
+            "backfill_settings", start_after=self.users[2].id, stdout=StringIO()
+        )
+        self.assertEqual(
+            sorted(UserPrivacySettings.objects.values_list("user_id", flat=True)),
+            [u.id for u in self.users[3:]],
+        )
+
+
+class ExportUsersCommandTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            User.objects.create(
+                email=f"cmdexport{i}@example.com", first_name="Cmd", last_name=str(i)
+            )
+
+    def test_export_ndjson_in_chunks(self):
+        out, err = StringIO(), StringIO()
+        with self.assertNumQueries(2):
+            call_command("export_users", chunk_size=2, stdout=out, stderr=err)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])["notifications"]["email_news"], True)
+        self.assertIn("Next cursor:", err.getvalue())
+
+    def test_export_csv_with_future_cursor_is_empty(self):
+        out = StringIO()
+        call_command(
+            "export_users",
+            format="csv",
+            since="2999-01-01T00:00:00",
+            stdout=out,
+            stderr=StringIO(),
+        )
+        self.assertEqual(out.getvalue(), "")
+
+
+class GCMediaCommandTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, THUMBNAIL_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(email="gc@example.com")
+
+    def upload(self, color):
+        buffer = BytesIO()
+        Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+        self.user.profile_picture = SimpleUploadedFile("avatar.png", buffer.getvalue())
+        self.user.save()
+        thumbnails.generate_variants(self.user.pk, self.user.profile_picture.name)
+        self.user.refresh_from_db()
+        return [self.user.profile_picture.name, *self.user.profile_picture_variants.values()]
+
+    def test_deletes_only_unreferenced_files(self):
+        storage = User._meta.get_field("profile_picture").storage
+        replaced = self.upload((255, 0, 0))
+        current = self.upload((0, 0, 255))
+
+        out = StringIO()
+        call_command("gc_media", min_age=0, batch_size=3, stdout=out)
+        self.assertTrue(all(storage.exists(name) for name in current))
+        self.assertFalse(any(storage.exists(name) for name in replaced))
+        self.assertIn(f"{len(replaced) + len(current)} scanned, {len(replaced)} deleted", out.getvalue())
+
+    def test_recent_files_and_dry_run_are_kept(self):
+        storage = User._meta.get_field("profile_picture").storage
+        replaced = self.upload((255, 0, 0))
+        self.upload((0, 0, 255))
+
+        call_command("gc_media", stdout=StringIO())
+        call_command("gc_media", min_age=0, dry_run=True, stdout=StringIO())
+        self.assertTrue(all(storage.exists(name) for name in replaced))
+
+    def test_uploading_existing_content_refreshes_its_age(self):
+        storage = User._meta.get_field("profile_picture").storage
+        name = self.upload((255, 0, 0))[0]
+        os.utime(storage.path(name), (0, 0))
+        self.upload((0, 0, 255))
+        # Another user uploads the same image; the row is not saved yet
+        storage.save(name, ContentFile(storage.open(name).read()))
+
+        call_command("gc_media", min_age=60, stdout=StringIO())
+        self.assertTrue(storage.exists(name))
+
+    def test_files_touched_after_the_reference_query_are_kept(self):
+        storage = User._meta.get_field("profile_picture").storage
+        replaced = self.upload((255, 0, 0))
+        self.upload((0, 0, 255))
+        for name in replaced:
+            os.utime(storage.path(name), (0, 0))
+
+        def query_then_upload(names):
+            keep = referenced_names(names)
+            storage.save(replaced[0], ContentFile(b""))
+            return keep
+
+        with mock.patch(
+            "users.management.commands.gc_media.referenced_names", query_then_upload
+        ):
+            call_command("gc_media", min_age=0, stdout=StringIO())
+        self.assertTrue(storage.exists(replaced[0]))
+        self.assertFalse(any(storage.exists(name) for name in replaced[1:]))
+
+    def test_limit_and_start_after_bound_a_run(self):
+        names = self.upload((255, 0, 0)) + self.upload((0, 0, 255))
+
+        out = StringIO()
+        call_command("gc_media", min_age=0, limit=2, stdout=out)
+        self.assertIn("2 scanned", out.getvalue())
+
+        last = max(names, key=path_key)
+        call_command("gc_media", min_age=0, start_after=last, stdout=out)
+        self.assertIn("0 scanned, 0 deleted", out.getvalue())
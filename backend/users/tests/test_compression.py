@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import zlib
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, compression
+from users.models import User
+
+
+class NegotiationTests(TestCase):
+    def test_preferred_accepted_codec_wins(self):
+        self.assertEqual(compression.negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(compression.negotiate("gzip;q=0, deflate"), "deflate")
+        self.assertEqual(compression.negotiate("*;q=0.5"), compression.negotiate("*"))
+        self.assertIsNone(compression.negotiate("identity"))
+        self.assertIsNone(compression.negotiate("gzip;q=0, *;q=0"))
+        self.assertIsNone(compression.negotiate(""))
+
+    @override_settings(COMPRESSION_CODECS=("deflate", "gzip"))
+    def test_server_order_decides(self):
+        self.assertEqual(compression.negotiate("gzip, deflate"), "deflate")
+
+
+@override_settings(EXPORT_API_TOKEN="export-secret")
+class CompressionMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        compression.clear()
+        compression.stats.reset()
+        self.users = [
+            User.objects.create(email=f"zip{i}@example.com", first_name="Zip", last_name=str(i))
+            for i in range(20)
+        ]
+
+    def bulk(self, **headers):
+        return self.client.post(
+            reverse("bulk_preferences"),
+            data=json.dumps({"user_ids": [user.id for user in self.users]}),
+            content_type="application/json",
+            headers=headers,
+        )
+
+    def test_large_json_is_compressed(self):
+        plain = self.bulk()
+        self.assertNotIn("Content-Encoding", plain)
+
+        resp = self.bulk(accept_encoding="gzip, deflate")
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        self.assertEqual(int(resp["Content-Length"]), len(resp.content))
+        self.assertLess(len(resp.content), len(plain.content) / 4)
+        self.assertEqual(gzip.decompress(resp.content), plain.content)
+
+        resp = self.bulk(accept_encoding="deflate")
+        self.assertEqual(zlib.decompress(resp.content), plain.content)
+
+    def test_small_responses_are_left_alone(self):
+        resp = self.client.get(
+            reverse("get_user", args=[self.users[0].id]), headers={"accept-encoding": "gzip"}
+        )
+        self.assertNotIn("Content-Encoding", resp)
+        self.assertIn("Accept-Encoding", resp["Vary"])
+
+    def test_export_stream_is_compressed(self):
+        resp = self.client.get(
+            reverse("export_users"),
+            headers={"authorization": "Bearer export-secret", "accept-encoding": "gzip"},
+        )
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        lines = gzip.decompress(b"".join(resp.streaming_content)).splitlines()
+        self.assertEqual(len(lines), len(self.users))
+
+    def test_media_is_not_recompressed(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with open(os.path.join(media_root, "photo.png"), "wb") as fh:
+            fh.write(b"\x89PNG" + bytes(4096))
+        with self.settings(MEDIA_ROOT=media_root):
+            resp = self.client.get("/media/photo.png", headers={"accept-encoding": "gzip"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Content-Encoding", resp)
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_hot_responses_are_compressed_once(self):
+        url = reverse("get_preferences", args=[self.users[0].id])
+        first = self.client.get(url, headers={"accept-encoding": "gzip"})
+        second = self.client.get(url, headers={"accept-encoding": "gzip"})
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(compression.stats.as_dict()["compressed"], 1)
+        self.assertEqual(compression.stats.as_dict()["cache_hits"], 1)
+
+        # The weakened ETag still validates conditional requests and If-Match
+        self.assertTrue(first["ETag"].startswith('W/"'))
+        resp = self.client.get(
+            url, headers={"accept-encoding": "gzip", "if-none-match": first["ETag"]}
+        )
+        self.assertEqual(resp.status_code, 304)
+        etag = self.client.get(
+            reverse("get_user", args=[self.users[0].id]), headers={"accept-encoding": "gzip"}
+        )["ETag"]
+        resp = self.client.put(
+            reverse("update_user", args=[self.users[0].id]),
+            data=json.dumps({"first_name": "Zipped"}),
+            content_type="application/json",
+            headers={"if-match": etag},
+        )
+        self.assertEqual(resp.status_code, 200)
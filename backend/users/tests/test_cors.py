@@ -0,0 +1,106 @@
+import json
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache
+from users.models import User
+
+# Browsers reuse a preflight this long when Access-Control-Max-Age is missing
+DEFAULT_PREFLIGHT_SECONDS = 5
+
+
+class Browser:
+    """
+    Cross-origin ``fetch`` as browsers do it: a JSON PUT is preceded by a
+    preflight, unless one for the same URL is still cached (for
+    ``Access-Control-Max-Age`` seconds). Counts the requests sent.
+    """
+
+    def __init__(self, client, origin):
+        self.client = client
+        self.origin = origin
+        self.preflights = {}
+        self.requests = 0
+
+    def put(self, url, payload, now):
+        if self.preflights.get(url, -1) < now:
+            resp = self.client.options(
+                url,
+                headers={
+                    "origin": self.origin,
+                    "access-control-request-method": "PUT",
+                    "access-control-request-headers": "content-type",
+                },
+            )
+            self.requests += 1
+            if resp.headers.get("Access-Control-Allow-Origin") not in ("*", self.origin):
+                raise AssertionError("Preflight refused")
+            max_age = int(resp.headers.get("Access-Control-Max-Age", DEFAULT_PREFLIGHT_SECONDS))
+            self.preflights[url] = now + max_age
+        self.requests += 1
+        return self.client.put(
+            url,
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers={"origin": self.origin},
+        )
+
+
+class CORSTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="cors@example.com")
+
+    def test_middleware_runs_first(self):
+        self.assertEqual(settings.MIDDLEWARE[0], "users.middleware.SimpleCORSMiddleware")
+
+    def test_preflight_skips_the_rest_of_the_chain(self):
+        url = reverse("update_theme_settings", args=[self.user.id])
+        with self.assertNumQueries(0):
+            resp = self.client.options(url, headers={"origin": "http://localhost:5173"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Access-Control-Allow-Origin"], "*")
+        self.assertEqual(resp["Access-Control-Max-Age"], "7200")
+        self.assertIn("If-Match", resp["Access-Control-Allow-Headers"])
+        # Set by SecurityMiddleware, which never saw the preflight
+        self.assertNotIn("X-Content-Type-Options", resp)
+
+    def test_preflight_caching_halves_requests_per_settings_save(self):
+        url = reverse("update_notification_settings", args=[self.user.id])
+        counts = {}
+        for max_age in (0, 7200):
+            with self.settings(CORS_PREFLIGHT_MAX_AGE=max_age):
+                browser = Browser(self.client_class(), "http://localhost:5173")
+                # A user toggling a switch every 30 seconds
+                for index, now in enumerate(range(0, 300, 30)):
+                    resp = browser.put(url, {"email_news": index % 2 == 0}, now)
+                    self.assertEqual(resp.status_code, 200)
+                counts[max_age] = browser.requests
+        self.assertEqual(counts, {0: 20, 7200: 11})
+
+    @override_settings(CORS_ALLOWED_ORIGINS=["https://app.example.com", "https://*.example.org"])
+    def test_allowlist(self):
+        url = reverse("get_user", args=[self.user.id])
+        for origin, allowed in (
+            ("https://app.example.com", True),
+            ("https://eu.app.example.org", True),
+            ("https://example.org", False),
+            ("https://app.example.com.evil.net", False),
+            ("http://app.example.com", False),
+        ):
+            resp = self.client.get(url, headers={"origin": origin})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Origin", resp["Vary"])
+            self.assertEqual(resp.get("Access-Control-Allow-Origin"), origin if allowed else None)
+        resp = self.client.get(url, headers={"origin": "https://app.example.com"})
+        self.assertEqual(resp["Access-Control-Expose-Headers"], "ETag, Retry-After, X-Export-Cursor")
+
+    @override_settings(CORS_ALLOWED_ORIGINS=["https://app.example.com"])
+    def test_refused_preflight_has_no_cors_headers(self):
+        resp = self.client.options(
+            reverse("update_user", args=[self.user.id]), headers={"origin": "https://evil.net"}
+        )
+        self.assertNotIn("Access-Control-Allow-Origin", resp)
+        self.assertNotIn("Access-Control-Max-Age", resp)
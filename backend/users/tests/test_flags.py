@@ -0,0 +1,221 @@
+import json
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, flags
+from users.models import User, UserNotificationSettings, UserPrivacySettings
+
+
+class FlagLayoutTests(TestCase):
+    def test_pack_and_unpack_round_trip(self):
+        value = flags.pack({"notifications.email_news": True, "privacy.show_email": True})
+        self.assertEqual(
+            flags.unpack(value, "privacy"), {"show_email": True, "data_sharing": False}
+        )
+        value = flags.pack({"notifications.email_news": False}, base=value)
+        self.assertFalse(flags.unpack(value, "notifications")["email_news"])
+        self.assertTrue(flags.unpack(value, "privacy")["show_email"])
+
+    def test_bitwise_lookups(self):
+        news = flags.mask("notifications.email_news")
+        both = flags.mask("privacy.show_email", "privacy.data_sharing")
+        User.objects.create(email="a@example.com", preference_flags=news)
+        User.objects.create(email="b@example.com", preference_flags=both)
+        User.objects.create(email="c@example.com")
+
+        self.assertEqual(
+            list(User.objects.filter(preference_flags__has_all=news).values_list("email", flat=True)),
+            ["a@example.com"],
+        )
+        self.assertEqual(User.objects.filter(preference_flags__has_any=both | news).count(), 2)
+        self.assertEqual(User.objects.filter(preference_flags__has_all=both | news).count(), 0)
+
+
+@override_settings(COMPACT_PREFERENCE_FLAGS=True)
+class CompactStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="flags@example.com")
+
+    def put(self, name, payload):
+        # Cache invalidation runs on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(
+                reverse(name, args=[self.user.id]),
+                data=json.dumps(payload),
+                content_type="application/json",
+            )
+
+    def test_notification_updates_need_no_row(self):
+        resp = self.put("update_notification_settings", {"email_news": False})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.json()["email_news"])
+        self.assertFalse(UserNotificationSettings.objects.exists())
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.preference_flags)
+        data = self.client.get(reverse("get_notification_settings", args=[self.user.id])).json()
+        self.assertEqual(
+            data,
+            {
+                "user_id": self.user.id,
+                "push_messages": True,
+                "push_comments": True,
+                "push_reminders": True,
+                "email_news": False,
+                "email_messages": True,
+                "email_reminders": True,
+            },
+        )
+
+    def test_only_changed_flags_are_written(self):
+        self.assertEqual(
+            self.put("update_notification_settings", {"email_news": False, "push_messages": True}).json()["changed_fields"],
+            ["email_news"],
+        )
+        with self.assertNumQueries(1):  # the user; flags unchanged, nothing written
+            resp = self.put("update_notification_settings", {"email_news": False})
+        self.assertEqual(resp.json()["changed_fields"], [])
+
+    def test_privacy_keeps_visibility_in_row(self):
+        resp = self.put("update_privacy_settings", {"profile_visibility": "private", "show_email": True})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(UserPrivacySettings.objects.get().profile_visibility, "private")
+        self.assertTrue(
+            User.objects.filter(preference_flags__has_all=flags.mask("privacy.show_email")).exists()
+        )
+        data = self.client.get(reverse("get_preferences", args=[self.user.id])).json()
+        self.assertEqual(data["privacy"]["profile_visibility"], "private")
+        self.assertTrue(data["privacy"]["show_email"])
+
+    def test_etag_changes_after_flag_write(self):
+        url = reverse("get_notification_settings", args=[self.user.id])
+        self.put("update_notification_settings", {"email_news": False})
+        etag = self.client.get(url)["ETag"]
+        self.put("update_notification_settings", {"email_news": True})
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()["email_news"])
+
+    def test_settings_etag_follows_user_saves(self):
+        url = reverse("get_notification_settings", args=[self.user.id])
+        self.put("update_notification_settings", {"email_news": False})
+        self.client.get(url)
+        self.put("update_user", {"first_name": "Renamed"})
+
+        etag = self.client.get(url)["ETag"]
+        resp = self.client.put(
+            reverse("update_notification_settings", args=[self.user.id]),
+            data=json.dumps({"email_news": True}),
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(resp.status_code, 200)
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_update_writes_flags(self):
+        resp = await self.async_client.put(
+            reverse("update_notification_settings", args=[self.user.id]),
+            data=json.dumps({"email_reminders": False}),
+            content_type="application/json",
+        )
+        self.assertFalse(resp.json()["email_reminders"])
+        self.assertFalse(await UserNotificationSettings.objects.aexists())
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertFalse(flags.unpack(user.preference_flags, "notifications")["email_reminders"])
+
+    def test_unpacked_user_is_packed_from_rows_on_update(self):
+        UserNotificationSettings.objects.create(user=self.user, push_comments=False)
+        data = self.client.get(reverse("get_notification_settings", args=[self.user.id])).json()
+        self.assertFalse(data["push_comments"])
+
+        resp = self.put("update_notification_settings", {"email_news": False})
+        self.assertFalse(resp.json()["push_comments"])
+        self.user.refresh_from_db()
+        values = flags.unpack(self.user.preference_flags, "notifications")
+        self.assertFalse(values["push_comments"])
+        self.assertFalse(values["email_news"])
+
+    def test_bulk_update_writes_flags(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(
+                reverse("bulk_update_preferences"),
+                data=json.dumps(
+                    {
+                        "items": [
+                            {
+                                "user_id": self.user.id,
+                                "notifications": {"push_messages": False},
+                                "privacy": {"data_sharing": True, "profile_visibility": "friends"},
+                            }
+                        ]
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(resp.json()["errors"], [])
+        self.assertFalse(UserNotificationSettings.objects.exists())
+        prefs = self.client.get(reverse("get_preferences", args=[self.user.id])).json()
+        self.assertFalse(prefs["notifications"]["push_messages"])
+        self.assertTrue(prefs["privacy"]["data_sharing"])
+        self.assertEqual(prefs["privacy"]["profile_visibility"], "friends")
+
+
+class PackPreferenceFlagsCommandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(email=f"pack{i}@example.com") for i in range(3)]
+        UserNotificationSettings.objects.create(user=self.users[0], email_news=False)
+        UserPrivacySettings.objects.create(user=self.users[1], show_email=True)
+
+    def preferences(self):
+        return [
+            self.client.get(reverse("get_preferences", args=[user.id])).json()
+            for user in self.users
+        ]
+
+    def test_pack_and_unpack_keep_responses(self):
+        before = self.preferences()
+
+        with override_settings(COMPACT_PREFERENCE_FLAGS=True):
+            call_command("pack_preference_flags", batch_size=2, prune=True, stdout=StringIO())
+            self.assertFalse(User.objects.filter(preference_flags__isnull=True).exists())
+            self.assertFalse(UserNotificationSettings.objects.exists())
+            self.assertEqual(
+                [{**prefs, "user": None} for prefs in self.preferences()],
+                [{**prefs, "user": None} for prefs in before],
+            )
+
+            out = StringIO()
+            call_command("pack_preference_flags", unpack=True, stdout=out)
+        self.assertIn("Done: 3 users unpacked", out.getvalue())
+        self.assertFalse(User.objects.filter(preference_flags__isnull=False).exists())
+        self.assertEqual(UserNotificationSettings.objects.count(), 3)
+        self.assertEqual(
+            [{**prefs, "user": None} for prefs in self.preferences()],
+            [{**prefs, "user": None} for prefs in before],
+        )
+
+    def test_requires_compact_mode(self):
+        for options in ({}, {"prune": True}, {"unpack": True}):
+            with self.assertRaises(CommandError):
+                call_command("pack_preference_flags", stdout=StringIO(), **options)
+        self.assertFalse(User.objects.filter(preference_flags__isnull=False).exists())
+        self.assertTrue(UserNotificationSettings.objects.exists())
+
+        # Updates made in rows mode survive turning compact mode on
+        user = self.users[2]
+        resp = self.client.put(
+            reverse("update_notification_settings", args=[user.id]),
+            data=json.dumps({"email_news": False}),
+            content_type="application/json",
+        )
+        self.assertFalse(resp.json()["email_news"])
+        with override_settings(COMPACT_PREFERENCE_FLAGS=True):
+            call_command("pack_preference_flags", stdout=StringIO())
+            cache.clear()
+            data = self.client.get(reverse("get_notification_settings", args=[user.id])).json()
+        self.assertFalse(data["email_news"])
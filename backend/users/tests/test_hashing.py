@@ -0,0 +1,85 @@
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import hashing, throttle
+from users.models import User
+
+
+class HashingTests(TestCase):
+    def setUp(self):
+        hashing.shutdown()
+        hashing.stats.reset()
+        throttle.reset()
+
+    def tearDown(self):
+        hashing.shutdown()
+
+    @override_settings(PASSWORD_HASHING_WORKERS=0)
+    def test_inline_change_password(self):
+        encoded = make_password("secret")
+        matches, new_encoded = hashing.change_password("secret", encoded, "fresh").result()
+        self.assertTrue(matches)
+        self.assertTrue(check_password("fresh", new_encoded))
+        self.assertEqual(hashing.change_password("wrong", encoded, "x").result(), (False, None))
+        self.assertEqual(hashing.stats.completed, 2)
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_MAX_PENDING=1)
+    def test_pool_rejects_when_saturated(self):
+        encoded = make_password("secret")
+        first = hashing.change_password("secret", encoded, "fresh")
+        with self.assertRaises(hashing.HashingBusy):
+            hashing.change_password("secret", encoded, "fresh")
+        self.assertTrue(first.result(timeout=30)[0])
+        self.assertEqual(hashing.stats.rejected, 1)
+        self.assertGreater(hashing.stats.hash_seconds, 0)
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_MAX_PENDING=1)
+    def test_dead_worker_is_replaced(self):
+        # The worker exits: the job is lost and the pool is broken
+        with self.assertRaises(hashing.HashingBusy):
+            hashing.result(hashing._submit(os._exit, 1))
+        encoded = make_password("secret")
+        job = hashing.change_password("secret", encoded, "fresh")
+        self.assertTrue(hashing.result(job)[0])
+
+    @override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_MAX_PENDING=1)
+    def test_refused_submit_releases_its_slot(self):
+        encoded = make_password("secret")
+        with mock.patch.object(ProcessPoolExecutor, "submit", side_effect=BrokenProcessPool):
+            for _ in range(2):
+                with self.assertRaises(hashing.HashingBusy):
+                    hashing.change_password("secret", encoded, "fresh")
+        job = hashing.change_password("secret", encoded, "fresh")
+        self.assertTrue(hashing.result(job)[0])
+
+    @override_settings(PASSWORD_HASHING_TIMEOUT=0.01)
+    async def test_waits_time_out(self):
+        with self.assertRaises(hashing.HashingBusy):
+            hashing.result(Future())
+        with self.assertRaises(hashing.HashingBusy):
+            await hashing.aresult(Future())
+
+    def test_update_password_returns_429_when_busy(self):
+        user = User.objects.create(email="busy@example.com", password=make_password("old"))
+        with mock.patch.object(hashing, "change_password", side_effect=hashing.HashingBusy):
+            resp = self.client.put(
+                reverse("update_password", args=[user.id]),
+                data=json.dumps(
+                    {
+                        "current_password": "old",
+                        "new_password": "new",
+                        "confirm_password": "new",
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "1")
+        self.assertEqual(resp.json()["error"]["code"], "hashing_busy")
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+CONTENT_NAME = "profile_pictures/ab/" + "ab" * 32 + ".png"
+
+
+class MediaServeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL="")
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in (CONTENT_NAME, "legacy/avatar.png"):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), "wb") as fh:
+                fh.write(bytes(range(100)))
+
+    def test_full_file_with_validators(self):
+        resp = self.client.get("/media/" + CONTENT_NAME)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b"".join(resp.streaming_content), bytes(range(100)))
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+        self.assertIn("immutable", resp["Cache-Control"])
+        self.assertIn("ETag", resp)
+        self.assertIn("Last-Modified", resp)
+
+    def test_mutable_names_get_short_max_age(self):
+        resp = self.client.get("/media/legacy/avatar.png")
+        self.assertEqual(resp["Cache-Control"], "public, max-age=3600")
+
+    def test_conditional_get_returns_304(self):
+        etag = self.client.get("/media/" + CONTENT_NAME)["ETag"]
+        resp = self.client.get("/media/" + CONTENT_NAME, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_byte_ranges(self):
+        url = "/media/" + CONTENT_NAME
+        resp = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(b"".join(resp.streaming_content), bytes(range(10, 20)))
+
+        resp = self.client.get(url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(resp.streaming_content), bytes(range(95, 100)))
+
+        resp = self.client.get(url, HTTP_RANGE="bytes=100-")
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp["Content-Range"], "bytes */100")
+
+    def test_stale_if_range_serves_full_file(self):
+        resp = self.client.get(
+            "/media/" + CONTENT_NAME, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(resp.status_code, 200)
+
+    def test_missing_and_escaping_paths_are_404(self):
+        self.assertEqual(self.client.get("/media/missing.png").status_code, 404)
+        self.assertEqual(self.client.get("/media/../manage.py").status_code, 404)
+        self.assertEqual(self.client.get("/media/legacy/").status_code, 404)
+
+    @override_settings(MEDIA_ACCEL="x-accel-redirect")
+    def test_accel_redirect_offloads_body(self):
+        resp = self.client.get("/media/" + CONTENT_NAME)
+        self.assertEqual(resp["X-Accel-Redirect"], "/protected-media/" + CONTENT_NAME)
+        self.assertEqual(resp.content, b"")
+        self.assertIn("immutable", resp["Cache-Control"])
+
+    @override_settings(USERS_ASYNC_VIEWS=True)
+    async def test_asgi_bodies_are_streamed_asynchronously(self):
+        url = "/media/" + CONTENT_NAME
+        resp = await self.async_client.get(url)
+        self.assertTrue(resp.is_async)
+        self.assertEqual(resp["Content-Length"], "100")
+        self.assertEqual(b"".join([chunk async for chunk in resp.streaming_content]), bytes(range(100)))
+
+        resp = await self.async_client.get(url, headers={"range": "bytes=10-19"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertTrue(resp.is_async)
+        self.assertEqual(
+            b"".join([chunk async for chunk in resp.streaming_content]), bytes(range(10, 20))
+        )
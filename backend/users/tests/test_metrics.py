@@ -0,0 +1,116 @@
+import gc
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, metrics
+from users.models import User
+
+
+def requests_by_key(data):
+    return {(route, method, status): count for route, method, status, count in data["requests"]}
+
+
+@override_settings(EXPORT_API_TOKEN="export-secret")
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create(email="metrics@example.com")
+
+    def test_requests_are_recorded_per_route(self):
+        self.client.get(reverse("get_user", args=[self.user.id]))
+        self.client.get(reverse("get_user", args=[self.user.id]))
+        self.client.get(reverse("get_user", args=[999]))
+        self.client.put(
+            reverse("update_theme_settings", args=[self.user.id]),
+            data=json.dumps({"skin": "flat"}),
+            content_type="application/json",
+        )
+
+        data = metrics.snapshot()
+        self.assertEqual(
+            requests_by_key(data),
+            {
+                ("get_user", "GET", 200): 2,
+                ("get_user", "GET", 404): 1,
+                ("update_theme_settings", "PUT", 200): 1,
+            },
+        )
+        latency = data["histograms"][metrics.LATENCY]["get_user"]
+        self.assertEqual(sum(latency[:-1]), 3)
+        queries = data["histograms"][metrics.QUERIES]
+        # The second read came from the cache
+        self.assertEqual(queries["get_user"][-1], 2)
+        self.assertGreater(queries["update_theme_settings"][-1], 1)
+        self.assertGreater(data["query_seconds"]["update_theme_settings"], 0)
+        sizes = data["histograms"][metrics.SIZE]["get_user"]
+        self.assertGreater(sizes[-1], 0)
+
+    def test_streamed_sizes_are_counted_when_consumed(self):
+        resp = self.client.get(
+            reverse("export_users"), headers={"authorization": "Bearer export-secret"}
+        )
+        body = b"".join(resp.streaming_content)
+        sizes = metrics.snapshot()["histograms"][metrics.SIZE]["export_users"]
+        self.assertEqual(sizes[-1], len(body))
+
+    def test_shards_of_exited_threads_are_retired(self):
+        shards = len(metrics._shards)
+
+        def record():
+            metrics._shard().observe(metrics.LATENCY, "probe", 0.5)
+
+        for _ in range(20):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertEqual(len(metrics._shards), shards)
+        latency = metrics.snapshot()["histograms"][metrics.LATENCY]["probe"]
+        self.assertEqual((sum(latency[:-1]), latency[-1]), (20, 10.0))
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse("get_user", args=[self.user.id]))
+        resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = resp.content.decode()
+        self.assertIn(
+            'users_http_requests_total{route="get_user",method="GET",status="200"} 1', text
+        )
+        self.assertIn("# TYPE users_http_request_duration_seconds histogram", text)
+        self.assertIn(
+            'users_http_request_duration_seconds_bucket{route="get_user",le="+Inf"} 1', text
+        )
+        self.assertIn('users_db_queries_per_request_count{route="get_user"} 1', text)
+        self.assertIn("users_cache_misses ", text)
+        self.assertIn("users_hashing_completed ", text)
+
+    @override_settings(METRICS_API_TOKEN="scrape-secret")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        resp = self.client.get(reverse("metrics"), headers={"authorization": "Bearer scrape-secret"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_snapshots_of_other_processes_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        other = metrics.merge([])
+        other["requests"] = [["get_user", "GET", 200, 5]]
+        other["components"] = {"hashing": {"completed": 3, "max_seconds": 9.0}}
+        with open(os.path.join(directory, "1.json"), "w") as fh:
+            json.dump(other, fh)
+
+        with self.settings(METRICS_DIR=directory):
+            self.client.get(reverse("get_user", args=[self.user.id]))
+            data = metrics.read_snapshots()
+
+        self.assertEqual(requests_by_key(data)[("get_user", "GET", 200)], 6)
+        self.assertIn(f"{os.getpid()}.json", os.listdir(directory))
+        self.assertEqual(data["components"]["hashing"]["max_seconds"], 9.0)
@@ -0,0 +1,278 @@
+import json
+import re
+import shutil
+import tempfile
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from users import cache, throttle, urls
+from users.models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+)
+
+WRITE_SQL = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+MISSING_PK = 999999
+BULK_USERS = 10
+
+
+# Scenarios: each creates its users and returns their ids
+
+
+def fresh_user(test):
+    """A user that has never saved any settings (no settings rows)."""
+    return [test.make_user("fresh@example.com").id]
+
+
+def existing_rows(test):
+    user = test.make_user("rows@example.com")
+    UserNotificationSettings.objects.create(user=user)
+    UserThemeSettings.objects.create(user=user)
+    UserPrivacySettings.objects.create(user=user)
+    return [user.id]
+
+
+def missing_user(test):
+    return [MISSING_PK]
+
+
+def fresh_users(test):
+    return [test.make_user(f"fresh{i}@example.com").id for i in range(BULK_USERS)]
+
+
+def users_with_rows(test):
+    ids = []
+    for i in range(BULK_USERS):
+        user = test.make_user(f"rows{i}@example.com")
+        UserNotificationSettings.objects.create(user=user)
+        UserThemeSettings.objects.create(user=user)
+        UserPrivacySettings.objects.create(user=user)
+        ids.append(user.id)
+    return ids
+
+
+SCENARIOS = {
+    "fresh": fresh_user,
+    "rows": existing_rows,
+    "missing": missing_user,
+    "bulk_fresh": fresh_users,
+    "bulk_rows": users_with_rows,
+}
+
+
+# Requests: (client, ids) -> response, with streamed bodies consumed
+
+
+def get(name):
+    def request(client, ids):
+        return client.get(reverse(name, args=[ids[0]]))
+
+    return request
+
+
+def put(name, payload):
+    def request(client, ids):
+        return client.put(
+            reverse(name, args=[ids[0]]),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    return request
+
+
+def export(client, ids):
+    resp = client.get(reverse("export_users"), headers={"authorization": "Bearer export-secret"})
+    if resp.is_async:
+
+        async def consume():
+            return [chunk async for chunk in resp.streaming_content]
+
+        async_to_sync(consume)()
+    else:
+        b"".join(resp.streaming_content)
+    return resp
+
+
+def bulk_read(client, ids):
+    return client.post(
+        reverse("bulk_preferences"),
+        data=json.dumps({"user_ids": ids + [MISSING_PK]}),
+        content_type="application/json",
+    )
+
+
+def bulk_write(client, ids):
+    items = [{"user_id": pk, "theme": {"skin": "flat"}} for pk in ids]
+    items += [{"user_id": pk, "notifications": {"email_news": True}} for pk in ids]
+    return client.post(
+        reverse("bulk_update_preferences"),
+        data=json.dumps({"items": items}),
+        content_type="application/json",
+    )
+
+
+def upload(client, ids):
+    picture = SimpleUploadedFile("avatar.png", b"\x89PNG\r\n\x1a\n", content_type="image/png")
+    return client.post(reverse("update_profile_picture", args=[ids[0]]), {"upload": picture})
+
+
+REQUESTS = {
+    "export_users": export,
+    "bulk_preferences": bulk_read,
+    "bulk_update_preferences": bulk_write,
+    "get_user": get("get_user"),
+    "update_user": put("update_user", {"first_name": "Renamed"}),
+    "update_user_unchanged": put("update_user", {"first_name": "Budget"}),
+    "update_profile_picture": upload,
+    "get_notification_settings": get("get_notification_settings"),
+    "update_notification_settings": put("update_notification_settings", {"email_news": False}),
+    "update_notification_settings_unchanged": put(
+        "update_notification_settings", {"email_news": True}
+    ),
+    "get_theme_settings": get("get_theme_settings"),
+    "update_theme_settings": put("update_theme_settings", {"skin": "flat"}),
+    "update_theme_settings_unchanged": put("update_theme_settings", {"skin": "material"}),
+    "get_privacy_settings": get("get_privacy_settings"),
+    "update_privacy_settings": put("update_privacy_settings", {"show_email": True}),
+    "update_privacy_settings_unchanged": put("update_privacy_settings", {"show_email": False}),
+    "update_password": put(
+        "update_password",
+        {
+            "current_password": "oldpass123",
+            "new_password": "newpass123",
+            "confirm_password": "newpass123",
+        },
+    ),
+    "get_preferences": get("get_preferences"),
+}
+
+
+# (request, scenario) -> (most queries allowed, whether writes are allowed).
+# Requests ending in "_unchanged" resend the current values and must not write;
+# "cached" budgets apply to a repeat of the request right after a first one.
+BUDGETS = {
+    # One joined page per EXPORT_CHUNK_SIZE users
+    ("export_users", "bulk_fresh"): (1, False),
+    ("export_users", "bulk_rows"): (1, False),
+    # One joined IN query per BULK_CHUNK_SIZE ids
+    ("bulk_preferences", "bulk_fresh"): (1, False),
+    ("bulk_preferences", "bulk_rows"): (1, False),
+    # Whatever the number of users: users, rows, then insert/update per group
+    ("bulk_update_preferences", "bulk_fresh"): (7, True),
+    ("bulk_update_preferences", "bulk_rows"): (7, True),
+    ("get_user", "fresh"): (1, False),
+    ("get_user", "missing"): (1, False),
+    ("get_user", "cached"): (0, False),
+    ("update_user", "fresh"): (2, True),
+    ("update_user", "missing"): (1, False),
+    ("update_user_unchanged", "fresh"): (1, False),
+    ("update_profile_picture", "fresh"): (2, True),
+    ("update_profile_picture", "missing"): (1, False),
+    ("update_password", "fresh"): (2, True),
+    ("update_password", "missing"): (1, False),
+    ("get_preferences", "fresh"): (1, False),
+    ("get_preferences", "rows"): (1, False),
+    ("get_preferences", "missing"): (1, False),
+}
+for group in ("notification", "theme", "privacy"):
+    BUDGETS.update(
+        {
+            (f"get_{group}_settings", "fresh"): (2, False),
+            (f"get_{group}_settings", "rows"): (2, False),
+            (f"get_{group}_settings", "missing"): (1, False),
+            (f"get_{group}_settings", "cached"): (0, False),
+            # user, row, then the write inside a savepoint
+            (f"update_{group}_settings", "fresh"): (5, True),
+            (f"update_{group}_settings", "rows"): (5, True),
+            (f"update_{group}_settings", "missing"): (1, False),
+            (f"update_{group}_settings_unchanged", "fresh"): (2, False),
+            (f"update_{group}_settings_unchanged", "rows"): (2, False),
+        }
+    )
+
+# The async views write settings without a savepoint
+ASYNC_BUDGETS = {
+    **BUDGETS,
+    **{
+        (f"update_{group}_settings", scenario): (3, True)
+        for group in ("notification", "theme", "privacy")
+        for scenario in ("fresh", "rows")
+    },
+}
+
+
+def describe(queries):
+    return "\n".join(f"  {index}. {query['sql']}" for index, query in enumerate(queries, 1))
+
+
+@override_settings(EXPORT_API_TOKEN="export-secret", THUMBNAIL_WORKERS=0)
+class QueryBudgetTests(TestCase):
+    budgets = BUDGETS
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_user(self, email):
+        return User.objects.create(
+            email=email, first_name="Budget", password=make_password("oldpass123")
+        )
+
+    def assertWithinBudget(self, label, budget, allow_writes, request):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = request()
+        queries = ctx.captured_queries
+        problems = []
+        if len(queries) > budget:
+            problems.append(f"{len(queries)} queries (budget {budget})")
+        writes = [query for query in queries if WRITE_SQL.match(query["sql"])]
+        if writes and not allow_writes:
+            problems.append(f"{len(writes)} writes on a request that must not write")
+        if problems:
+            self.fail(f"{label}: {', '.join(problems)}\n{describe(queries)}")
+        return resp
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - {name for name, _ in self.budgets}, set())
+
+    def test_budgets(self):
+        for (name, scenario), (budget, allow_writes) in self.budgets.items():
+            with self.subTest(request=name, scenario=scenario):
+                cache.clear()
+                throttle.reset()
+                # Each case starts from an empty database again
+                with transaction.atomic():
+                    self.run_case(name, scenario, budget, allow_writes)
+                    transaction.set_rollback(True)
+
+    def run_case(self, name, scenario, budget, allow_writes):
+        request = REQUESTS[name]
+        if scenario == "cached":
+            ids = fresh_user(self)
+            self.assertLess(request(self.client, ids).status_code, 400)
+        else:
+            ids = SCENARIOS[scenario](self)
+        resp = self.assertWithinBudget(
+            f"{name} [{scenario}]", budget, allow_writes, lambda: request(self.client, ids)
+        )
+        expected = 404 if scenario == "missing" else 200
+        self.assertEqual(resp.status_code, expected, f"{name} [{scenario}]")
+
+
+@override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+class AsyncQueryBudgetTests(QueryBudgetTests):
+    budgets = ASYNC_BUDGETS
@@ -0,0 +1,67 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import skipIf
+
+from django.test import SimpleTestCase, override_settings
+
+from users import renderers
+from users.serializers import SERIALIZERS
+
+PAYLOAD = {
+    "text": "héllo",
+    "when": datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+    "amount": Decimal("1.50"),
+    "items": [1, None, True],
+}
+
+
+class RendererTests(SimpleTestCase):
+    @override_settings(JSON_ENCODER="json")
+    def test_stdlib_backend(self):
+        self.assertEqual(renderers.backend(), "json")
+        data = json.loads(renderers.dumps(PAYLOAD))
+        self.assertEqual(data["when"], "2024-01-02T03:04:05Z")
+        self.assertEqual(data["amount"], "1.50")
+
+    @skipIf(renderers.orjson is None, "orjson is not installed")
+    @override_settings(JSON_ENCODER="orjson")
+    def test_orjson_backend_matches_stdlib(self):
+        fast = json.loads(renderers.dumps(PAYLOAD))
+        with self.settings(JSON_ENCODER="json"):
+            self.assertEqual(fast, json.loads(renderers.dumps(PAYLOAD)))
+
+    def test_json_response_rejects_non_dict_by_default(self):
+        with self.assertRaises(TypeError):
+            renderers.JsonResponse([1, 2])
+        response = renderers.JsonResponse([1, 2], safe=False, status=201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+
+class SerializerTests(SimpleTestCase):
+    def test_row_serializer_uses_prefixed_columns(self):
+        row = {
+            "theme_settings__user_id": 7,
+            "theme_settings__skin": "flat",
+            "theme_settings__primary_color": "#000000",
+            "theme_settings__font_family": "mono",
+        }
+        self.assertEqual(
+            SERIALIZERS["theme"].from_row(row, prefix="theme_settings__"),
+            {"user_id": 7, "skin": "flat", "primary_color": "#000000", "font_family": "mono"},
+        )
+
+    def test_user_row_converts_picture_names(self):
+        row = {
+            "id": 1,
+            "email": "a@example.com",
+            "first_name": "A",
+            "last_name": "B",
+            "profile_picture": "profile_pictures/ab/ab.png",
+            "profile_picture_variants": {"40": "profile_pictures/ab/ab.png.40.webp"},
+        }
+        data = SERIALIZERS["user"].from_row(row)
+        self.assertEqual(data["profile_picture"], "/media/profile_pictures/ab/ab.png")
+        self.assertEqual(data["profile_picture_variants"]["40"], "/media/profile_pictures/ab/ab.png.40.webp")
+        self.assertIsNone(SERIALIZERS["user"].from_row({**row, "profile_picture": ""})["profile_picture"])
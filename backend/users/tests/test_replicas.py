@@ -0,0 +1,109 @@
+import json
+
+from django.core.cache import cache as default_cache
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, routers
+from users.models import User, UserThemeSettings
+
+REPLICA = "replica_test"
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(TestCase):
+    # A second in-memory SQLite database stands in for a replica. It only
+    # exists while this class runs, so other test runs never create it.
+    databases = {"default"}
+
+    @classmethod
+    def setUpClass(cls):
+        default = connections.settings["default"]
+        connections.settings[REPLICA] = {
+            **default,
+            "NAME": ":memory:",
+            "TEST": {**default["TEST"], "NAME": None},
+        }
+        connections[REPLICA].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cls.databases = {"default", REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            connections[REPLICA].creation.destroy_test_db(":memory:", verbosity=0)
+            del connections[REPLICA]
+            del connections.settings[REPLICA]
+            cls.databases = {"default"}
+
+    def setUp(self):
+        cache.clear()
+        default_cache.clear()
+        # The replica lags behind: it still has the old name
+        self.user = User.objects.create(email="lag@example.com", first_name="Primary")
+        User.objects.using(REPLICA).create(
+            pk=self.user.pk, email="lag@example.com", first_name="Replica"
+        )
+
+    def test_router_splits_reads_and_writes(self):
+        router = routers.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(User), REPLICA)
+        self.assertEqual(router.db_for_write(User), "default")
+        with routers.use_primary():
+            self.assertEqual(router.db_for_read(User), "default")
+
+    def test_get_reads_from_replica(self):
+        resp = self.client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp.json()["first_name"], "Replica")
+
+    def test_reads_stay_on_primary_after_a_write(self):
+        resp = self.client.put(
+            reverse("update_user", args=[self.user.id]),
+            data=json.dumps({"first_name": "Updated"}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(routers.is_pinned(self.user.id))
+
+        resp = self.client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp.json()["first_name"], "Updated")
+
+        # Once the window is over reads go back to the replica
+        default_cache.clear()
+        cache.clear()
+        resp = self.client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp.json()["first_name"], "Replica")
+
+    def test_failed_write_does_not_pin(self):
+        self.client.put(
+            reverse("update_user", args=[self.user.id]),
+            data="not json",
+            content_type="application/json",
+        )
+        self.assertFalse(routers.is_pinned(self.user.id))
+
+    def test_bulk_reads_use_replica_and_bulk_writes_pin(self):
+        UserThemeSettings.objects.using(REPLICA).create(user_id=self.user.pk, skin="flat")
+        resp = self.client.post(
+            reverse("bulk_preferences"),
+            data=json.dumps({"user_ids": [self.user.id]}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["results"][str(self.user.id)]["theme"]["skin"], "flat")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(
+                reverse("bulk_update_preferences"),
+                data=json.dumps({"items": [{"user_id": self.user.id, "theme": {"skin": "mini"}}]}),
+                content_type="application/json",
+            )
+        self.assertEqual(resp.json()["errors"], [])
+        self.assertTrue(routers.is_pinned(self.user.id))
+
+
+class NoReplicaTests(TestCase):
+    def test_reads_use_default_without_replicas(self):
+        self.assertEqual(routers.PrimaryReplicaRouter().db_for_read(User), "default")
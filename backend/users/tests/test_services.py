@@ -0,0 +1,145 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache
+from users.models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+)
+from users.serializers import (
+    serialize_notification_settings,
+    serialize_privacy_settings,
+    serialize_theme_settings,
+)
+from users.services import (
+    bulk_update_settings,
+    get_bulk_preferences,
+    iter_bulk_preferences,
+    settings_or_defaults,
+)
+
+
+class BulkPreferencesServiceTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(
+                email=f"bulk{i}@example.com", first_name="Bulk", last_name=str(i)
+            )
+            for i in range(5)
+        ]
+        UserNotificationSettings.objects.create(user=self.users[0], email_news=False)
+        UserPrivacySettings.objects.create(
+            user=self.users[1], profile_visibility="private"
+        )
+
+    def test_one_query_per_chunk(self):
+        ids = [u.id for u in self.users]
+        with self.assertNumQueries(1):
+            results = get_bulk_preferences(ids)
+        self.assertEqual(set(results), set(ids))
+        with self.assertNumQueries(3):
+            list(iter_bulk_preferences(ids, chunk_size=2))
+
+    def test_defaults_and_saved_values(self):
+        results = get_bulk_preferences([u.id for u in self.users])
+        self.assertFalse(results[self.users[0].id]["notifications"]["email_news"])
+        self.assertEqual(
+            results[self.users[1].id]["privacy"]["profile_visibility"], "private"
+        )
+        defaults = results[self.users[2].id]
+        self.assertTrue(defaults["notifications"]["email_news"])
+        self.assertEqual(defaults["theme"]["skin"], "material")
+        self.assertEqual(defaults["theme"]["user_id"], self.users[2].id)
+
+    def test_rows_serialize_like_instances(self):
+        for compact in (False, True):
+            with self.subTest(compact=compact), override_settings(COMPACT_PREFERENCE_FLAGS=compact):
+                if compact:
+                    User.objects.filter(pk=self.users[3].pk).update(preference_flags=0)
+                expected = {}
+                for user in User.objects.filter(pk__in=[u.id for u in self.users]):
+                    notifications, theme, privacy = settings_or_defaults(user)
+                    expected[user.pk] = {
+                        "notifications": serialize_notification_settings(notifications),
+                        "theme": serialize_theme_settings(theme),
+                        "privacy": serialize_privacy_settings(privacy),
+                    }
+                self.assertEqual(get_bulk_preferences([u.id for u in self.users]), expected)
+
+    def test_reads_do_not_write(self):
+        get_bulk_preferences([u.id for u in self.users])
+        self.assertEqual(UserNotificationSettings.objects.count(), 1)
+
+    def test_unknown_and_duplicate_ids(self):
+        ids = [self.users[0].id, self.users[0].id, 99999]
+        self.assertEqual(list(get_bulk_preferences(ids)), [self.users[0].id])
+
+
+class BulkUpdateSettingsServiceTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(
+                email=f"write{i}@example.com", first_name="Write", last_name=str(i)
+            )
+            for i in range(4)
+        ]
+        UserNotificationSettings.objects.create(user=self.users[0])
+        UserNotificationSettings.objects.create(user=self.users[1])
+
+    def test_creates_and_updates_rows(self):
+        items = [
+            {"user_id": u.id, "notifications": {"email_news": False}} for u in self.users
+        ]
+        items.append({"user_id": self.users[0].id, "privacy": {"profile_visibility": "friends"}})
+        result = bulk_update_settings(items, chunk_size=3)
+        self.assertEqual(result, {"created": 3, "updated": 2, "errors": []})
+        self.assertFalse(
+            UserNotificationSettings.objects.filter(email_news=True).exists()
+        )
+        self.assertEqual(UserNotificationSettings.objects.count(), 4)
+        self.assertEqual(
+            UserPrivacySettings.objects.get(user=self.users[0]).profile_visibility,
+            "friends",
+        )
+
+    def test_mixed_change_sets_leave_other_fields_alone(self):
+        bulk_update_settings(
+            [
+                {"user_id": self.users[0].id, "notifications": {"push_comments": False}},
+                {"user_id": self.users[1].id, "notifications": {"email_news": False}},
+            ]
+        )
+        first = UserNotificationSettings.objects.get(user=self.users[0])
+        second = UserNotificationSettings.objects.get(user=self.users[1])
+        self.assertFalse(first.push_comments)
+        self.assertTrue(first.email_news)
+        self.assertFalse(second.email_news)
+        self.assertTrue(second.push_comments)
+
+    def test_per_item_errors(self):
+        result = bulk_update_settings(
+            [
+                {"user_id": self.users[0].id, "theme": {"skin": "neon"}},
+                {"user_id": self.users[0].id, "theme": {"unknown": 1}},
+                {"user_id": 99999, "theme": {"skin": "flat"}},
+                {"user_id": "1"},
+                {"user_id": self.users[1].id, "theme": {"skin": "flat"}},
+            ]
+        )
+        self.assertEqual([e["index"] for e in result["errors"]], [0, 1, 2, 3])
+        self.assertIn("theme.skin", result["errors"][0]["errors"])
+        self.assertEqual(result["errors"][2]["errors"], {"user_id": "User not found"})
+        self.assertEqual(result["created"], 1)
+        self.assertFalse(UserThemeSettings.objects.filter(user=self.users[0]).exists())
+
+    def test_invalidates_cache_on_commit(self):
+        cache.clear()
+        url = reverse("get_notification_settings", args=[self.users[0].id])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_settings(
+                [{"user_id": self.users[0].id, "notifications": {"email_news": False}}]
+            )
+        self.assertFalse(self.client.get(url).json()["email_news"])
@@ -0,0 +1,112 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, throttle
+from users.models import User
+
+
+class LocalStoreTests(SimpleTestCase):
+    def test_burst_then_refill(self):
+        store = throttle.LocalStore(shards=4, max_keys=100)
+        with mock.patch("users.throttle.time.monotonic", return_value=100.0):
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 0)
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 0)
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 0)
+            # Empty: 10 tokens at 0.5/s
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 20.0)
+            self.assertEqual(store.take("user:2", 10, 30, 0.5), 0)
+        with mock.patch("users.throttle.time.monotonic", return_value=110.0):
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 10.0)
+        with mock.patch("users.throttle.time.monotonic", return_value=120.0):
+            self.assertEqual(store.take("user:1", 10, 30, 0.5), 0)
+
+    def test_concurrent_takes_never_overdraw(self):
+        store = throttle.LocalStore(shards=2, max_keys=100)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: store.take("ip:1", 1, 100, 0), range(400)))
+        self.assertEqual(results.count(0), 100)
+
+    def test_idle_buckets_are_evicted(self):
+        store = throttle.LocalStore(shards=1, max_keys=2)
+        for key in ("a", "b", "c"):
+            store.take(key, 1, 1, 0)
+        self.assertEqual(list(store.shards[0].buckets), ["b", "c"])
+        # Forgotten means full again
+        self.assertEqual(store.take("a", 1, 1, 0), 0)
+
+
+@override_settings(
+    THROTTLE_COSTS={"update_password": 10},
+    THROTTLE_USER_BUCKET=(20, 0.1),
+    THROTTLE_IP_BUCKET=(1000, 1.0),
+    PASSWORD_HASHING_WORKERS=0,
+)
+class ThrottleMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.reset()
+        self.addCleanup(throttle.reset)
+        self.users = [User.objects.create(email=f"t{i}@example.com") for i in range(3)]
+
+    def change_password(self, user, address="10.0.0.1"):
+        return self.client.put(
+            reverse("update_password", args=[user.id]),
+            data=json.dumps({"current_password": "x", "new_password": "a", "confirm_password": "b"}),
+            content_type="application/json",
+            REMOTE_ADDR=address,
+        )
+
+    def test_user_bucket(self):
+        self.assertEqual(self.change_password(self.users[0]).status_code, 400)
+        self.assertEqual(self.change_password(self.users[0]).status_code, 400)
+        resp = self.change_password(self.users[0])
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "100")
+        self.assertEqual(resp.json()["error"]["code"], "throttled")
+        # Other users, and other routes, are not affected
+        self.assertEqual(self.change_password(self.users[1]).status_code, 400)
+        resp = self.client.get(reverse("get_user", args=[self.users[0].id]), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(resp.status_code, 200)
+
+    @override_settings(THROTTLE_IP_BUCKET=(30, 1.0))
+    def test_address_bucket_is_all_or_nothing(self):
+        for user in self.users:
+            self.assertEqual(self.change_password(user).status_code, 400)
+        resp = self.change_password(self.users[1])
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "10")
+        # The refused request took nothing from the user's bucket
+        self.assertEqual(self.change_password(self.users[1], "10.0.0.2").status_code, 400)
+        self.assertEqual(self.change_password(self.users[1], "10.0.0.2").status_code, 429)
+
+    @override_settings(THROTTLE_CACHE="default")
+    def test_shared_backend(self):
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+        self.change_password(self.users[0])
+        self.change_password(self.users[0])
+        # A process with no local state of its own sees the shared buckets
+        throttle.reset()
+        self.assertEqual(self.change_password(self.users[0]).status_code, 429)
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_chain(self):
+        statuses = [(await self.async_password(self.users[0])).status_code for _ in range(3)]
+        self.assertEqual(statuses, [400, 400, 429])
+
+    async def async_password(self, user):
+        return await self.async_client.put(
+            reverse("update_password", args=[user.id]),
+            data=json.dumps({"current_password": "x", "new_password": "a", "confirm_password": "b"}),
+            content_type="application/json",
+        )
+
+    @override_settings(THROTTLE_COSTS={})
+    def test_unused_without_costs(self):
+        for _ in range(4):
+            self.assertEqual(self.change_password(self.users[0]).status_code, 400)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from users import cache, throttle, thumbnails
+from users.models import User
+
+
+def png_upload(size=(640, 480)):
+    buffer = BytesIO()
+    Image.new("RGB", size, (75, 123, 236)).save(buffer, "PNG")
+    return SimpleUploadedFile("avatar.png", buffer.getvalue(), content_type="image/png")
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.reset()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, THUMBNAIL_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(email="thumbs@example.com")
+
+    def test_render_variants_are_square_and_sized(self):
+        variants = thumbnails.render_variants(png_upload(), [40, 160])
+        self.assertEqual(sorted(variants), [40, 160])
+        with Image.open(BytesIO(variants[40])) as image:
+            self.assertEqual(image.size, (40, 40))
+            self.assertEqual(image.format, "WEBP")
+
+    def test_upload_produces_variant_urls(self):
+        resp = self.client.post(
+            reverse("update_profile_picture", args=[self.user.id]),
+            {"upload": png_upload()},
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        data = self.client.get(reverse("get_user", args=[self.user.id])).json()
+        variants = data["profile_picture_variants"]
+        self.assertEqual(sorted(variants, key=int), ["40", "80", "160", "320"])
+        self.assertTrue(variants["40"].startswith("/media/profile_pictures/"))
+        self.assertTrue(variants["40"].endswith(".png.40.webp"))
+
+    def test_inline_job_is_reflected_in_the_response(self):
+        url = reverse("update_profile_picture", args=[self.user.id])
+        resp = self.client.post(url, {"upload": png_upload()})
+        self.assertEqual(len(resp.json()["profile_picture_variants"]), 4)
+        get = self.client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp["ETag"], get["ETag"])
+
+        resp = self.client.post(url, {"upload": png_upload((64, 64))}, headers={"if-match": resp["ETag"]})
+        self.assertEqual(resp.status_code, 200)
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_inline_job_is_reflected_in_the_response(self):
+        resp = await self.async_client.post(
+            reverse("update_profile_picture", args=[self.user.id]), {"upload": png_upload()}
+        )
+        self.assertEqual(len(resp.json()["profile_picture_variants"]), 4)
+        get = await self.async_client.get(reverse("get_user", args=[self.user.id]))
+        self.assertEqual(resp["ETag"], get["ETag"])
+
+    def test_identical_uploads_share_one_file(self):
+        other = User.objects.create(email="thumbs2@example.com")
+        for user in (self.user, other):
+            self.client.post(
+                reverse("update_profile_picture", args=[user.id]), {"upload": png_upload()}
+            )
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+
+        self.assertEqual(self.user.profile_picture.name, other.profile_picture.name)
+        self.assertEqual(self.user.profile_picture_variants, other.profile_picture_variants)
+        directory = os.path.dirname(self.user.profile_picture.path)
+        self.assertEqual(len(os.listdir(directory)), 1 + len(thumbnails.settings.THUMBNAIL_SIZES))
+
+    def test_stale_job_does_not_attach_variants(self):
+        url = reverse("update_profile_picture", args=[self.user.id])
+        self.client.post(url, {"upload": png_upload()})
+        self.user.refresh_from_db()
+        first_picture = self.user.profile_picture.name
+        self.client.post(url, {"upload": png_upload((100, 100))})
+        self.user.refresh_from_db()
+        current = dict(self.user.profile_picture_variants)
+
+        # A late job for the replaced picture must not overwrite the variants
+        thumbnails.generate_variants(self.user.id, first_picture)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_picture_variants, current)
+
+    def test_undecodable_upload_keeps_original_only(self):
+        upload = SimpleUploadedFile("bad.png", b"not an image", content_type="image/png")
+        resp = self.client.post(
+            reverse("update_profile_picture", args=[self.user.id]), {"upload": upload}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["profile_picture_variants"], {})
@@ -0,0 +1,135 @@
+import json
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, views
+from users.models import User, UserNotificationSettings, UserThemeSettings, VersionConflict
+from users.services import bulk_update_settings, settings_or_default
+
+
+class VersionedSaveTests(TestCase):
+    def test_stale_instance_cannot_overwrite(self):
+        user = User.objects.create(email="cas@example.com")
+        first = User.objects.get(pk=user.pk)
+        second = User.objects.get(pk=user.pk)
+
+        first.first_name = "First"
+        first.save_changes()
+        self.assertEqual(first.version, 2)
+
+        second.last_name = "Second"
+        with self.assertRaises(VersionConflict):
+            second.save_changes()
+        self.assertEqual(second.version, 1)
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name, user.version), ("First", "", 2))
+
+    def test_plain_save_overwrites_and_bumps_version(self):
+        user = User.objects.create(email="plain@example.com")
+        stale = User.objects.get(pk=user.pk)
+        user.first_name = "First"
+        user.save_changes()
+
+        stale.last_name = "Second"
+        stale.save()
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name, user.version), ("", "Second", 3))
+
+    def test_deleted_row_is_not_a_conflict(self):
+        user = User.objects.create(email="gone@example.com")
+        loaded = User.objects.get(pk=user.pk)
+        user.delete()
+        loaded.first_name = "Ghost"
+        with self.assertRaises(DatabaseError):
+            loaded.save_changes()
+
+    def test_bulk_writes_bump_versions(self):
+        user = User.objects.create(email="bulk-cas@example.com")
+        UserThemeSettings.objects.create(user=user)
+        stale = UserThemeSettings.objects.get(user=user)
+
+        bulk_update_settings([{"user_id": user.pk, "theme": {"skin": "flat"}}])
+
+        stale.font_family = "mono"
+        with self.assertRaises(VersionConflict):
+            stale.save_changes()
+
+
+class IfMatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="ifmatch@example.com")
+
+    def put(self, name, payload, **headers):
+        # Cache invalidation runs on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(
+                reverse(name, args=[self.user.id]),
+                data=json.dumps(payload),
+                content_type="application/json",
+                headers=headers,
+            )
+
+    def test_current_etag_allows_chained_updates(self):
+        etag = self.client.get(reverse("get_theme_settings", args=[self.user.id]))["ETag"]
+
+        resp = self.put("update_theme_settings", {"skin": "flat"}, if_match=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp["ETag"], self.client.get(reverse("get_theme_settings", args=[self.user.id]))["ETag"]
+        )
+        resp = self.put("update_theme_settings", {"skin": "mini"}, if_match=resp["ETag"])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(UserThemeSettings.objects.get(user=self.user).skin, "mini")
+
+    def test_stale_etag_is_rejected(self):
+        etag = self.client.get(reverse("get_user", args=[self.user.id]))["ETag"]
+        self.put("update_user", {"first_name": "Tab one"})
+
+        resp = self.put("update_user", {"first_name": "Tab two"}, if_match=etag)
+        self.assertEqual(resp.status_code, 412)
+        self.assertEqual(resp.json()["error"]["code"], "version_conflict")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Tab one")
+
+    def test_write_between_read_and_save_is_rejected(self):
+        self.put("update_theme_settings", {"skin": "flat"})
+        stale = settings_or_default(UserThemeSettings, self.user)
+        self.put("update_theme_settings", {"font_family": "serif"})
+
+        with mock.patch.object(views, "settings_or_default", return_value=stale):
+            resp = self.put("update_theme_settings", {"skin": "willow"})
+        self.assertEqual(resp.status_code, 412)
+        settings = UserThemeSettings.objects.get(user=self.user)
+        self.assertEqual((settings.skin, settings.font_family), ("flat", "serif"))
+
+    @override_settings(COMPACT_PREFERENCE_FLAGS=True)
+    def test_packed_flag_writes_are_compare_and_swap(self):
+        self.put("update_notification_settings", {"email_news": False})
+        stale = settings_or_default(UserNotificationSettings, User.objects.get(pk=self.user.pk))
+        self.put("update_user", {"last_name": "Changed"})
+
+        with mock.patch.object(views, "settings_or_default", return_value=stale):
+            resp = self.put("update_notification_settings", {"push_messages": False})
+        self.assertEqual(resp.status_code, 412)
+        prefs = self.client.get(reverse("get_preferences", args=[self.user.id])).json()
+        self.assertTrue(prefs["notifications"]["push_messages"])
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_stale_etag_is_rejected(self):
+        url = reverse("get_privacy_settings", args=[self.user.id])
+        etag = (await self.async_client.get(url))["ETag"]
+        update = reverse("update_privacy_settings", args=[self.user.id])
+        body = json.dumps({"profile_visibility": "private"})
+
+        resp = await self.async_client.put(
+            update, data=body, content_type="application/json", headers={"if-match": etag}
+        )
+        self.assertEqual(resp.status_code, 200)
+        resp = await self.async_client.put(
+            update, data=body, content_type="application/json", headers={"if-match": etag}
+        )
+        self.assertEqual(resp.status_code, 412)
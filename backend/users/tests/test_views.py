@@ -1,9 +1,12 @@
+import csv
+import io
 import json
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.hashers import make_password, check_password
 
+from users import cache, export, throttle
 from users.models import (
     User,
     UserNotificationSettings,
@@ -14,6 +17,8 @@ from users.models import (
 
 class UserViewTests(TestCase):
     def setUp(self):
+        cache.clear()
+        throttle.reset()
         self.user = User.objects.create(
             email="demo@example.com",
             first_name="Demo",
@@ -47,6 +52,41 @@ class UserViewTests(TestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertEqual(resp.json()["error"]["code"], "duplicate_email")
 
+    def test_update_user_reports_changed_fields(self):
+        url = reverse("update_user", args=[self.user.id])
+        resp = self.client.put(
+            url,
+            data=json.dumps({"first_name": "Renamed", "last_name": "User"}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["changed_fields"], ["first_name"])
+
+    def test_noop_update_skips_write(self):
+        before = User.objects.get(pk=self.user.pk).updated_at
+        url = reverse("update_user", args=[self.user.id])
+        # Only the SELECT of the user; no UPDATE
+        with self.assertNumQueries(1):
+            resp = self.client.put(
+                url,
+                data=json.dumps({"first_name": "Demo", "email": "demo@example.com"}),
+                content_type="application/json",
+            )
+        self.assertEqual(resp.json()["changed_fields"], [])
+        self.assertEqual(User.objects.get(pk=self.user.pk).updated_at, before)
+
+    def test_noop_settings_update_skips_write(self):
+        url = reverse("update_theme_settings", args=[self.user.id])
+        payload = json.dumps({"skin": "flat", "font_family": "mono"})
+        first = self.client.put(url, data=payload, content_type="application/json")
+        self.assertEqual(first.json()["changed_fields"], ["skin", "font_family"])
+        updated_at = UserThemeSettings.objects.get(user=self.user).updated_at
+
+        with self.assertNumQueries(2):  # user + settings row, nothing written
+            again = self.client.put(url, data=payload, content_type="application/json")
+        self.assertEqual(again.json()["changed_fields"], [])
+        self.assertEqual(again.json()["skin"], "flat")
+        self.assertEqual(UserThemeSettings.objects.get(user=self.user).updated_at, updated_at)
+
     def test_update_user_success(self):
         url = reverse("update_user", args=[self.user.id])
         resp = self.client.put(
@@ -132,13 +172,13 @@ class UserViewTests(TestCase):
         payload = resp.json()
         self.assertIn("profile_picture", payload)
 
-    def test_notifications_get_creates_defaults(self):
+    def test_notifications_get_returns_defaults_without_writing(self):
         url = reverse("get_notification_settings", args=[self.user.id])
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertTrue(data["push_messages"])
-        self.assertTrue(
+        self.assertFalse(
             UserNotificationSettings.objects.filter(user=self.user).exists()
         )
 
@@ -160,13 +200,13 @@ class UserViewTests(TestCase):
         self.assertFalse(data["push_messages"])
         self.assertTrue(data["push_comments"])
 
-    def test_theme_get_creates_defaults(self):
+    def test_theme_get_returns_defaults_without_writing(self):
         url = reverse("get_theme_settings", args=[self.user.id])
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["skin"], "material")
-        self.assertTrue(
+        self.assertFalse(
             UserThemeSettings.objects.filter(user=self.user).exists()
         )
 
@@ -186,13 +226,13 @@ class UserViewTests(TestCase):
         self.assertEqual(data["primary_color"], "#123abc")
         self.assertEqual(data["font_family"], "serif")
 
-    def test_privacy_get_creates_defaults(self):
+    def test_privacy_get_returns_defaults_without_writing(self):
         url = reverse("get_privacy_settings", args=[self.user.id])
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertEqual(data["profile_visibility"], "public")
-        self.assertTrue(
+        self.assertFalse(
             UserPrivacySettings.objects.filter(user=self.user).exists()
         )
 
@@ -211,3 +251,237 @@ class UserViewTests(TestCase):
         self.assertEqual(data["profile_visibility"], "private")
         self.assertTrue(data["show_email"])
 
+
+
+class PreferencesViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email="prefs@example.com",
+            first_name="Pref",
+            last_name="User",
+        )
+
+    def test_preferences_single_query_with_defaults(self):
+        url = reverse("get_preferences", args=[self.user.id])
+        with self.assertNumQueries(1):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["user"]["email"], "prefs@example.com")
+        self.assertTrue(data["notifications"]["email_news"])
+        self.assertEqual(data["theme"]["skin"], "material")
+        self.assertEqual(data["privacy"]["profile_visibility"], "public")
+        self.assertFalse(
+            UserNotificationSettings.objects.filter(user=self.user).exists()
+        )
+
+    def test_preferences_reflects_saved_settings(self):
+        UserThemeSettings.objects.create(user=self.user, skin="contrast")
+        url = reverse("get_preferences", args=[self.user.id])
+        with self.assertNumQueries(1):
+            resp = self.client.get(url)
+        self.assertEqual(resp.json()["theme"]["skin"], "contrast")
+
+    def test_preferences_etag_changes_and_304(self):
+        url = reverse("get_preferences", args=[self.user.id])
+        etag = self.client.get(url)["ETag"]
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        UserPrivacySettings.objects.create(user=self.user, show_email=True)
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+
+    def test_preferences_missing_user(self):
+        resp = self.client.get(reverse("get_preferences", args=[999]))
+        self.assertEqual(resp.status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    read_routes = (
+        "get_user",
+        "get_notification_settings",
+        "get_theme_settings",
+        "get_privacy_settings",
+        "get_preferences",
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email="etag@example.com", first_name="Etag", last_name="User"
+        )
+
+    def test_read_endpoints_send_validators(self):
+        for name in self.read_routes:
+            resp = self.client.get(reverse(name, args=[self.user.id]))
+            self.assertEqual(resp.status_code, 200, name)
+            self.assertTrue(resp["ETag"].startswith('"'), name)
+            self.assertIn("Last-Modified", resp, name)
+
+    def test_if_none_match_returns_304_without_queries(self):
+        for name in self.read_routes[:4]:
+            url = reverse(name, args=[self.user.id])
+            etag = self.client.get(url)["ETag"]
+            with self.assertNumQueries(0):
+                resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 304, name)
+            self.assertEqual(resp.content, b"")
+            self.assertEqual(resp["ETag"], etag)
+
+    def test_if_modified_since_returns_304(self):
+        url = reverse("get_theme_settings", args=[self.user.id])
+        last_modified = self.client.get(url)["Last-Modified"]
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_update_changes_etag(self):
+        url = reverse("get_privacy_settings", args=[self.user.id])
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                reverse("update_privacy_settings", args=[self.user.id]),
+                data=json.dumps({"show_email": True}),
+                content_type="application/json",
+            )
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()["show_email"])
+
+
+class BulkPreferencesViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="bulk@example.com", first_name="Bulk", last_name="User"
+        )
+        self.url = reverse("bulk_preferences")
+
+    def test_bulk_preferences(self):
+        resp = self.client.post(
+            self.url,
+            data=json.dumps({"user_ids": [self.user.id, 424242]}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(
+            data["results"][str(self.user.id)]["theme"]["skin"], "material"
+        )
+        self.assertEqual(data["missing"], [424242])
+
+    def test_bulk_preferences_invalid_ids(self):
+        resp = self.client.post(
+            self.url,
+            data=json.dumps({"user_ids": ["1"]}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["error"]["code"], "invalid_user_ids")
+
+    def test_bulk_preferences_requires_post(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+class BulkUpdatePreferencesViewTests(TestCase):
+    def test_bulk_update_preferences(self):
+        user = User.objects.create(
+            email="bulkw@example.com", first_name="Bulk", last_name="Writer"
+        )
+        resp = self.client.post(
+            reverse("bulk_update_preferences"),
+            data=json.dumps(
+                {
+                    "items": [
+                        {"user_id": user.id, "theme": {"skin": "flat"}},
+                        {"user_id": user.id, "theme": {"primary_color": "#12345678"}},
+                    ]
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(data["errors"][0]["index"], 1)
+        self.assertEqual(UserThemeSettings.objects.get(user=user).skin, "flat")
+
+    def test_bulk_update_preferences_invalid_body(self):
+        resp = self.client.post(
+            reverse("bulk_update_preferences"),
+            data=json.dumps({"items": {}}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["error"]["code"], "invalid_items")
+
+
+@override_settings(EXPORT_API_TOKEN="export-secret")
+class ExportViewTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(
+                email=f"export{i}@example.com", first_name="Export", last_name=str(i)
+            )
+            for i in range(3)
+        ]
+        UserThemeSettings.objects.create(user=self.users[1], skin="mini")
+        self.url = reverse("export_users")
+        self.auth = {"HTTP_AUTHORIZATION": "Bearer export-secret"}
+
+    def test_export_requires_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        resp = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(resp.status_code, 403)
+
+    def test_export_ndjson(self):
+        resp = self.client.get(self.url, **self.auth)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        lines = b"".join(resp.streaming_content).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r["id"] for r in records], [u.id for u in self.users])
+        self.assertEqual(records[1]["theme"]["skin"], "mini")
+        self.assertNotIn("password", records[0])
+        self.assertIn("X-Export-Cursor", resp)
+
+    def test_export_csv(self):
+        resp = self.client.get(self.url, {"format": "csv"}, **self.auth)
+        rows = b"".join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertIn("theme.skin", rows[0].split(","))
+        self.assertIn("mini", rows[2])
+
+    def test_export_csv_header_is_fixed(self):
+        # Only a later user has thumbnails, and with sizes of its own
+        User.objects.filter(pk=self.users[1].pk).update(
+            profile_picture_variants={"40": "pictures/a-40.webp"}
+        )
+        User.objects.filter(pk=self.users[2].pk).update(
+            profile_picture_variants={"80": "pictures/b-80.webp"}
+        )
+        resp = self.client.get(self.url, {"format": "csv"}, **self.auth)
+        text = b"".join(resp.streaming_content).decode()
+        reader = csv.DictReader(io.StringIO(text))
+        rows = list(reader)
+        self.assertEqual(reader.fieldnames, export.CSV_HEADER)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(json.loads(rows[0]["profile_picture_variants"]), {})
+        self.assertEqual(list(json.loads(rows[2]["profile_picture_variants"])), ["80"])
+
+    def test_export_since_cursor(self):
+        cursor = self.client.get(self.url, **self.auth)["X-Export-Cursor"]
+        UserPrivacySettings.objects.create(user=self.users[2], show_email=True)
+        resp = self.client.get(self.url, {"since": cursor}, **self.auth)
+        records = [
+            json.loads(line)
+            for line in b"".join(resp.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual([r["id"] for r in records], [self.users[2].id])
+
+    def test_export_invalid_params(self):
+        resp = self.client.get(self.url, {"format": "xml"}, **self.auth)
+        self.assertEqual(resp.json()["error"]["code"], "invalid_format")
+        resp = self.client.get(self.url, {"since": "yesterday"}, **self.auth)
+        self.assertEqual(resp.json()["error"]["code"], "invalid_since")
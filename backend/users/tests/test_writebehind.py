@@ -0,0 +1,153 @@
+import json
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users import cache, writebehind
+from users.models import User, UserNotificationSettings, UserThemeSettings
+
+
+@override_settings(WRITE_BEHIND_WINDOW=60, WRITE_BEHIND_MAX_USERS=100)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        writebehind.stats.reset()
+        self.addCleanup(self.flush)
+        self.user = User.objects.create(email="toggles@example.com")
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return writebehind.flush()
+
+    def put(self, name, payload):
+        return self.client.put(
+            reverse(name, args=[self.user.id]),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_toggles_are_coalesced_into_one_flush(self):
+        for field in ("push_messages", "email_news", "push_messages"):
+            resp = self.put("update_notification_settings", {field: False})
+            self.assertEqual(resp.status_code, 200)
+        self.assertFalse(UserNotificationSettings.objects.filter(user=self.user).exists())
+
+        self.assertEqual(self.flush(), 1)
+        settings = UserNotificationSettings.objects.get(user=self.user)
+        self.assertFalse(settings.push_messages)
+        self.assertFalse(settings.email_news)
+        self.assertTrue(settings.push_comments)
+        self.assertEqual(writebehind.stats.as_dict()["flushes"], 1)
+
+    def test_reads_see_buffered_changes(self):
+        url = reverse("get_theme_settings", args=[self.user.id])
+        before = self.client.get(url)
+
+        self.put("update_theme_settings", {"skin": "mini"})
+
+        after = self.client.get(url)
+        self.assertEqual(after.json()["skin"], "mini")
+        self.assertNotEqual(after["ETag"], before["ETag"])
+        preferences = self.client.get(reverse("get_preferences", args=[self.user.id]))
+        self.assertEqual(preferences.json()["theme"]["skin"], "mini")
+
+    def test_changes_are_relative_to_buffered_values(self):
+        first = self.put("update_theme_settings", {"skin": "mini"})
+        second = self.put("update_theme_settings", {"skin": "mini"})
+        self.assertEqual(first.json()["changed_fields"], ["skin"])
+        self.assertEqual(second.json()["changed_fields"], [])
+
+    def test_if_match_updates_can_be_chained(self):
+        first = self.put("update_theme_settings", {"skin": "mini"})
+        get = self.client.get(reverse("get_theme_settings", args=[self.user.id]))
+        self.assertEqual(get["ETag"], first["ETag"])
+
+        resp = self.client.put(
+            reverse("update_theme_settings", args=[self.user.id]),
+            data=json.dumps({"skin": "flat"}),
+            content_type="application/json",
+            headers={"if-match": first["ETag"]},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["changed_fields"], ["skin"])
+
+    def test_if_match_survives_the_flush(self):
+        UserThemeSettings.objects.create(user=self.user)
+        for name, first, second in (
+            # No row yet: the flush creates it
+            ("update_notification_settings", {"email_news": False}, {"email_news": True}),
+            ("update_theme_settings", {"skin": "mini"}, {"skin": "flat"}),
+        ):
+            with self.subTest(name=name):
+                etag = self.put(name, first)["ETag"]
+                self.flush()
+                url = reverse(name.replace("update_", "get_"), args=[self.user.id])
+                self.assertEqual(self.client.get(url)["ETag"], etag)
+                resp = self.client.put(
+                    reverse(name, args=[self.user.id]),
+                    data=json.dumps(second),
+                    content_type="application/json",
+                    headers={"if-match": etag},
+                )
+                self.assertEqual(resp.status_code, 200)
+
+    @override_settings(COMPACT_PREFERENCE_FLAGS=True)
+    def test_if_match_survives_a_flags_flush(self):
+        etag = self.put("update_notification_settings", {"email_news": False})["ETag"]
+        self.flush()
+        url = reverse("get_notification_settings", args=[self.user.id])
+        self.assertEqual(self.client.get(url)["ETag"], etag)
+
+    def test_changes_failing_bulk_validation_are_written_directly(self):
+        self.put("update_notification_settings", {"email_news": False})
+        self.put("update_theme_settings", {"skin": "unlisted"})
+
+        self.assertEqual(UserThemeSettings.objects.get(user=self.user).skin, "unlisted")
+        # The buffer was flushed first to keep the writes in order
+        self.assertFalse(UserNotificationSettings.objects.get(user=self.user).email_news)
+
+    def test_failed_flush_is_retried(self):
+        self.put("update_theme_settings", {"skin": "flat", "font_family": "serif"})
+
+        def fail(items, stamps=None):
+            # A change buffered while the batch is being written
+            writebehind.submit(self.user.id, "theme", {"skin": "mini"})
+            raise DatabaseError("database is locked")
+
+        with mock.patch("users.writebehind.bulk_update_settings", side_effect=fail):
+            with self.assertRaises(DatabaseError):
+                writebehind.flush()
+        self.assertIsNotNone(writebehind._timer)
+        data = self.client.get(reverse("get_theme_settings", args=[self.user.id])).json()
+        self.assertEqual((data["skin"], data["font_family"]), ("mini", "serif"))
+
+        self.assertEqual(self.flush(), 1)
+        settings = UserThemeSettings.objects.get(user=self.user)
+        self.assertEqual((settings.skin, settings.font_family), ("mini", "serif"))
+
+    @override_settings(WRITE_BEHIND_MAX_USERS=1)
+    def test_full_buffer_flushes_inline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.put("update_theme_settings", {"skin": "flat"})
+        self.assertEqual(UserThemeSettings.objects.get(user=self.user).skin, "flat")
+
+    def test_shutdown_flushes(self):
+        self.put("update_theme_settings", {"skin": "willow"})
+        with self.captureOnCommitCallbacks(execute=True):
+            writebehind.shutdown()
+        self.assertEqual(UserThemeSettings.objects.get(user=self.user).skin, "willow")
+
+    @override_settings(ROOT_URLCONF="users.tests.async_urlconf")
+    async def test_async_updates_are_buffered(self):
+        resp = await self.async_client.put(
+            reverse("update_theme_settings", args=[self.user.id]),
+            data=json.dumps({"skin": "compact"}),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["changed_fields"], ["skin"])
+        self.assertFalse(await UserThemeSettings.objects.filter(user=self.user).aexists())
+
+        resp = await self.async_client.get(reverse("get_theme_settings", args=[self.user.id]))
+        self.assertEqual(resp.json()["skin"], "compact")
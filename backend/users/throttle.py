@@ -0,0 +1,182 @@
+"""
+Token-bucket throttling of expensive routes (``middleware.ThrottleMiddleware``).
+
+A request to a route listed in ``THROTTLE_COSTS`` takes that many tokens
+from two buckets: the one of the user it targets (the ``pk`` in the URL)
+and the one of the client address (``REMOTE_ADDR``; have the proxy set it).
+Each bucket holds up to ``capacity`` tokens and refills at ``rate`` tokens
+per second (``THROTTLE_USER_BUCKET`` / ``THROTTLE_IP_BUCKET``), so a client
+gets a burst of ``capacity / cost`` requests and then one every
+``cost / rate`` seconds. When either bucket is short, nothing is taken and
+the request is answered 429 with the seconds until it would pass as
+``Retry-After``. Routes without a cost are never throttled.
+
+Buckets live in a per-process store split into ``THROTTLE_SHARDS`` shards,
+each with its own lock and LRU dict (at most ``THROTTLE_MAX_KEYS`` buckets
+in all; forgetting an idle bucket only refills it early), so taking tokens
+is O(1) and concurrent requests rarely wait on the same lock. Set
+``THROTTLE_CACHE`` to a cache alias shared by the workers (Redis,
+memcached) to throttle across processes. The cache has no compare-and-swap:
+updates within a process are serialized, but two processes updating the
+same bucket at the same instant may both pass.
+"""
+import math
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = "throttle"
+
+
+def refill(bucket, capacity, rate, now):
+    """Tokens in ``bucket`` (``(tokens, stamp)`` or None for a new one) at ``now``."""
+    if bucket is None:
+        return capacity
+    tokens, stamp = bucket
+    return min(capacity, tokens + max(now - stamp, 0.0) * rate)
+
+
+def wait_for(tokens, cost, rate):
+    """Seconds until ``tokens`` grow to ``cost``."""
+    return (cost - tokens) / rate if rate > 0 else math.inf
+
+
+class Shard:
+    def __init__(self):
+        self.lock = Lock()
+        # key -> (tokens, stamp), least recently used first
+        self.buckets = OrderedDict()
+
+
+class LocalStore:
+    """Buckets of this process, lock-striped over ``shards`` shards."""
+
+    def __init__(self, shards, max_keys):
+        self.shards = [Shard() for _ in range(shards)]
+        self.max_per_shard = max(max_keys // shards, 1)
+
+    def _shard(self, key):
+        return self.shards[zlib.crc32(key.encode()) % len(self.shards)]
+
+    def take(self, key, cost, capacity, rate):
+        """Take ``cost`` tokens; returns 0, or the seconds to wait (nothing taken)."""
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            tokens = refill(shard.buckets.get(key), capacity, rate, now)
+            if tokens < cost:
+                return wait_for(tokens, cost, rate)
+            shard.buckets[key] = (tokens - cost, now)
+            shard.buckets.move_to_end(key)
+            if len(shard.buckets) > self.max_per_shard:
+                shard.buckets.popitem(last=False)
+        return 0.0
+
+    def refund(self, key, cost, capacity, rate):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            if key in shard.buckets:
+                tokens = refill(shard.buckets[key], capacity, rate, now)
+                shard.buckets[key] = (min(capacity, tokens + cost), now)
+
+
+class CacheStore:
+    """Buckets in a Django cache shared by the worker processes."""
+
+    def __init__(self, alias, locks):
+        self.cache = caches[alias]
+        # Serializes read-modify-write cycles of this process
+        self.locks = locks
+
+    def _lock(self, key):
+        return self.locks[zlib.crc32(key.encode()) % len(self.locks)]
+
+    def _timeout(self, capacity, rate):
+        # Once full, a bucket is the same as a missing one
+        return math.ceil(capacity / rate) + 1 if rate > 0 else None
+
+    def take(self, key, cost, capacity, rate):
+        cache_key = f"{KEY_PREFIX}:{key}"
+        now = time.time()
+        with self._lock(key):
+            tokens = refill(self.cache.get(cache_key), capacity, rate, now)
+            if tokens < cost:
+                return wait_for(tokens, cost, rate)
+            self.cache.set(cache_key, (tokens - cost, now), self._timeout(capacity, rate))
+        return 0.0
+
+    def refund(self, key, cost, capacity, rate):
+        cache_key = f"{KEY_PREFIX}:{key}"
+        now = time.time()
+        with self._lock(key):
+            bucket = self.cache.get(cache_key)
+            if bucket is not None:
+                tokens = min(capacity, refill(bucket, capacity, rate, now) + cost)
+                self.cache.set(cache_key, (tokens, now), self._timeout(capacity, rate))
+
+
+_store_lock = Lock()
+_local = None
+
+
+def get_store():
+    global _local
+    if _local is None:
+        with _store_lock:
+            if _local is None:
+                _local = LocalStore(settings.THROTTLE_SHARDS, settings.THROTTLE_MAX_KEYS)
+    if settings.THROTTLE_CACHE:
+        return CacheStore(settings.THROTTLE_CACHE, [shard.lock for shard in _local.shards])
+    return _local
+
+
+def reset():
+    """Forget every bucket of this process (tests)."""
+    global _local
+    with _store_lock:
+        _local = None
+
+
+def cost_of(route):
+    return settings.THROTTLE_COSTS.get(route, 0)
+
+
+def take(route, user_id, address):
+    """
+    Charge a request to ``route`` for ``user_id`` and ``address`` (either may
+    be None). Returns 0 when it may proceed, otherwise the seconds to wait.
+    """
+    cost = cost_of(route)
+    if not cost:
+        return 0.0
+    store = get_store()
+    buckets = []
+    if user_id is not None:
+        buckets.append((f"user:{user_id}", *settings.THROTTLE_USER_BUCKET))
+    if address:
+        buckets.append((f"ip:{address}", *settings.THROTTLE_IP_BUCKET))
+
+    taken = []
+    for key, capacity, rate in buckets:
+        # A cost above the capacity would never pass; it takes a full bucket
+        charge = min(cost, capacity)
+        wait = store.take(key, charge, capacity, rate)
+        if wait:
+            # All or nothing: give back what the other bucket lent
+            for taken_key, taken_charge, taken_capacity, taken_rate in taken:
+                store.refund(taken_key, taken_charge, taken_capacity, taken_rate)
+            return wait
+        taken.append((key, charge, capacity, rate))
+    return 0.0
+
+
+def retry_after(wait):
+    """``Retry-After`` seconds for a wait (at least 1)."""
+    if math.isinf(wait):
+        return 3600
+    return max(math.ceil(wait), 1)
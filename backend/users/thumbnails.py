@@ -0,0 +1,139 @@
+"""
+Background generation of resized profile pictures.
+
+``schedule`` queues an uploaded picture on a small thread pool
+(``THUMBNAIL_WORKERS``; 0 runs the job inline). Each job decodes the original
+once, produces square variants for every edge size in ``THUMBNAIL_SIZES``
+(largest first, each resized from the previous one) re-encoded as
+``THUMBNAIL_FORMAT``, stores them next to the original and records their
+names in ``User.profile_picture_variants``. Variant names derive from the
+content-addressed original (users/storage.py), so a picture already rendered
+for another user is not decoded again. Until a job finishes, payloads only
+carry the original picture URL.
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import invalidate
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+VARIANT_NAME = re.compile(r"^(?P<owner>.+)\.(?P<size>\d+)\.(?P<format>[a-z]+)$")
+
+_lock = Lock()
+_executor = None
+
+
+def variant_name(name, size):
+    """``profile_pictures/3f/3fa9...png`` -> ``profile_pictures/3f/3fa9...png.40.webp``."""
+    return f"{name}.{size}.{settings.THUMBNAIL_FORMAT.lower()}"
+
+
+def variant_owner(name):
+    """The original a variant name was derived from, or None for non-variants."""
+    match = VARIANT_NAME.match(name)
+    return match.group("owner") if match else None
+
+
+def render_variants(fileobj, sizes):
+    """Return ``{size: encoded_bytes}`` for square crops of the image in ``fileobj``."""
+    sizes = sorted(sizes, reverse=True)
+    with Image.open(fileobj) as image:
+        # Lets the JPEG decoder scale down while decoding
+        image.draft("RGB", (sizes[0], sizes[0]))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        variants = {}
+        for size in sizes:
+            image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, settings.THUMBNAIL_FORMAT, quality=80)
+            variants[size] = buffer.getvalue()
+    return variants
+
+
+def generate_variants(user_id, name):
+    """
+    Render and store the variants of picture ``name`` for ``user_id``.
+    Returns True if they were attached to the user.
+    """
+    storage = User._meta.get_field("profile_picture").storage
+    names = {str(size): variant_name(name, size) for size in settings.THUMBNAIL_SIZES}
+    try:
+        # Names are content-derived: variants already rendered for another
+        # user with the same picture are reused as they are
+        if not all(storage.exists(variant) for variant in names.values()):
+            with storage.open(name) as fh:
+                rendered = render_variants(fh, settings.THUMBNAIL_SIZES)
+            for size, data in rendered.items():
+                storage.save(names[str(size)], ContentFile(data))
+
+        # Only attach the variants if the user still has this picture;
+        # unreferenced files are left to manage.py gc_media
+        updated = User.objects.filter(pk=user_id, profile_picture=name).update(
+            profile_picture_variants=names, updated_at=timezone.now(), version=F("version") + 1
+        )
+        if updated:
+            invalidate(User, user_id)
+        return bool(updated)
+    except UnidentifiedImageError:
+        logger.info("Skipping variants for %s: not a decodable image", name)
+    except Exception:
+        logger.exception("Could not generate variants for %s", name)
+    return False
+
+
+def _run_in_worker(user_id, name):
+    # Worker threads manage their own DB connections, like request threads do
+    close_old_connections()
+    try:
+        generate_variants(user_id, name)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix="thumbnails"
+            )
+        return _executor
+
+
+def schedule(user):
+    """
+    Queue variant generation for ``user``'s current profile picture. Inline
+    jobs reload ``user``, so responses built from it match the updated row.
+    """
+    if not user.profile_picture:
+        return None
+    if not settings.THUMBNAIL_WORKERS:
+        if generate_variants(user.pk, user.profile_picture.name):
+            user.refresh_from_db(
+                using=user._state.db, fields=["profile_picture_variants", "updated_at", "version"]
+            )
+            user.track_changes(["profile_picture_variants"])
+        return None
+    return _get_executor().submit(_run_in_worker, user.pk, user.profile_picture.name)
+
+
+def shutdown(wait=True):
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+        _executor = None
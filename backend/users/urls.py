@@ -1,27 +1,25 @@
 from django.urls import path
-from .views import (
-    get_user,
-    update_user,
-    update_profile_picture,
-    get_notification_settings,
-    update_notification_settings,
-    get_theme_settings,
-    update_theme_settings,
-    get_privacy_settings,
-    update_privacy_settings,
-    update_password,
-)
+from . import views
 
-urlpatterns = [
-    path("<int:pk>/", get_user, name="get_user"),
-    path("<int:pk>/update/", update_user, name="update_user"),
-    path("<int:pk>/profile-picture/", update_profile_picture, name="update_profile_picture"),
-    path("<int:pk>/notifications/", get_notification_settings, name="get_notification_settings"),
-    path("<int:pk>/notifications/update/", update_notification_settings, name="update_notification_settings"),
-    path("<int:pk>/theme/", get_theme_settings, name="get_theme_settings"),
-    path("<int:pk>/theme/update/", update_theme_settings, name="update_theme_settings"),
-    path("<int:pk>/privacy/", get_privacy_settings, name="get_privacy_settings"),
-    path("<int:pk>/privacy/update/", update_privacy_settings, name="update_privacy_settings"),
-    path("<int:pk>/password/update/", update_password, name="update_password"),
-]
 
+def build_urlpatterns(views):
+    """URL patterns for a views module (``views`` or ``async_views``)."""
+    return [
+        path("export/", views.export_users, name="export_users"),
+        path("preferences/bulk/", views.bulk_preferences, name="bulk_preferences"),
+        path("preferences/bulk/update/", views.bulk_update_preferences, name="bulk_update_preferences"),
+        path("<int:pk>/", views.get_user, name="get_user"),
+        path("<int:pk>/update/", views.update_user, name="update_user"),
+        path("<int:pk>/profile-picture/", views.update_profile_picture, name="update_profile_picture"),
+        path("<int:pk>/notifications/", views.get_notification_settings, name="get_notification_settings"),
+        path("<int:pk>/notifications/update/", views.update_notification_settings, name="update_notification_settings"),
+        path("<int:pk>/theme/", views.get_theme_settings, name="get_theme_settings"),
+        path("<int:pk>/theme/update/", views.update_theme_settings, name="update_theme_settings"),
+        path("<int:pk>/privacy/", views.get_privacy_settings, name="get_privacy_settings"),
+        path("<int:pk>/privacy/update/", views.update_privacy_settings, name="update_privacy_settings"),
+        path("<int:pk>/password/update/", views.update_password, name="update_password"),
+        path("<int:pk>/preferences/", views.get_preferences, name="get_preferences"),
+    ]
+
+
+urlpatterns = build_urlpatterns(views)
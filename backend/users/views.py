@@ -1,10 +1,41 @@
+import hashlib
+import hmac
 import json
-from django.http import JsonResponse, Http404, HttpResponseBadRequest
-from django.contrib.auth.hashers import check_password, make_password
+from django.conf import settings as django_settings
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
 from django.core.validators import EmailValidator
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from .models import User, UserNotificationSettings, UserThemeSettings, UserPrivacySettings
+from django.db import IntegrityError, transaction
+from . import hashing, thumbnails, writebehind
+from .cache import read_through
+from .export import EXPORT_FORMATS, iter_export
+from .renderers import JsonResponse
+from .routers import replica_reads
+from .models import (
+    User,
+    UserNotificationSettings,
+    UserPrivacySettings,
+    UserThemeSettings,
+    VersionConflict,
+)
+from .serializers import (
+    serialize_notification_settings,
+    serialize_privacy_settings,
+    serialize_theme_settings,
+    serialize_user,
+)
+from .services import (
+    SETTINGS_RELATIONS,
+    bulk_update_settings,
+    get_bulk_preferences,
+    save_settings,
+    settings_or_default,
+    settings_or_defaults,
+)
 
 
 def bad_request(message: str, code: str = None, fields: dict = None):
@@ -20,20 +51,242 @@ def bad_request(message: str, code: str = None, fields: dict = None):
     )
 
 
+def forbidden(message: str, code: str = None):
+    return JsonResponse(
+        {
+            "error": {
+                "message": message,
+                "code": code,
+                "fields": {},
+            }
+        },
+        status=403,
+    )
+
+
+def too_many_requests(message: str, code: str = None, retry_after: int = 1):
+    response = JsonResponse(
+        {
+            "error": {
+                "message": message,
+                "code": code,
+                "fields": {},
+            }
+        },
+        status=429,
+    )
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def precondition_failed(
+    message: str = "Resource was modified; reload it and retry",
+    code: str = "version_conflict",
+):
+    return JsonResponse(
+        {
+            "error": {
+                "message": message,
+                "code": code,
+                "fields": {},
+            }
+        },
+        status=412,
+    )
+
+
+def parse_json_body(request):
+    """Return ``(payload, None)``, or ``(None, error_response)`` for invalid JSON."""
+    try:
+        body = request.body.decode() or "{}"
+        return json.loads(body), None
+    except json.JSONDecodeError:
+        return None, bad_request("Invalid JSON", code="invalid_json")
+
+
+def apply_user_changes(user, payload):
+    """Copy allowed fields from payload onto user; return an error response or None."""
+    for field in ("email", "first_name", "last_name"):
+        if field in payload:
+            if field == "email":
+                validator = EmailValidator()
+                try:
+                    validator(payload[field])
+                except ValidationError:
+                    return bad_request("Invalid email address", code="invalid_email")
+            setattr(user, field, payload[field])
+    return None
+
+
+def uploaded_profile_picture(request):
+    # Webix uploader sends as "upload" by default
+    for name in ("upload", "file", "profile_picture"):
+        if name in request.FILES:
+            return request.FILES[name]
+    return None
+
+
+def apply_notification_changes(settings, payload):
+    allowed_fields = (
+        "push_messages", "push_comments", "push_reminders",
+        "email_news", "email_messages", "email_reminders"
+    )
+    for field in allowed_fields:
+        if field in payload:
+            setattr(settings, field, bool(payload[field]))
+
+
+def apply_theme_changes(settings, payload):
+    allowed_fields = ("skin", "primary_color", "font_family")
+    for field in allowed_fields:
+        if field in payload:
+            setattr(settings, field, payload[field])
+
+
+def apply_privacy_changes(settings, payload):
+    if "profile_visibility" in payload:
+        profile_visibility = payload["profile_visibility"]
+        # Validate the value is one of the allowed choices
+        valid_choices = ['public', 'friends', 'private']
+        if profile_visibility in valid_choices:
+            settings.profile_visibility = profile_visibility
+
+    if "show_email" in payload:
+        settings.show_email = bool(payload["show_email"])
+
+    if "data_sharing" in payload:
+        settings.data_sharing = bool(payload["data_sharing"])
+
+
+def parse_password_payload(request):
+    """
+    Return ``(current_password, new_password, None)``, or
+    ``(None, None, error_response)`` when the body is invalid, incomplete or
+    the new password and its confirmation differ.
+    """
+    try:
+        body = request.body.decode() or "{}"
+        payload = json.loads(body)
+    except json.JSONDecodeError:
+        return None, None, HttpResponseBadRequest("Invalid JSON")
+
+    required_fields = ("current_password", "new_password", "confirm_password")
+    if not all(field in payload and payload[field] for field in required_fields):
+        return None, None, HttpResponseBadRequest("Missing password fields")
+
+    if payload["new_password"] != payload["confirm_password"]:
+        return None, None, HttpResponseBadRequest(
+            "New password and confirmation do not match"
+        )
+    return payload["current_password"], payload["new_password"], None
+
+
+def updated_response(payload, changed, instances=()):
+    """
+    Response for an update: the resource plus ``changed_fields``, the names of
+    the fields the request actually changed (empty when nothing was written).
+    The ``ETag`` of ``instances`` lets clients chain ``If-Match`` updates.
+    """
+    response = JsonResponse({**payload, "changed_fields": changed})
+    if instances:
+        response["ETag"] = etag_for(instances)
+    return response
+
+
+def etag_for(instances):
+    """Strong ETag of ``instances``, derived from their ``updated_at`` values."""
+    # Settings are identified by their user: creating the row keeps the tag
+    fingerprint = "|".join(
+        f"{obj._meta.label_lower}:{getattr(obj, 'user_id', obj.pk)}:"
+        f"{obj.updated_at.isoformat() if obj.updated_at else '-'}"
+        for obj in instances
+    )
+    return quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+
+
+def if_match_passes(request, instances):
+    """
+    True unless the request has an ``If-Match`` header naming none of the
+    current ETags. Weak tags are compared by value, as compressing proxies
+    and middleware weaken the strong tags we send.
+    """
+    header = request.META.get("HTTP_IF_MATCH")
+    if header is None:
+        return True
+    etags = [etag.removeprefix("W/") for etag in parse_etags(header)]
+    return "*" in etags or etag_for(instances) in etags
+
+
+def write_settings(request, model, user, apply_changes, payload):
+    """
+    Apply ``payload`` to the user's ``model`` settings and store the result:
+    buffered in write-behind mode (users/writebehind.py), otherwise written
+    now with a compare-and-swap on the loaded version (a missing row is
+    created). Returns ``(settings, changed_fields, None)``, or
+    ``(None, None, error_response)`` for a failed ``If-Match`` or a
+    concurrent write.
+    """
+    # Defaults without a row are what GET serves; If-Match refers to them
+    settings = writebehind.overlay(settings_or_default(model, user))
+    if not if_match_passes(request, [settings]):
+        return None, None, precondition_failed()
+    apply_changes(settings, payload)
+    if writebehind.enabled():
+        changed = writebehind.buffer(settings)
+        if changed is not None:
+            return settings, changed, None
+        # The buffer was flushed; write on top of the stored state
+        settings = settings_or_default(model, user)
+        apply_changes(settings, payload)
+    if not settings.changed_fields():
+        return settings, [], None
+    try:
+        with transaction.atomic():
+            return settings, save_settings(settings), None
+    except (VersionConflict, IntegrityError):
+        # Row updated, or created, by a concurrent request
+        return None, None, precondition_failed()
+
+
+def modified_at(obj):
+    """``updated_at`` of ``obj``; unsaved settings (defaults) date from their user."""
+    if obj.updated_at is None and obj.pk is None and hasattr(obj, "user_id"):
+        return obj.user.updated_at or obj.user.created_at
+    return obj.updated_at
+
+
+def conditional_json_response(request, instances, build):
+    """
+    Return a JSON response for ``instances`` with a strong ETag and a
+    Last-Modified derived from their ``updated_at`` values.
+
+    Conditional requests (If-None-Match / If-Modified-Since) are answered with
+    304 before ``build()`` is called, so nothing is serialized for them.
+    Unsaved instances (defaults) contribute a fixed marker to the ETag and
+    their user's ``updated_at`` to Last-Modified.
+    """
+    etag = etag_for(instances)
+    stamps = [stamp for stamp in map(modified_at, instances) if stamp]
+    last_modified = int(max(stamps).timestamp()) if stamps else None
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = JsonResponse(build())
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
 def get_user(request, pk: int):
     try:
-        user = User.objects.get(pk=pk)
+        user = read_through(User, pk, lambda: User.objects.get(pk=pk))
     except User.DoesNotExist:
         raise Http404("User not found")
 
-    data = {
-        "id": user.id,
-        "email": user.email,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "profile_picture": user.profile_picture.url if user.profile_picture else None,
-    }
-    return JsonResponse(data)
+    return conditional_json_response(request, [user], lambda: serialize_user(user))
 
 
 def update_user(request, pk: int):
@@ -44,41 +297,29 @@ def update_user(request, pk: int):
     if request.method not in ("PUT", "PATCH", "POST"):
         return bad_request("Unsupported method", code="unsupported_method")
 
-    try:
-        body = request.body.decode() or "{}"
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        return bad_request("Invalid JSON", code="invalid_json")
+    payload, error = parse_json_body(request)
+    if error:
+        return error
 
     try:
         user = User.objects.get(pk=pk)
     except User.DoesNotExist:
         raise Http404("User not found")
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
 
-    # Update allowed fields if present
-    for field in ("email", "first_name", "last_name"):
-        if field in payload:
-            if field == "email":
-                validator = EmailValidator()
-                try:
-                    validator(payload[field])
-                except ValidationError:
-                    return bad_request("Invalid email address", code="invalid_email")
-            setattr(user, field, payload[field])
+    error = apply_user_changes(user, payload)
+    if error:
+        return error
 
     try:
-        user.save()
+        changed = user.save_changes()
     except IntegrityError:
         return bad_request("Email already in use", code="duplicate_email")
+    except VersionConflict:
+        return precondition_failed()
 
-    data = {
-        "id": user.id,
-        "email": user.email,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "profile_picture": user.profile_picture.url if user.profile_picture else None,
-    }
-    return JsonResponse(data)
+    return updated_response(serialize_user(user), changed, [user])
 
 
 def update_profile_picture(request, pk: int):
@@ -94,58 +335,47 @@ def update_profile_picture(request, pk: int):
     except User.DoesNotExist:
         raise Http404("User not found")
 
-    # Check if file was uploaded (Webix uploader sends as "upload" by default)
-    if "upload" in request.FILES:
-        user.profile_picture = request.FILES["upload"]
-    elif "file" in request.FILES:
-        user.profile_picture = request.FILES["file"]
-    elif "profile_picture" in request.FILES:
-        user.profile_picture = request.FILES["profile_picture"]
-    else:
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
+
+    upload = uploaded_profile_picture(request)
+    if upload is None:
         return bad_request("No file uploaded", code="missing_file")
+    user.profile_picture = upload
+    # The previous picture's variants no longer apply
+    user.profile_picture_variants = {}
 
-    user.save()
+    try:
+        user.save_changes()
+    except VersionConflict:
+        return precondition_failed()
+    thumbnails.schedule(user)
 
-    data = {
-        "id": user.id,
-        "email": user.email,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "profile_picture": user.profile_picture.url if user.profile_picture else None,
-    }
-    return JsonResponse(data)
+    response = JsonResponse(serialize_user(user))
+    response["ETag"] = etag_for([user])
+    return response
 
 
 def get_notification_settings(request, pk: int):
     """Get notification settings for a user by user ID."""
     try:
-        user = User.objects.get(pk=pk)
+        user = read_through(User, pk, lambda: User.objects.get(pk=pk))
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create notification settings
-    settings, created = UserNotificationSettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'push_messages': True,
-            'push_comments': True,
-            'push_reminders': True,
-            'email_news': True,
-            'email_messages': True,
-            'email_reminders': True,
-        }
+    # Defaults without writing a row; the row is created by the first update
+    settings = read_through(
+        UserNotificationSettings,
+        user.pk,
+        lambda: settings_or_default(UserNotificationSettings, user),
+        field="user_id",
     )
+    # Changes still in the write-behind buffer
+    settings = writebehind.overlay(settings)
     
-    data = {
-        "user_id": settings.user.id,
-        "push_messages": settings.push_messages,
-        "push_comments": settings.push_comments,
-        "push_reminders": settings.push_reminders,
-        "email_news": settings.email_news,
-        "email_messages": settings.email_messages,
-        "email_reminders": settings.email_reminders,
-    }
-    return JsonResponse(data)
+    return conditional_json_response(
+        request, [settings], lambda: serialize_notification_settings(settings)
+    )
 
 
 def update_notification_settings(request, pk: int):
@@ -157,77 +387,44 @@ def update_notification_settings(request, pk: int):
     if request.method not in ("PUT", "PATCH", "POST"):
         return bad_request("Unsupported method", code="unsupported_method")
 
-    try:
-        body = request.body.decode() or "{}"
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        return bad_request("Invalid JSON", code="invalid_json")
+    payload, error = parse_json_body(request)
+    if error:
+        return error
 
     try:
         user = User.objects.get(pk=pk)
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create notification settings
-    settings, created = UserNotificationSettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'push_messages': True,
-            'push_comments': True,
-            'push_reminders': True,
-            'email_news': True,
-            'email_messages': True,
-            'email_reminders': True,
-        }
+    settings, changed, error = write_settings(
+        request, UserNotificationSettings, user, apply_notification_changes, payload
     )
+    if error:
+        return error
 
-    # Update allowed fields if present
-    allowed_fields = (
-        "push_messages", "push_comments", "push_reminders",
-        "email_news", "email_messages", "email_reminders"
-    )
-    for field in allowed_fields:
-        if field in payload:
-            setattr(settings, field, bool(payload[field]))
-
-    settings.save()
-
-    data = {
-        "user_id": settings.user.id,
-        "push_messages": settings.push_messages,
-        "push_comments": settings.push_comments,
-        "push_reminders": settings.push_reminders,
-        "email_news": settings.email_news,
-        "email_messages": settings.email_messages,
-        "email_reminders": settings.email_reminders,
-    }
-    return JsonResponse(data)
+    return updated_response(serialize_notification_settings(settings), changed, [settings])
 
 
 def get_theme_settings(request, pk: int):
     """Get theme settings for a user by user ID."""
     try:
-        user = User.objects.get(pk=pk)
+        user = read_through(User, pk, lambda: User.objects.get(pk=pk))
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create theme settings
-    settings, created = UserThemeSettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'skin': 'material',
-            'primary_color': '#4b7bec',
-            'font_family': 'system',
-        }
+    # Defaults without writing a row; the row is created by the first update
+    settings = read_through(
+        UserThemeSettings,
+        user.pk,
+        lambda: settings_or_default(UserThemeSettings, user),
+        field="user_id",
     )
+    # Changes still in the write-behind buffer
+    settings = writebehind.overlay(settings)
     
-    data = {
-        "user_id": settings.user.id,
-        "skin": settings.skin,
-        "primary_color": settings.primary_color,
-        "font_family": settings.font_family,
-    }
-    return JsonResponse(data)
+    return conditional_json_response(
+        request, [settings], lambda: serialize_theme_settings(settings)
+    )
 
 
 def update_theme_settings(request, pk: int):
@@ -238,68 +435,44 @@ def update_theme_settings(request, pk: int):
     if request.method not in ("PUT", "PATCH", "POST"):
         return bad_request("Unsupported method", code="unsupported_method")
 
-    try:
-        body = request.body.decode() or "{}"
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        return bad_request("Invalid JSON", code="invalid_json")
+    payload, error = parse_json_body(request)
+    if error:
+        return error
 
     try:
         user = User.objects.get(pk=pk)
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create theme settings
-    settings, created = UserThemeSettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'skin': 'material',
-            'primary_color': '#4b7bec',
-            'font_family': 'system',
-        }
+    settings, changed, error = write_settings(
+        request, UserThemeSettings, user, apply_theme_changes, payload
     )
+    if error:
+        return error
 
-    # Update allowed fields if present
-    allowed_fields = ("skin", "primary_color", "font_family")
-    for field in allowed_fields:
-        if field in payload:
-            setattr(settings, field, payload[field])
-
-    settings.save()
-
-    data = {
-        "user_id": settings.user.id,
-        "skin": settings.skin,
-        "primary_color": settings.primary_color,
-        "font_family": settings.font_family,
-    }
-    return JsonResponse(data)
+    return updated_response(serialize_theme_settings(settings), changed, [settings])
 
 
 def get_privacy_settings(request, pk: int):
     """Get privacy settings for a user by user ID."""
     try:
-        user = User.objects.get(pk=pk)
+        user = read_through(User, pk, lambda: User.objects.get(pk=pk))
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create privacy settings
-    settings, created = UserPrivacySettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'profile_visibility': 'public',
-            'show_email': False,
-            'data_sharing': False,
-        }
+    # Defaults without writing a row; the row is created by the first update
+    settings = read_through(
+        UserPrivacySettings,
+        user.pk,
+        lambda: settings_or_default(UserPrivacySettings, user),
+        field="user_id",
     )
+    # Changes still in the write-behind buffer
+    settings = writebehind.overlay(settings)
     
-    data = {
-        "user_id": settings.user.id,
-        "profile_visibility": settings.profile_visibility,
-        "show_email": settings.show_email,
-        "data_sharing": settings.data_sharing,
-    }
-    return JsonResponse(data)
+    return conditional_json_response(
+        request, [settings], lambda: serialize_privacy_settings(settings)
+    )
 
 
 def update_privacy_settings(request, pk: int):
@@ -310,50 +483,22 @@ def update_privacy_settings(request, pk: int):
     if request.method not in ("PUT", "PATCH", "POST"):
         return bad_request("Unsupported method", code="unsupported_method")
 
-    try:
-        body = request.body.decode() or "{}"
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        return bad_request("Invalid JSON", code="invalid_json")
+    payload, error = parse_json_body(request)
+    if error:
+        return error
 
     try:
         user = User.objects.get(pk=pk)
     except User.DoesNotExist:
         raise Http404("User not found")
     
-    # Get or create privacy settings
-    settings, created = UserPrivacySettings.objects.get_or_create(
-        user=user,
-        defaults={
-            'profile_visibility': 'public',
-            'show_email': False,
-            'data_sharing': False,
-        }
+    settings, changed, error = write_settings(
+        request, UserPrivacySettings, user, apply_privacy_changes, payload
     )
+    if error:
+        return error
 
-    # Update allowed fields if present
-    if "profile_visibility" in payload:
-        profile_visibility = payload["profile_visibility"]
-        # Validate the value is one of the allowed choices
-        valid_choices = ['public', 'friends', 'private']
-        if profile_visibility in valid_choices:
-            settings.profile_visibility = profile_visibility
-    
-    if "show_email" in payload:
-        settings.show_email = bool(payload["show_email"])
-    
-    if "data_sharing" in payload:
-        settings.data_sharing = bool(payload["data_sharing"])
-
-    settings.save()
-
-    data = {
-        "user_id": settings.user.id,
-        "profile_visibility": settings.profile_visibility,
-        "show_email": settings.show_email,
-        "data_sharing": settings.data_sharing,
-    }
-    return JsonResponse(data)
+    return updated_response(serialize_privacy_settings(settings), changed, [settings])
 
 
 def update_password(request, pk: int):
@@ -365,22 +510,9 @@ def update_password(request, pk: int):
     if request.method not in ("PUT", "PATCH", "POST"):
         return HttpResponseBadRequest("Unsupported method")
 
-    try:
-        body = request.body.decode() or "{}"
-        payload = json.loads(body)
-    except json.JSONDecodeError:
-        return HttpResponseBadRequest("Invalid JSON")
-
-    required_fields = ("current_password", "new_password", "confirm_password")
-    if not all(field in payload and payload[field] for field in required_fields):
-        return HttpResponseBadRequest("Missing password fields")
-
-    current_password = payload["current_password"]
-    new_password = payload["new_password"]
-    confirm_password = payload["confirm_password"]
-
-    if new_password != confirm_password:
-        return HttpResponseBadRequest("New password and confirmation do not match")
+    current_password, new_password, error = parse_password_payload(request)
+    if error:
+        return error
 
     try:
         user = User.objects.get(pk=pk)
@@ -389,11 +521,175 @@ def update_password(request, pk: int):
 
     if not user.password:
         return bad_request("No existing password set", code="no_password")
+    if not if_match_passes(request, [user]):
+        return precondition_failed()
 
-    if not check_password(current_password, user.password):
+    # Hashing runs in the bounded worker pool (users/hashing.py)
+    try:
+        job = hashing.change_password(current_password, user.password, new_password)
+        matches, new_encoded = hashing.result(job)
+    except hashing.HashingBusy:
+        return too_many_requests("Password service busy, retry shortly", code="hashing_busy")
+    if not matches:
         return bad_request("Current password is incorrect", code="incorrect_current_password")
 
-    user.password = make_password(new_password)
-    user.save()
+    user.password = new_encoded
+    try:
+        user.save_changes()
+    except VersionConflict:
+        return precondition_failed()
+
+    response = JsonResponse({"id": user.id, "message": "Password updated"})
+    response["ETag"] = etag_for([user])
+    return response
 
-    return JsonResponse({"id": user.id, "message": "Password updated"})
+
+def get_preferences(request, pk: int):
+    """
+    Get a user together with their notification, theme and privacy settings.
+    Everything is loaded with a single joined query; settings that have never
+    been saved are reported with their model defaults (nothing is written).
+    Responds with a combined ETag / Last-Modified and honours conditional GETs.
+    """
+    try:
+        user = User.objects.select_related(
+            *(related_name for related_name, _ in SETTINGS_RELATIONS)
+        ).get(pk=pk)
+    except User.DoesNotExist:
+        raise Http404("User not found")
+
+    notifications, theme, privacy = map(writebehind.overlay, settings_or_defaults(user))
+
+    return conditional_json_response(
+        request,
+        [user, notifications, theme, privacy],
+        lambda: {
+            "user": serialize_user(user),
+            "notifications": serialize_notification_settings(notifications),
+            "theme": serialize_theme_settings(theme),
+            "privacy": serialize_privacy_settings(privacy),
+        },
+    )
+
+
+MAX_BULK_USER_IDS = 10000
+
+
+@replica_reads
+def bulk_preferences(request):
+    """
+    Get notification, theme and privacy settings for many users at once.
+    Expects JSON body with: user_ids (list of integers, at most
+    MAX_BULK_USER_IDS). Users without settings rows get the defaults;
+    unknown ids are listed under "missing".
+    """
+    if request.method != "POST":
+        return bad_request("Unsupported method", code="unsupported_method")
+
+    payload, error = parse_json_body(request)
+    if error:
+        return error
+
+    user_ids = payload.get("user_ids") if isinstance(payload, dict) else None
+    if not isinstance(user_ids, list) or not all(
+        isinstance(pk, int) and not isinstance(pk, bool) for pk in user_ids
+    ):
+        return bad_request(
+            "user_ids must be a list of integers",
+            code="invalid_user_ids",
+            fields={"user_ids": "Expected a list of integers"},
+        )
+    if len(user_ids) > MAX_BULK_USER_IDS:
+        return bad_request(
+            f"At most {MAX_BULK_USER_IDS} user_ids per request",
+            code="too_many_user_ids",
+        )
+
+    results = get_bulk_preferences(user_ids)
+    missing = [pk for pk in dict.fromkeys(user_ids) if pk not in results]
+    return JsonResponse(
+        {
+            "results": {str(pk): prefs for pk, prefs in results.items()},
+            "missing": missing,
+        }
+    )
+
+
+MAX_BULK_UPDATE_ITEMS = 10000
+
+
+def bulk_update_preferences(request):
+    """
+    Update settings for many users at once.
+    Expects JSON body with: items, a list (at most MAX_BULK_UPDATE_ITEMS) of
+    {"user_id": ..., "notifications": {...}, "theme": {...}, "privacy": {...}}.
+    Invalid items are reported per index under "errors"; the rest are applied.
+    For larger jobs call users.services.bulk_update_settings directly.
+    """
+    if request.method != "POST":
+        return bad_request("Unsupported method", code="unsupported_method")
+
+    payload, error = parse_json_body(request)
+    if error:
+        return error
+
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return bad_request(
+            "items must be a list",
+            code="invalid_items",
+            fields={"items": "Expected a list of objects"},
+        )
+    if len(items) > MAX_BULK_UPDATE_ITEMS:
+        return bad_request(
+            f"At most {MAX_BULK_UPDATE_ITEMS} items per request",
+            code="too_many_items",
+        )
+
+    return JsonResponse(bulk_update_settings(items))
+
+
+def parse_export_request(request):
+    """
+    Check the token and query params of an export request. Returns
+    ``(export_format, since, error_response)``.
+    """
+    token = getattr(django_settings, "EXPORT_API_TOKEN", None)
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+        return None, None, forbidden("Export requires an admin token", code="forbidden")
+
+    export_format = request.GET.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return None, None, bad_request("Unsupported export format", code="invalid_format")
+
+    since = None
+    if "since" in request.GET:
+        since = parse_datetime(request.GET["since"])
+        if since is None:
+            return None, None, bad_request("Invalid since timestamp", code="invalid_since")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    return export_format, since, None
+
+
+def export_response(chunks, export_format, cursor):
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[export_format])
+    response["X-Export-Cursor"] = cursor.isoformat()
+    response["Content-Disposition"] = f'attachment; filename="users.{export_format}"'
+    return response
+
+
+def export_users(request):
+    """
+    Stream all users with their settings as NDJSON (default) or CSV.
+    Query params: format=ndjson|csv, since=<ISO 8601> for an incremental
+    export. Requires "Authorization: Bearer <EXPORT_API_TOKEN>"; disabled
+    while the setting is empty. The X-Export-Cursor response header is the
+    value to pass as "since" next time.
+    """
+    export_format, since, error = parse_export_request(request)
+    if error:
+        return error
+    cursor = timezone.now()
+    return export_response(iter_export(export_format, since=since), export_format, cursor)
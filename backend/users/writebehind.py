@@ -0,0 +1,227 @@
+"""
+Write-behind coalescing of settings updates.
+
+With ``WRITE_BEHIND_WINDOW`` > 0, settings update views acknowledge changes
+immediately and buffer them in memory, merged per user and group. The first
+buffered change arms a timer; when it fires, every buffered user is written
+with ``services.bulk_update_settings`` (one transaction per chunk of users),
+so a user flipping five switches costs one write instead of five.
+
+Durability: a change is acknowledged before it is written. A process that
+dies without running ``shutdown()`` (registered with ``atexit``) loses at
+most the changes of the last window. A flush that fails puts its changes
+back in the buffer (behind any newer ones) and is retried a window later.
+``WRITE_BEHIND_MAX_USERS`` bounds the buffer: reaching it flushes inline in
+the request that filled it.
+
+Read-your-writes: per-user views pass settings through ``overlay``, which
+applies changes still buffered or being flushed. The buffer is per process,
+so this holds for requests served by the same process; bulk reads and
+exports see changes once flushed. ``If-Match`` is checked against the
+overlaid state, but flushes are plain bulk writes, not compare-and-swap.
+Flushed rows take the time of the user's latest buffered change as
+``updated_at``, so ETags handed out before a flush stay current after it.
+"""
+import copy
+import logging
+from threading import Lock, Timer
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .services import GROUP_NAMES, bulk_update_settings, validate_settings_changes
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindStats:
+    """Per-process counters for buffered changes and flushes."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.buffered = 0
+            self.flushes = 0
+            self.flushed_users = 0
+            self.errors = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "buffered": self.buffered,
+                "flushes": self.flushes,
+                "flushed_users": self.flushed_users,
+                "errors": self.errors,
+            }
+
+
+stats = WriteBehindStats()
+
+_lock = Lock()
+# Serializes flushes, so an older batch never lands after a newer one
+_flush_lock = Lock()
+# user_id -> {group: {field: value}}
+_pending = {}
+# Changes taken by a running flush, still visible to reads until it commits
+_flushing = {}
+# user_id -> time of the user's latest buffered change
+_stamps = {}
+_timer = None
+
+
+def enabled():
+    return settings.WRITE_BEHIND_WINDOW > 0
+
+
+def _arm_timer():
+    # Called with _lock held
+    global _timer
+    if _timer is None:
+        _timer = Timer(settings.WRITE_BEHIND_WINDOW, _flush_in_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def submit(user_id, group, changes):
+    """
+    Buffer ``{field: value}`` changes of ``group`` ("notifications") for a
+    user. Returns the stamp ``overlay`` now gives the user's settings.
+    """
+    with _lock:
+        _pending.setdefault(user_id, {}).setdefault(group, {}).update(changes)
+        stamp = _stamps[user_id] = timezone.now()
+        full = len(_pending) >= settings.WRITE_BEHIND_MAX_USERS
+        if not full:
+            _arm_timer()
+    stats.incr("buffered")
+    if full:
+        flush()
+    return stamp
+
+
+def pending_changes(user_id, group):
+    """Changes of ``group`` for ``user_id`` not yet committed, oldest first."""
+    with _lock:
+        return {
+            **_flushing.get(user_id, {}).get(group, {}),
+            **_pending.get(user_id, {}).get(group, {}),
+        }, _stamps.get(user_id)
+
+
+def overlay(instance):
+    """
+    Return settings ``instance`` with its user's buffered changes applied.
+    A copy is returned when there are any, so cached instances stay intact.
+    """
+    if not enabled():
+        return instance
+    changes, stamp = pending_changes(instance.user_id, GROUP_NAMES[type(instance)])
+    if not changes:
+        return instance
+    instance = copy.copy(instance)
+    instance._saved_values = dict(getattr(instance, "_saved_values", {}))
+    for name, value in changes.items():
+        setattr(instance, name, value)
+    # Buffered values count as stored: updates report changes relative to them
+    instance.track_changes(list(changes))
+    # Gives the buffered state its own ETag / Last-Modified
+    if instance.updated_at is None or instance.updated_at < stamp:
+        instance.updated_at = stamp
+    return instance
+
+
+def buffer(instance):
+    """
+    Buffered counterpart of ``services.save_settings`` for settings loaded
+    with ``overlay`` and then modified: buffer the fields that changed and
+    return their names. Nothing is written here.
+
+    Returns None, after flushing the buffer, if the changes would not pass
+    the bulk write validation; the caller then writes them directly.
+    """
+    changed = instance.changed_fields()
+    if not changed:
+        return changed
+    group = GROUP_NAMES[type(instance)]
+    _, cleaned, errors = validate_settings_changes(
+        {"user_id": instance.user_id, group: {name: getattr(instance, name) for name in changed}}
+    )
+    if errors:
+        # Keep the buffered changes ordered before the direct write
+        flush()
+        return None
+    stamp = submit(instance.user_id, group, cleaned[group])
+    instance.track_changes(changed)
+    # The ETag of the response must be the one reads now serve
+    instance.updated_at = stamp
+    return changed
+
+
+def flush():
+    """Write every buffered change now. Returns the number of users written."""
+    global _timer, _pending, _flushing
+    with _flush_lock:
+        with _lock:
+            if _timer is not None:
+                _timer.cancel()
+                _timer = None
+            batch, _pending = _pending, {}
+            _flushing = batch
+            stamps = {user_id: _stamps[user_id] for user_id in batch}
+        if not batch:
+            return 0
+        try:
+            # Rows keep the stamps reads were served with, so their ETags
+            # stay valid for If-Match across the flush
+            result = bulk_update_settings(
+                [{"user_id": user_id, **groups} for user_id, groups in batch.items()],
+                stamps=stamps,
+            )
+        except Exception:
+            stats.incr("errors")
+            logger.exception("Could not flush buffered settings of %d users", len(batch))
+            with _lock:
+                # Retry later; changes buffered since the batch was taken win
+                for user_id, groups in batch.items():
+                    pending = _pending.setdefault(user_id, {})
+                    for group, changes in groups.items():
+                        pending[group] = {**changes, **pending.get(group, {})}
+                _arm_timer()
+            raise
+        finally:
+            with _lock:
+                _flushing = {}
+                for user_id in batch:
+                    if user_id not in _pending:
+                        _stamps.pop(user_id, None)
+        for error in result["errors"]:
+            stats.incr("errors")
+            logger.warning("Dropped buffered settings change: %s", error)
+        stats.incr("flushes")
+        stats.incr("flushed_users", len(batch))
+        return len(batch)
+
+
+def _flush_in_timer():
+    # Timer threads manage their own DB connections, like request threads do
+    close_old_connections()
+    try:
+        flush()
+    except Exception:
+        pass  # logged by flush(), which buffered the changes again
+    finally:
+        close_old_connections()
+
+
+def shutdown():
+    """Flush buffered changes and stop the timer; call before the process exits."""
+    if _pending:
+        flush()